@@ -0,0 +1,73 @@
+import threading
+
+# Constants
+GENERATION_COUNTERS = {
+    'event': 'event.generation',
+    'execution': 'execution.generation',
+}
+
+
+class CachedResponse(object):
+    def __init__(self, generation, body):
+        """Serialised response body that is valid for one table generation
+
+        :param generation: Generation of the table when the body was built
+        :type generation: int
+        :param body: JSON text of the response
+        :type body: str
+        """
+        self.generation = generation
+        self.body = body
+        self.etag = str(generation)  # ETags are scoped to a URL, so the generation is enough
+
+
+class ResponseCache(object):
+    def __init__(self):
+        """Keeps the serialised responses of endpoints that return the same
+        rows until their table changes
+
+        Every insert or delete bumps the generation counter of its table in the
+        same transaction. The counters live in the database, so a response
+        built by one gunicorn worker is dropped by all of them as soon as any
+        worker changes the table.
+        """
+        self._responses = {}
+        self._lock = threading.Lock()
+
+    def get(self, key, generation):
+        """Gets a cached response if it was built for the current generation
+
+        :param key: Name of the endpoint
+        :type key: str
+        :param generation: Current generation of the table the endpoint reads
+        :type generation: int
+        :return: The cached response or None
+        :rtype: CachedResponse
+        """
+        with self._lock:
+            cached = self._responses.get(key)
+        if cached is None or cached.generation != generation:
+            return None
+        return cached
+
+    def put(self, key, generation, body):
+        """Stores a response built for a generation
+
+        The generation must be read before the rows, so a response that raced
+        with a write is stored under the older generation and rebuilt on the
+        next request instead of being served after the change.
+
+        :return: The stored response
+        :rtype: CachedResponse
+        """
+        cached = CachedResponse(generation, body)
+        with self._lock:
+            current = self._responses.get(key)
+            if current is None or current.generation <= generation:
+                self._responses[key] = cached
+        return cached
+
+    def clear(self):
+        """Drops every cached response"""
+        with self._lock:
+            self._responses.clear()
@@ -1,28 +1,49 @@
 import logging
+import os
+import threading
+import time
 from glob import glob
 
-from flask import Flask, json, request
+from flask import Flask, Response, json, request, stream_with_context
 from flask_cors import CORS
 from flask_restful import Api, Resource, reqparse
 from flask_sqlalchemy import SQLAlchemy
 from gevent.pywsgi import WSGIServer
 from sqlalchemy.exc import IntegrityError, OperationalError
-from sqlalchemy import create_engine
+from sqlalchemy import select
 from sqlalchemy.orm import scoped_session, sessionmaker
 from sqlalchemy.ext.declarative import declarative_base
 
-from db_models import Event, Execution, db
+from db_cache import GENERATION_COUNTERS, ResponseCache
+from db_models import Counter, Event, Execution, db, iso_to_epoch
+from db_retention import RETENTION_CONFIG_FILE, event_summaries_query, load_retention_config, query_archive
+from db_serialise import event_fragment, execution_fragment, json_array, json_text
+from db_schema import migrate
+from db_storage import STORAGE_MODE, DBWriter, create_read_engine, create_write_engine
+from db_stream import ChangeNotifier
 
 # Constants
 DATABASE_NAME = 'core.db'
 HOST = '0.0.0.0'
 DB_PORT = 5000
+MAX_BATCH_SIZE = 5000  # Events per /create_events request
+SQLITE_MAX_VARIABLES = 500  # Keeps IN (...) clauses below the SQLite limit
+REQUIRED_EVENT_FIELDS = ('uuid', 'name', 'type')
+DEFAULT_PAGE_SIZE = 100  # Events per /get_events_since page
+MAX_PAGE_SIZE = 1000
+STREAM_HEARTBEAT = 15  # seconds between keep-alive comments on /stream
+STREAM_TOPICS = ('events', 'executions')
+MAX_STREAMS = 4  # open /stream responses per worker, each holds one of its threads
+STREAM_RETRY_AFTER = 10  # seconds a refused /stream client should wait before reconnecting
+ARCHIVE_DIRECTORY = load_retention_config(RETENTION_CONFIG_FILE)['archive_directory']
 
 # Flask Settings
 app = Flask(__name__)
-app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///{}'.format(DATABASE_NAME)
+# Absolute, as Flask-SQLAlchemy resolves relative SQLite paths against the app directory
+app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///{}'.format(os.path.abspath(DATABASE_NAME))
 app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
-engine = create_engine('sqlite:///{}'.format(DATABASE_NAME), convert_unicode=True)
+engine = create_read_engine(DATABASE_NAME, STORAGE_MODE)
+writer = DBWriter(create_write_engine(DATABASE_NAME, STORAGE_MODE))
 db.session = scoped_session(sessionmaker(autocommit=False,
                                          autoflush=False,
                                          bind=engine,
@@ -51,11 +72,80 @@ def initialise_db(db_name):
     :param db_name: Filename of the database
     :type db_name: str
     """
-    if db_name not in glob('*'):
+    new_database = db_name not in glob('*')
+    if new_database:
         logger.info('Creating new database \'%s\'', db_name)
         db.create_all()
     # else:
         # logger.info('Existing database \'%s\' already exists', db_name)
+    # Runs to completion before any request is served, see db_schema.migrate
+    migrate(engine, new_database)
+    # gunicorn --preload forks after this point, workers must open their own connections
+    engine.dispose()
+
+
+def _next_sequence(conn, name, count):
+    """Reserves count sequence numbers from a named counter. Must run inside a
+    DBWriter transaction so that concurrent writers never get the same numbers
+
+    :param conn: Open database connection
+    :param name: Name of the counter (eg. event)
+    :type name: str
+    :param count: Number of sequence numbers to reserve
+    :type count: int
+    :return: The first of the reserved sequence numbers
+    :rtype: int
+    """
+    counter = Counter.__table__
+    result = conn.execute(counter.update().where(counter.c.name == name).values(value=counter.c.value + count))
+    if result.rowcount == 0:
+        conn.execute(counter.insert(), {'name': name, 'value': count})
+        return 1
+    last = conn.execute(select([counter.c.value]).where(counter.c.name == name)).scalar()
+    return last - count + 1
+
+
+def _current_sequence(name):
+    """Gets the last sequence number handed out by a named counter
+
+    :param name: Name of the counter (eg. event)
+    :type name: str
+    :return: Last sequence number, 0 if none have been handed out
+    :rtype: int
+    """
+    counter = Counter.__table__
+    value = engine.execute(select([counter.c.value]).where(counter.c.name == name)).scalar()
+    return value or 0
+
+
+def _current_sequences():
+    """Gets the last Event and Execution sequence numbers in a single query
+
+    :return: Counter name to last sequence number
+    :rtype: dict
+    """
+    counters = {'event': 0, 'execution': 0}
+    counter = Counter.__table__
+    for name, value in engine.execute(select([counter.c.name, counter.c.value])
+                                      .where(counter.c.name.in_(list(counters.keys())))):
+        counters[name] = value
+    return counters
+
+
+notifier = ChangeNotifier(_current_sequences)
+stream_slots = threading.BoundedSemaphore(MAX_STREAMS)
+response_cache = ResponseCache()
+
+
+def _bump_generation(conn, table_name):
+    """Marks a table as changed so that every worker drops its cached
+    responses for it. Must run inside the DBWriter transaction that changed it
+
+    :param conn: Open database connection
+    :param table_name: 'event' or 'execution'
+    :type table_name: str
+    """
+    _next_sequence(conn, GENERATION_COUNTERS[table_name], 1)
 
 
 def add_event_to_db(event):
@@ -64,22 +154,150 @@ def add_event_to_db(event):
     :param event: Database model that has been filled out
     :type event: db.model object
     """
-    try:
-        engine.execute(Event.__table__.insert(),[{
-            'uuid': event.uuid,
-            'time': event.time,
-            'name': event.name,
-            'type': event.type,
-            'priority': event.priority,
-            'body': event.body,
-        }])
-    except IntegrityError as e:
-        logger.error('UUID might already be in the database (ignoring)\n %s', e)
+    row = {
+        'uuid': event.uuid,
+        'time': event.time,
+        'timestamp': event.timestamp,
+        'name': event.name,
+        'type': event.type,
+        'priority': event.priority,
+        'body': event.body,
+    }
+    existing = writer.execute(_insert_event_rows, {event.uuid: row})
+    notifier.notify()
+    if existing:
+        logger.error('UUID is already in the database (ignoring) %s', event.uuid)
         return False
-    else:
-        logging.info('Sucessfully added Event: {}'.format(event.uuid))
+    logging.info('Sucessfully added Event: {}'.format(event.uuid))
     return True
 
+
+def event_timestamp(event_uuid, time_string):
+    """Gets the epoch timestamp of an Event. Events whose time cannot be read
+    are still stored, as they always were, with the time they arrived at so
+    that they are ordered and expired like the others. Their time column keeps
+    what was sent, which tells them apart
+
+    :param event_uuid: UUID of the Event, for the warning
+    :type event_uuid: str
+    :param time_string: Time of the Event as it was received
+    :type time_string: str
+    :return: Seconds since the epoch, the current time if the time cannot be read
+    :rtype: float
+    """
+    try:
+        return iso_to_epoch(time_string)
+    except ValueError as e:
+        logger.warning('Event %s has no usable time, timestamping it on arrival: %s', event_uuid, e)
+        return time.time()
+
+
+def _event_row(event):
+    """Converts a raw Event dict from a batch into a row for the Event table
+
+    :param event: Event as it was received by the API
+    :type event: dict
+    :raises ValueError: If the event is missing any required fields
+    :return: Row that can be inserted into the Event table
+    :rtype: dict
+    """
+    if not isinstance(event, dict):
+        raise ValueError('Event must be an object')
+    missing = [field for field in REQUIRED_EVENT_FIELDS if not event.get(field)]
+    if missing:
+        raise ValueError('Missing required fields: {}'.format(', '.join(missing)))
+
+    body = json_text(event.get('body'))
+    return {
+        'uuid': str(event['uuid']),
+        'time': str(event.get('time')),
+        'timestamp': event_timestamp(event['uuid'], str(event.get('time'))),
+        'name': str(event['name']),
+        'type': str(event['type']),
+        'priority': str(event.get('priority')),
+        'body': body,
+    }
+
+
+def _existing_event_uuids(conn, uuids):
+    """Finds which of the given UUIDs are already stored in the Event table
+
+    :param conn: Open database connection
+    :param uuids: UUIDs to look up
+    :type uuids: list
+    :return: UUIDs that already exist
+    :rtype: set
+    """
+    existing = set()
+    for i in range(0, len(uuids), SQLITE_MAX_VARIABLES):
+        chunk = uuids[i:i + SQLITE_MAX_VARIABLES]
+        query = select([Event.__table__.c.uuid]).where(Event.__table__.c.uuid.in_(chunk))
+        existing.update(row[0] for row in conn.execute(query))
+    return existing
+
+
+def add_events_to_db(events):
+    """Adds a batch of Events to the core database in a single transaction
+
+    Invalid and duplicate Events are reported back individually instead of
+    failing the whole batch.
+
+    :param events: Events as they were received by the API
+    :type events: list
+    :return: Result for each Event, in the same order as the input
+    :rtype: list
+    """
+    results = []
+    rows = {}
+    for event in events:
+        try:
+            row = _event_row(event)
+        except ValueError as e:
+            results.append({'uuid': event.get('uuid') if isinstance(event, dict) else None,
+                            'status': 'invalid',
+                            'error': str(e)})
+            continue
+        if row['uuid'] in rows:
+            results.append({'uuid': row['uuid'], 'status': 'duplicate'})
+            continue
+        rows[row['uuid']] = row
+        results.append({'uuid': row['uuid'], 'status': 'created'})
+
+    if not rows:
+        return results
+
+    existing = writer.execute(_insert_event_rows, rows)
+    notifier.notify()
+    for result in results:
+        if result['status'] == 'created' and result['uuid'] in existing:
+            result['status'] = 'duplicate'
+    logging.info('Sucessfully added %s Events', len(rows) - len(existing))
+    return results
+
+
+def _insert_event_rows(conn, rows):
+    """Inserts the Event rows that are not already in the database with a
+    single executemany and numbers them with the next sequence numbers. Runs
+    inside a DBWriter transaction, so no other writer can insert the same UUIDs
+    or take the same sequence numbers between the lookup and the insert
+
+    :param conn: Open database connection
+    :param rows: UUID to row for the Event table
+    :type rows: dict
+    :return: UUIDs that were already in the database
+    :rtype: set
+    """
+    existing = _existing_event_uuids(conn, list(rows.keys()))
+    new_rows = [row for uuid, row in rows.items() if uuid not in existing]
+    if new_rows:
+        first_seq = _next_sequence(conn, 'event', len(new_rows))
+        for i, row in enumerate(new_rows):
+            row['seq'] = first_seq + i
+        conn.execute(Event.__table__.insert(), new_rows)
+        _bump_generation(conn, 'event')
+    return existing
+
+
 def add_execution_to_db(execution):
     """Adds and commits new entries into the core databse
 
@@ -87,21 +305,130 @@ def add_execution_to_db(execution):
     :type execution: db.model object
     """
     try:
-        engine.execute(Execution.__table__.insert(),[{
+        writer.execute(_insert_execution_row, {
             'uuid': execution.uuid,
             'name': execution.name,
             'binded_events': execution.binded_events,
             'time': execution.time,
             'commands': execution.commands,
             'status': execution.status,
-        }])
+        })
     except IntegrityError as e:
         logger.error('UUID might already be in the database (ignoring)\n %s', e)
         return False
     else:
         logging.info('Sucessfully added Execution: {}'.format(execution.uuid))
+    notifier.notify()
     return True
 
+
+def _insert_execution_row(conn, row):
+    """Inserts an Execution row numbered with the next sequence number. Runs
+    inside a DBWriter transaction
+
+    :param conn: Open database connection
+    :param row: Row for the Execution table
+    :type row: dict
+    """
+    row['seq'] = _next_sequence(conn, 'execution', 1)
+    conn.execute(Execution.__table__.insert(), row)
+    _bump_generation(conn, 'execution')
+
+
+def events_last_query(limit=100):
+    """Query for the most recent Events"""
+    event = Event.__table__
+    return select([event]).order_by(event.c.timestamp.desc()).limit(limit)
+
+
+def events_last_critical_query(limit=10):
+    """Query for the most recent Critical Events"""
+    event = Event.__table__
+    return select([event]).where(event.c.priority == 'critical').order_by(event.c.timestamp.desc()).limit(limit)
+
+
+def events_interval_query(start_timestamp, end_timestamp):
+    """Query for the Events between two epoch timestamps"""
+    event = Event.__table__
+    return select([event]).where(event.c.timestamp.between(start_timestamp, end_timestamp)).order_by(event.c.timestamp)
+
+
+def events_since_query(cursor, limit):
+    """Query for the Events after a sequence number, oldest first"""
+    event = Event.__table__
+    return select([event]).where(event.c.seq > cursor).order_by(event.c.seq).limit(limit)
+
+
+def executions_last_query(limit):
+    """Query for the most recent Executions"""
+    execution = Execution.__table__
+    return select([execution]).order_by(execution.c.seq.desc()).limit(limit)
+
+
+def _json_response(text, status=200):
+    """Wraps JSON text that was already serialised into a response, so that
+    Flask-RESTful does not encode it again
+    """
+    return Response(text, status=status, mimetype='application/json',
+                    headers={'Access-Control-Allow-Origin': '*'})
+
+
+def _rows_json(query, fragment):
+    """Runs a query and serialises its rows into a JSON list
+
+    :param query: Core selectable over every column of a table
+    :param fragment: event_fragment or execution_fragment
+    :rtype: str
+    """
+    return json_array([fragment(row) for row in engine.execute(query)])
+
+
+def _cached_response(key, table_name, build):
+    """Serves an endpoint from the response cache while its table is unchanged
+
+    Clients that send back the ETag of the current generation in If-None-Match
+    get an empty 304 instead of the rows.
+
+    :param key: Name of the endpoint
+    :type key: str
+    :param table_name: Table the endpoint reads, 'event' or 'execution'
+    :type table_name: str
+    :param build: Callable returning the JSON text of the response
+    :raises OperationalError: If the rows could not be read
+    :return: Flask response
+    """
+    generation = _current_sequence(GENERATION_COUNTERS[table_name])
+    cached = response_cache.get(key, generation)
+    if cached is None:
+        cached = response_cache.put(key, generation, build())
+
+    if request.if_none_match.contains(cached.etag):
+        response = Response(status=304, headers={'Access-Control-Allow-Origin': '*'})
+    else:
+        response = _json_response(cached.body)
+    response.set_etag(cached.etag)
+    response.headers['Cache-Control'] = 'no-cache'
+    return response
+
+
+def endpoint_queries():
+    """Representative query for each read endpoint, used to check that they
+    are answered with an index
+
+    :return: Endpoint name to query
+    :rtype: dict
+    """
+    return {
+        '/get_events_last': events_last_query(),
+        '/get_events_last_critical': events_last_critical_query(),
+        '/get_events_interval': events_interval_query(0, 1),
+        '/get_events_since': events_since_query(0, DEFAULT_PAGE_SIZE),
+        '/get_executions_last': executions_last_query(20),
+        '/get_event_summaries': event_summaries_query(0, 1),
+        '/get_event_summaries?name': event_summaries_query(0, 1, 'oper_status.interface.up.P1'),
+    }
+
+
 class DBCreateEvent(Resource):
     def post(self):
         """POST method for storing new Event entries into the database
@@ -125,61 +452,67 @@ class DBCreateEvent(Resource):
 
         new_event = Event(uuid=str(args['uuid']),
                           time=str(args['time']),
+                          timestamp=event_timestamp(args['uuid'], str(args['time'])),
                           name=str(args['name']),
                           type=str(args['type']),
                           priority=str(args['priority']),
-                          body=str(args['body']))
+                          body=json_text(args['body']))
         status = add_event_to_db(new_event)
         if not status:
             return {'Error': 'Could not add event to database'}, 400
         return {'Success': 'New event added with id {}'.format(args['uuid'])}, 201
 
 
+class DBCreateEvents(Resource):
+    def post(self):
+        """POST method for storing a batch of new Event entries into the database
+
+        Expects a JSON list of Events, each with the same fields as /create_event.
+        Duplicate or invalid Events are reported individually and do not stop the
+        rest of the batch from being stored.
+
+        :return: Counts of created and failed Events along with a result for each
+                 Event. 201 if every Event was added, 207 otherwise
+        """
+        events = request.get_json(force=True, silent=True)
+        if not isinstance(events, list):
+            return {'Error': 'Expected a list of events'}, 400
+        if len(events) > MAX_BATCH_SIZE:
+            return {'Error': 'Batch is larger than {} events'.format(MAX_BATCH_SIZE)}, 413
+
+        results = add_events_to_db(events)
+        created = len([result for result in results if result['status'] == 'created'])
+        output = {
+            'created': created,
+            'failed': len(results) - created,
+            'results': results,
+        }
+        if created != len(results):
+            return output, 207
+        return output, 201
+
+
 class DBGetEventsLast(Resource):
     def get(self):
         """GET method that retrieves the 100 most recent Events
 
         :return: A list of Events"""
-        output = []
         try:
-            queries = db.session.query(Event).order_by(Event.time.desc()).limit(100)
+            return _cached_response('/get_events_last', 'event',
+                                    lambda: _rows_json(events_last_query(), event_fragment))
         except OperationalError:
-            return {'Error': 'Database is currently empty'}, 400
-
-        for query in queries:
-            query_serialised = {
-                'uuid': query.uuid,
-                'time': query.time,
-                'name': query.name,
-                'type': query.type,
-                'priority': query.priority,
-                'body': json.loads(query.body)
-            }
-            output.append(query_serialised)
-        return output, 200, {'Access-Control-Allow-Origin': '*'}
+            return {'Error': 'Database is currently empty'}, 400, {'Access-Control-Allow-Origin': '*'}
 
 class DBGetEventsLastCritical(Resource):
     def get(self):
         """GET method that retrieves the 10 most recent Critical events
 
         :return: A list of Events"""
-        output = []
         try:
-            queries = db.session.query(Event).order_by(Event.time.desc()).filter(Event.priority == 'critical').limit(10)
+            return _cached_response('/get_events_last_critical', 'event',
+                                    lambda: _rows_json(events_last_critical_query(), event_fragment))
         except OperationalError:
-            return {'Error': 'Database is currently empty'}, 400
-
-        for query in queries:
-            query_serialised = {
-                'uuid': query.uuid,
-                'time': query.time,
-                'name': query.name,
-                'type': query.type,
-                'priority': query.priority,
-                'body': json.loads(query.body)
-            }
-            output.append(query_serialised)
-        return output, 200, {'Access-Control-Allow-Origin': '*'}
+            return {'Error': 'Database is currently empty'}, 400, {'Access-Control-Allow-Origin': '*'}
 
 class DBGetEventsInterval(Resource):
     def get(self):
@@ -201,23 +534,216 @@ class DBGetEventsInterval(Resource):
             return {'Error': 'end_time has not been defined'}, 400
 
         try:
-            queries = db.session.query(Event).filter(Event.time.between(start_time, end_time)).all()
-            if not queries:
-                return [], 200, {'Access-Control-Allow-Origin': '*'}
-            output = []
-            for query in queries:
-                query_serialised = {
-                    'uuid': query.uuid,
-                    'time': query.time,
-                    'name': query.name,
-                    'type': query.type,
-                    'priority': query.priority,
-                    'body': json.loads(query.body)
-                }
-                output.append(query_serialised)
+            rows = engine.execute(events_interval_query(iso_to_epoch(start_time), iso_to_epoch(end_time))).fetchall()
         except Exception as e:
             return {'Error': str(e)}, 400, {'Access-Control-Allow-Origin': '*'}
-        return output, 200, {'Access-Control-Allow-Origin': '*'}
+        return _json_response(json_array([event_fragment(row) for row in rows]))
+
+
+class DBGetEventsSince(Resource):
+    def get(self):
+        """GET method which retrieves the Events that were added after a cursor,
+        oldest first. Pass the returned cursor back in to get the next page
+
+        :param cursor: Sequence number of the last Event already seen, defaults to 0
+        :type cursor: int
+        :param limit: Maximum number of Events to return, defaults to 100
+        :type limit: int
+
+        :return: The Events, the cursor for the next request, whether more Events
+                 are already waiting and the sequence number of the newest Event
+        """
+        try:
+            cursor = int(request.args.get('cursor', 0))
+            limit = int(request.args.get('limit', DEFAULT_PAGE_SIZE))
+        except ValueError:
+            return {'Error': 'cursor and limit must be integers'}, 400, {'Access-Control-Allow-Origin': '*'}
+        limit = max(0, min(limit, MAX_PAGE_SIZE))
+
+        try:
+            head = _current_sequence('event')
+            rows = engine.execute(events_since_query(cursor, limit)).fetchall()
+        except OperationalError as e:
+            return {'Error': str(e)}, 400, {'Access-Control-Allow-Origin': '*'}
+
+        if rows:
+            cursor = rows[-1].seq
+        output = '{{"events": {}, "cursor": {}, "more": {}, "head": {}}}'.format(
+            json_array([event_fragment(row) for row in rows]), cursor, json.dumps(cursor < head), head)
+        return _json_response(output)
+
+
+class DBGetArchivedEvents(Resource):
+    def get(self):
+        """GET method which retrieves the Events that the retention process moved
+        into the archive, for the period between start and end time
+
+        :param start_time: The starting timestamp
+        :param end_time: The final timestamp
+        :param name_prefix: Only return Events whose name starts with this prefix
+        :param priority: Only return Events with this priority
+        :param limit: Maximum number of Events to return, defaults to 1000
+
+        :return: A list of Events, oldest first
+        """
+        start_time = request.args.get('start_time')
+        end_time = request.args.get('end_time')
+        if start_time is None or end_time is None:
+            return {'Error': 'start_time and end_time have to be defined'}, 400, {'Access-Control-Allow-Origin': '*'}
+
+        try:
+            limit = max(0, min(int(request.args.get('limit', MAX_PAGE_SIZE)), MAX_PAGE_SIZE))
+            events = query_archive(ARCHIVE_DIRECTORY, iso_to_epoch(start_time), iso_to_epoch(end_time),
+                                   name_prefix=request.args.get('name_prefix'),
+                                   priority=request.args.get('priority'),
+                                   limit=limit)
+        except ValueError as e:
+            return {'Error': str(e)}, 400, {'Access-Control-Allow-Origin': '*'}
+        return events, 200, {'Access-Control-Allow-Origin': '*'}
+
+
+class DBGetEventSummaries(Resource):
+    def get(self):
+        """GET method which retrieves the hourly summaries of the Events that the
+        retention process downsampled, for the period between start and end time
+
+        :param start_time: The starting timestamp
+        :param end_time: The final timestamp
+        :param name: Only return the summaries of this Event name
+
+        :return: A list of hourly summaries with the number of Events, the time of
+                 the first and last one and the body of the last one
+        """
+        start_time = request.args.get('start_time')
+        end_time = request.args.get('end_time')
+        if start_time is None or end_time is None:
+            return {'Error': 'start_time and end_time have to be defined'}, 400, {'Access-Control-Allow-Origin': '*'}
+
+        try:
+            query = event_summaries_query(iso_to_epoch(start_time), iso_to_epoch(end_time), request.args.get('name'))
+            rows = engine.execute(query).fetchall()
+        except (ValueError, OperationalError) as e:
+            return {'Error': str(e)}, 400, {'Access-Control-Allow-Origin': '*'}
+
+        output = ['{{"hour": {}, "name": {}, "priority": {}, "count": {}, "first_time": {}, "last_time": {}, "last_body": {}}}'
+                  .format(json.dumps(row.hour), json.dumps(row.name), json.dumps(row.priority), row.count,
+                          json.dumps(row.first_time), json.dumps(row.last_time), row.last_body)
+                  for row in rows]
+        return _json_response(json_array(output))
+
+
+def _stream_message(message_type, cursors, data):
+    """Formats a Server-Sent Event. The id holds both cursors, so a reconnecting
+    EventSource resumes with Last-Event-ID from where it stopped
+
+    :param data: Serialised JSON text of the row
+    """
+    return 'id: {}:{}\nevent: {}\ndata: {}\n\n'.format(cursors['event'], cursors['execution'],
+                                                          message_type, data)
+
+
+def _stream_rows(table, cursor, head, filters):
+    """Reads the rows of a table added after cursor up to head, oldest first.
+    Reads through the engine so that no transaction is left open between
+    messages
+
+    :return: Generator of rows
+    """
+    while cursor < head:
+        query = select([table]).where(table.c.seq > cursor).where(table.c.seq <= head)
+        for condition in filters:
+            query = query.where(condition)
+        rows = engine.execute(query.order_by(table.c.seq).limit(MAX_PAGE_SIZE)).fetchall()
+        if not rows:
+            return
+        for row in rows:
+            yield row
+        cursor = rows[-1].seq
+
+
+class DBStream(Resource):
+    def get(self):
+        """GET method which streams newly added Events and Executions as
+        Server-Sent Events (text/event-stream) instead of having to poll for them
+
+        Each Event is sent as an 'event' message and each Execution as an
+        'execution' message, with the same fields as the other endpoints plus
+        their sequence number. A keep-alive comment is sent when nothing happened
+        for a while. Every open stream holds one worker thread, so each worker
+        serves at most MAX_STREAMS of them and answers 503 with Retry-After above
+        that, keeping its other threads for the write endpoints.
+
+        :param topics: Comma separated list of 'events' and 'executions', defaults to both
+        :param name_prefix: Only send Events whose name starts with this prefix
+        :param priority: Comma separated list of Event priorities to send
+        :param Last-Event-ID: Header sent by a reconnecting EventSource to resume the stream,
+                              otherwise only rows added after connecting are sent
+
+        :return: A never ending text/event-stream response, 503 when this worker
+                 already serves MAX_STREAMS streams
+        """
+        topics = request.args.get('topics', ','.join(STREAM_TOPICS)).split(',')
+        if not set(topics).issubset(STREAM_TOPICS):
+            return {'Error': 'topics must be a list of {}'.format(', '.join(STREAM_TOPICS))}, 400, {'Access-Control-Allow-Origin': '*'}
+
+        event_table = Event.__table__
+        event_filters = []
+        name_prefix = request.args.get('name_prefix')
+        if name_prefix:
+            escaped_prefix = name_prefix.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+            event_filters.append(event_table.c.name.like(escaped_prefix + '%', escape='\\'))
+        priority = request.args.get('priority')
+        if priority:
+            event_filters.append(event_table.c.priority.in_(priority.split(',')))
+
+        resume_cursors = None
+        last_event_id = request.headers.get('Last-Event-ID')
+        if last_event_id:
+            try:
+                event_cursor, execution_cursor = [int(cursor) for cursor in last_event_id.split(':')]
+            except ValueError:
+                return {'Error': 'Invalid Last-Event-ID'}, 400, {'Access-Control-Allow-Origin': '*'}
+            resume_cursors = {'event': event_cursor, 'execution': execution_cursor}
+
+        def generate():
+            current = notifier.subscribe()
+            cursors = resume_cursors or dict(current)
+            try:
+                yield 'retry: 3000\n\n'
+                while True:
+                    if 'events' in topics:
+                        for row in _stream_rows(event_table, cursors['event'], current['event'], event_filters):
+                            cursors['event'] = row.seq
+                            yield _stream_message('event', cursors, event_fragment(row))
+                    if 'executions' in topics:
+                        for row in _stream_rows(Execution.__table__, cursors['execution'], current['execution'], []):
+                            cursors['execution'] = row.seq
+                            yield _stream_message('execution', cursors, execution_fragment(row))
+                    # Rows skipped by the filters still move the cursors forward
+                    cursors['event'] = max(cursors['event'], current['event'])
+                    cursors['execution'] = max(cursors['execution'], current['execution'])
+
+                    latest = notifier.wait_for_change(current, STREAM_HEARTBEAT)
+                    if latest == current:
+                        yield ': keep-alive\n\n'
+                    current = latest
+            finally:
+                notifier.unsubscribe()
+
+        if not stream_slots.acquire(False):
+            logger.warning('Refusing /stream, %s streams are already open in this worker', MAX_STREAMS)
+            return {'Error': 'Too many open streams, retry later'}, 503, \
+                {'Access-Control-Allow-Origin': '*', 'Retry-After': str(STREAM_RETRY_AFTER)}
+
+        headers = {
+            'Cache-Control': 'no-cache',
+            'X-Accel-Buffering': 'no',
+            'Access-Control-Allow-Origin': '*',
+        }
+        response = Response(stream_with_context(generate()), mimetype='text/event-stream', headers=headers)
+        # Called by the WSGI server once the client is gone, even if the stream never started
+        response.call_on_close(stream_slots.release)
+        return response
 
 
 class DBCreateExecution(Resource):
@@ -245,10 +771,10 @@ class DBCreateExecution(Resource):
 
         new_event = Execution(uuid=str(args['uuid']),
                               name=str(args['name']),
-                              binded_events=str(args['binded_events']),
+                              binded_events=json_text(args['binded_events']),
                               time=str(args['time']),
                               status=str(args['status']),
-                              commands=str(args['commands']))
+                              commands=json_text(args['commands']))
 
         db_status = add_execution_to_db(new_event)
         if not db_status:
@@ -263,57 +789,41 @@ class DBGetExecutionsLast(Resource):
         :return: a list of Executions
         """
         try:
-            queries = db.session.query(Execution).order_by(Execution.time.desc()).limit(20)
+            return _cached_response('/get_executions_last', 'execution',
+                                    lambda: _rows_json(executions_last_query(20), execution_fragment))
         except OperationalError:
             return {'Error': 'Database is currently empty'}, 400, {'Access-Control-Allow-Origin': '*'}
-        output = []
-        for query in queries:
-            query_serialised = {
-                'uuid': query.uuid,
-                'name': query.name,
-                'binded_events': json.loads(query.binded_events),
-                'time': query.time,
-                'commands': json.loads(query.commands),
-                'status': query.status,
-            }
-            output.append(query_serialised)
-        return output, 200, {'Access-Control-Allow-Origin': '*'}
 
 class DBGetExecutionsLast10(Resource):
     def get(self):
-        """GET method for retrieving the 20 most recent Executions
+        """GET method for retrieving the 10 most recent Executions
 
         :return: a list of Executions
         """
         try:
-            queries = db.session.query(Execution).order_by(Execution.time.desc()).limit(10)
+            return _cached_response('/get_executions_last10', 'execution',
+                                    lambda: _rows_json(executions_last_query(10), execution_fragment))
         except OperationalError:
             return {'Error': 'Database is currently empty'}, 400, {'Access-Control-Allow-Origin': '*'}
-        output = []
-        for query in queries:
-            query_serialised = {
-                'uuid': query.uuid,
-                'name': query.name,
-                'binded_events': json.loads(query.binded_events),
-                'time': query.time,
-                'commands': json.loads(query.commands),
-                'status': query.status,
-            }
-            output.append(query_serialised)
-        return output, 200, {'Access-Control-Allow-Origin': '*'}
 
 initialise_db(DATABASE_NAME)
 
 # Routes for the Database API
 # Events
 api.add_resource(DBCreateEvent,          '/create_event')
+api.add_resource(DBCreateEvents,         '/create_events')
 api.add_resource(DBGetEventsLast,        '/get_events_last')
 api.add_resource(DBGetEventsLastCritical,'/get_events_last_critical')
 api.add_resource(DBGetEventsInterval,    '/get_events_interval')
+api.add_resource(DBGetEventsSince,       '/get_events_since')
+api.add_resource(DBGetArchivedEvents,    '/get_archived_events')
+api.add_resource(DBGetEventSummaries,    '/get_event_summaries')
 # Executions
 api.add_resource(DBCreateExecution,      '/create_execution')
 api.add_resource(DBGetExecutionsLast,    '/get_executions_last')
 api.add_resource(DBGetExecutionsLast10,  '/get_executions_last10')
+# Live updates
+api.add_resource(DBStream,               '/stream')
 
 
 if __name__ == '__main__':
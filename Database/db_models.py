@@ -1,13 +1,54 @@
+import calendar
+from datetime import datetime
+
 from flask_sqlalchemy import SQLAlchemy
 
 db = SQLAlchemy()
 
+ISO_FORMATS = (
+    '%Y-%m-%dT%H:%M:%S.%f',
+    '%Y-%m-%dT%H:%M:%S',
+    '%Y-%m-%d %H:%M:%S.%f',
+    '%Y-%m-%d %H:%M:%S',
+    '%Y-%m-%dT%H:%M',
+    '%Y-%m-%d',
+)
+
+
+def iso_to_epoch(time_string):
+    """Converts an ISO 8601 timestamp into seconds since the epoch
+
+    Timestamps are stored without a UTC offset, so they are all treated as UTC.
+    This keeps the epoch ordering identical to the ordering of the original strings.
+
+    :param time_string: Timestamp (eg. 2019-03-01T10:11:12.123456)
+    :type time_string: str
+    :raises ValueError: If the timestamp is not in a supported format
+    :return: Seconds since the epoch
+    :rtype: float
+    """
+    for iso_format in ISO_FORMATS:
+        try:
+            date = datetime.strptime(time_string, iso_format)
+        except (TypeError, ValueError):
+            continue
+        return calendar.timegm(date.timetuple()) + date.microsecond / 1e6
+    raise ValueError('Unsupported timestamp \'{}\''.format(time_string))
+
 
 class Event(db.Model):
     """Event model for the database"""
     __tablename__ = 'event'
+    __table_args__ = (
+        db.Index('ix_event_timestamp', 'timestamp'),
+        db.Index('ix_event_priority_timestamp', 'priority', 'timestamp'),
+        db.Index('ix_event_name_timestamp', 'name', 'timestamp'),
+        db.Index('ix_event_seq', 'seq', unique=True),
+    )
     uuid = db.Column(db.String(37), unique=True, primary_key=True, nullable=False)
+    seq = db.Column(db.Integer, nullable=True)  # Increases by one for every inserted Event
     time = db.Column(db.String(27), nullable=False)
+    timestamp = db.Column(db.Float, nullable=True)  # time as seconds since the epoch
     name = db.Column(db.String(100), nullable=False)
     type = db.Column(db.String(20), nullable=False)
     priority = db.Column(db.String(20), nullable=True)
@@ -21,7 +62,11 @@ class Event(db.Model):
 class Execution(db.Model):
     """Execution model for the database"""
     __tablename__ = 'execution'
+    __table_args__ = (
+        db.Index('ix_execution_seq', 'seq', unique=True),
+    )
     uuid = db.Column(db.String(37), unique=True, primary_key=True, nullable=False)
+    seq = db.Column(db.Integer, nullable=True)  # Increases by one for every inserted Execution
     name = db.Column(db.String(100), nullable=False)
     binded_events = db.Column(db.String(1000), nullable=False)
     time = db.Column(db.String(27), nullable=False)
@@ -31,3 +76,33 @@ class Execution(db.Model):
     def __repr__(self):
         output_format = '{}: {} - {}'
         return output_format.format(self.uuid, self.time, self.name)
+
+
+class EventSummary(db.Model):
+    """Hourly summary of the Events that the retention process downsampled"""
+    __tablename__ = 'event_summary'
+    __table_args__ = (
+        db.Index('ix_event_summary_name_hour', 'name', 'hour'),
+    )
+    hour = db.Column(db.Float, primary_key=True, nullable=False)  # Start of the hour as seconds since the epoch
+    name = db.Column(db.String(100), primary_key=True, nullable=False)
+    priority = db.Column(db.String(20), primary_key=True, nullable=False)
+    count = db.Column(db.Integer, nullable=False, default=0)
+    first_time = db.Column(db.String(27), nullable=False)
+    last_time = db.Column(db.String(27), nullable=False)
+    last_body = db.Column(db.String(100000), nullable=True)  # Body of the newest Event in the hour
+
+    def __repr__(self):
+        output_format = '{}: {} x{}'
+        return output_format.format(self.hour, self.name, self.count)
+
+
+class Counter(db.Model):
+    """Named counters shared by every worker (eg. the last Event sequence number)"""
+    __tablename__ = 'counter'
+    name = db.Column(db.String(50), primary_key=True, nullable=False)
+    value = db.Column(db.Integer, nullable=False, default=0)
+
+    def __repr__(self):
+        output_format = '{}: {}'
+        return output_format.format(self.name, self.value)
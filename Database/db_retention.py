@@ -0,0 +1,313 @@
+import argparse
+import calendar
+import gzip
+import json
+import logging
+import os
+import time
+import zlib
+from datetime import datetime, timedelta
+
+import yaml
+from sqlalchemy import and_, or_, select, text
+
+from db_cache import GENERATION_COUNTERS
+from db_models import Counter, Event, EventSummary
+from db_serialise import event_fragment
+from db_storage import STORAGE_MODE, create_read_engine, create_write_engine
+
+# Constants
+DATABASE_NAME = 'core.db'
+RETENTION_CONFIG_FILE = 'retention.yaml'
+ARCHIVE_DIRECTORY = 'archive'
+RETENTION_INTERVAL = 300  # seconds between retention runs
+RETENTION_BATCH_SIZE = 500  # Events removed per transaction, stays below the SQLite variable limit
+BATCH_PAUSE = 0.05  # seconds between transactions, so the API workers can write in between
+DEFAULT_POLICY = 'default'
+SECONDS_PER_HOUR = 3600
+
+# Logging
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.INFO)
+
+handler = logging.StreamHandler()
+handler.setLevel(logging.DEBUG)
+
+logger.addHandler(handler)
+
+
+def load_retention_config(config_path=RETENTION_CONFIG_FILE):
+    """Loads the retention policies. Without a config file nothing expires
+
+    :param config_path: Path to the retention yaml
+    :type config_path: str
+    :return: interval, batch_size, archive_directory and the policy for each priority
+    :rtype: dict
+    """
+    config = {}
+    try:
+        with open(config_path, 'r') as f:
+            config = yaml.safe_load(f.read()) or {}
+    except IOError:
+        logger.error('Could not open \'%s\', Events will be kept forever', config_path)
+
+    return {
+        'interval': config.get('interval', RETENTION_INTERVAL),
+        'batch_size': min(int(config.get('batch_size', RETENTION_BATCH_SIZE)), RETENTION_BATCH_SIZE),
+        'archive_directory': config.get('archive_directory', ARCHIVE_DIRECTORY),
+        'priorities': dict((name, policy or {}) for name, policy in config.get('priorities', {}).items()),
+    }
+
+
+def archive_path(archive_directory, timestamp):
+    """Gets the archive file holding the Events of a day (UTC)
+
+    :param archive_directory: Directory of the archive
+    :type archive_directory: str
+    :param timestamp: Seconds since the epoch
+    :type timestamp: float
+    :return: Path of the file (eg. archive/2019/03/events-2019-03-01.jsonl.gz)
+    :rtype: str
+    """
+    day = datetime.utcfromtimestamp(timestamp)
+    return os.path.join(archive_directory, day.strftime('%Y'), day.strftime('%m'),
+                        day.strftime('events-%Y-%m-%d.jsonl.gz'))
+
+
+def archive_events(archive_directory, rows):
+    """Appends Event rows to the archive files of their days
+
+    Every call appends a new gzip member, so files never have to be rewritten.
+    The files are synced to disk before returning, so the rows can then be
+    deleted from the database. A crash before the delete archives the same
+    rows again on the next run, which query_archive ignores.
+
+    :param archive_directory: Directory of the archive
+    :type archive_directory: str
+    :param rows: Event rows with every column of the Event table
+    :type rows: list
+    """
+    days = {}
+    for row in rows:
+        days.setdefault(archive_path(archive_directory, row.timestamp or 0), []).append(
+            '{{"timestamp": {}, "event": {}}}\n'.format(json.dumps(row.timestamp), event_fragment(row)))
+
+    for path, lines in days.items():
+        directory = os.path.dirname(path)
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+        with open(path, 'ab') as raw:
+            with gzip.GzipFile(fileobj=raw, mode='ab') as f:
+                f.write(''.join(lines).encode('utf-8'))
+            raw.flush()
+            os.fsync(raw.fileno())
+
+
+def _read_archive_file(path):
+    try:
+        with gzip.open(path, 'rt') as f:
+            for line in f:
+                yield json.loads(line)
+    except (EOFError, OSError, zlib.error, ValueError) as e:
+        # A partly written member at the end of the file, from a crash during archive_events
+        logger.error('Could not read all of \'%s\': %s', path, e)
+
+
+def query_archive(archive_directory, start_timestamp, end_timestamp, name_prefix=None, priority=None, limit=None):
+    """Finds archived Events between two epoch timestamps, oldest first
+
+    :param archive_directory: Directory of the archive
+    :type archive_directory: str
+    :param start_timestamp: Seconds since the epoch
+    :type start_timestamp: float
+    :param end_timestamp: Seconds since the epoch
+    :type end_timestamp: float
+    :param name_prefix: Only return Events whose name starts with this prefix
+    :type name_prefix: str
+    :param priority: Only return Events with this priority
+    :type priority: str
+    :param limit: Maximum number of Events to return
+    :type limit: int
+    :return: Events in the same format as the other Event endpoints
+    :rtype: list
+    """
+    matches = {}
+    day = datetime.utcfromtimestamp(start_timestamp).date()
+    last_day = datetime.utcfromtimestamp(end_timestamp).date()
+    while day <= last_day:
+        path = archive_path(archive_directory, calendar.timegm(day.timetuple()))
+        day += timedelta(days=1)
+        if not os.path.exists(path):
+            continue
+        for line in _read_archive_file(path):
+            event = line['event']
+            if not start_timestamp <= (line['timestamp'] or 0) <= end_timestamp:
+                continue
+            if name_prefix and not event['name'].startswith(name_prefix):
+                continue
+            if priority and event['priority'] != priority:
+                continue
+            matches[event['uuid']] = (line['timestamp'], event)
+
+    events = [event for _, event in sorted(matches.values(), key=lambda match: match[0] or 0)]
+    if limit is not None:
+        events = events[:limit]
+    return events
+
+
+def event_summaries_query(start_timestamp, end_timestamp, name=None):
+    """Query for the hourly Event summaries between two epoch timestamps
+
+    :param name: Only return the summaries of this Event name
+    :type name: str
+    """
+    summary = EventSummary.__table__
+    start_hour = start_timestamp - start_timestamp % SECONDS_PER_HOUR
+    query = select([summary]).where(summary.c.hour.between(start_hour, end_timestamp))
+    if name:
+        query = query.where(summary.c.name == name)
+    return query.order_by(summary.c.hour)
+
+
+def _summarise(rows):
+    """Counts Event rows into hourly summaries
+
+    :param rows: Event rows, oldest first
+    :type rows: list
+    :return: (hour, name, priority) to the summary of that hour
+    :rtype: dict
+    """
+    summaries = {}
+    for row in rows:
+        timestamp = row.timestamp or 0
+        key = (timestamp - timestamp % SECONDS_PER_HOUR, row.name, str(row.priority))
+        summary = summaries.get(key)
+        if summary is None:
+            summary = summaries[key] = {'hour': key[0], 'name': key[1], 'priority': key[2],
+                                        'count': 0, 'first_time': row.time}
+        summary['count'] += 1
+        summary['last_time'] = row.time
+        summary['last_body'] = row.body
+    return summaries
+
+
+_UPDATE_SUMMARY = text(
+    'UPDATE event_summary SET count = count + :count, '
+    'first_time = MIN(first_time, :first_time), '
+    'last_time = MAX(last_time, :last_time), '
+    'last_body = CASE WHEN :last_time >= last_time THEN :last_body ELSE last_body END '
+    'WHERE hour = :hour AND name = :name AND priority = :priority')
+
+
+def _remove_rows(conn, rows, downsample):
+    """Deletes Event rows, adding them to the hourly summaries first if they are
+    downsampled. Runs in a single write transaction
+
+    :param conn: Open database connection
+    :param rows: Event rows, oldest first
+    :type rows: list
+    :param downsample: [True] to count the rows into the event_summary table
+    :type downsample: bool
+    """
+    if downsample:
+        for summary in _summarise(rows).values():
+            if conn.execute(_UPDATE_SUMMARY, **summary).rowcount == 0:
+                conn.execute(EventSummary.__table__.insert(), summary)
+
+    event = Event.__table__
+    conn.execute(event.delete().where(event.c.uuid.in_([row.uuid for row in rows])))
+
+    # Drops the cached /get_events_last responses of every API worker
+    counter = Counter.__table__
+    name = GENERATION_COUNTERS['event']
+    if conn.execute(counter.update().where(counter.c.name == name)
+                    .values(value=counter.c.value + 1)).rowcount == 0:
+        conn.execute(counter.insert(), {'name': name, 'value': 1})
+
+
+class RetentionEngine(object):
+    def __init__(self, database_name=DATABASE_NAME, config_path=RETENTION_CONFIG_FILE):
+        """Removes expired Events from the core database in the background
+
+        Each priority has its own policy with a ttl in hours. Expired Events are
+        optionally counted into hourly summaries and moved into gzipped, date
+        partitioned archive files, then deleted in small transactions so the
+        API workers can keep inserting in between.
+
+        :param database_name: Filename of the database
+        :type database_name: str
+        :param config_path: Path to the retention yaml
+        :type config_path: str
+        """
+        self.config = load_retention_config(config_path)
+        self.read_engine = create_read_engine(database_name, STORAGE_MODE)
+        self.write_engine = create_write_engine(database_name, STORAGE_MODE)
+
+    def run_forever(self):
+        """Applies the retention policies every interval"""
+        while True:
+            start = time.time()
+            try:
+                self.run_once()
+            except Exception as e:
+                logger.error('Retention run failed: %s', e)
+            time.sleep(max(0, self.config['interval'] - (time.time() - start)))
+
+    def run_once(self, now=None):
+        """Applies every retention policy once
+
+        :param now: Current time in seconds since the epoch, defaults to time.time()
+        :type now: float
+        :return: Policy name to the number of Events removed
+        :rtype: dict
+        """
+        now = time.time() if now is None else now
+        removed = {}
+        for policy_name, policy in sorted(self.config['priorities'].items()):
+            if policy.get('ttl') is None:
+                continue
+            removed[policy_name] = self._expire(policy_name, policy, now - policy['ttl'] * SECONDS_PER_HOUR)
+            if removed[policy_name]:
+                logger.info('Removed %s expired \'%s\' Events', removed[policy_name], policy_name)
+        return removed
+
+    def _expired_query(self, policy_name, cutoff, after):
+        event = Event.__table__
+        # Events stored without a timestamp are treated as the oldest, they come first
+        query = select([event]).where(or_(and_(event.c.timestamp < cutoff, event.c.timestamp >= after),
+                                          event.c.timestamp.is_(None)))
+        if policy_name == DEFAULT_POLICY:
+            listed = [name for name in self.config['priorities'] if name != DEFAULT_POLICY]
+            query = query.where(or_(event.c.priority.is_(None), event.c.priority.notin_(listed)))
+        else:
+            query = query.where(event.c.priority == policy_name)
+        return query.order_by(event.c.timestamp).limit(self.config['batch_size'])
+
+    def _expire(self, policy_name, policy, cutoff):
+        removed = 0
+        after = float('-inf')
+        while True:
+            rows = self.read_engine.execute(self._expired_query(policy_name, cutoff, after)).fetchall()
+            if not rows:
+                return removed
+            if policy.get('archive'):
+                archive_events(self.config['archive_directory'], rows)
+            with self.write_engine.begin() as conn:
+                _remove_rows(conn, rows, policy.get('downsample', False))
+            removed += len(rows)
+            # Kept priorities that share the timestamp index are not scanned again
+            after = rows[-1].timestamp or 0
+            time.sleep(BATCH_PAUSE)
+
+
+if __name__ == '__main__':
+    arg_parser = argparse.ArgumentParser(description='Removes expired Events from the core database')
+    arg_parser.add_argument('--config', default=RETENTION_CONFIG_FILE, help='Path to the retention yaml')
+    arg_parser.add_argument('--once', action='store_true', help='Run the policies once and exit')
+    options = arg_parser.parse_args()
+
+    retention = RetentionEngine(DATABASE_NAME, options.config)
+    if options.once:
+        retention.run_once()
+    else:
+        retention.run_forever()
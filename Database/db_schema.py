@@ -0,0 +1,257 @@
+import logging
+import re
+import sys
+
+from db_models import Counter, Event, EventSummary, Execution, iso_to_epoch
+from db_serialise import json_text
+
+# Constants
+SCHEMA_VERSION = 5
+MIGRATION_BATCH_SIZE = 5000  # Rows backfilled per transaction
+
+# Logging
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.INFO)
+
+handler = logging.StreamHandler()
+handler.setLevel(logging.DEBUG)
+
+logger.addHandler(handler)
+
+
+def get_schema_version(engine):
+    """Gets the schema version stored in the SQLite user_version pragma
+
+    :param engine: Engine bound to the core database
+    :return: Schema version, 0 for databases created before versioning
+    :rtype: int
+    """
+    return engine.execute('PRAGMA user_version').scalar()
+
+
+def set_schema_version(engine, version):
+    """Stores the schema version in the SQLite user_version pragma
+
+    :param engine: Engine bound to the core database
+    :param version: New schema version
+    :type version: int
+    """
+    engine.execute('PRAGMA user_version = {}'.format(int(version)))
+
+
+def _column_names(engine, table_name):
+    return [row[1] for row in engine.execute('PRAGMA table_info({})'.format(table_name))]
+
+
+def _create_missing_indexes(engine, table, index_names):
+    existing = set(row[1] for row in engine.execute('PRAGMA index_list({})'.format(table.name)))
+    for index in table.indexes:
+        if index.name in index_names and index.name not in existing:
+            logger.info('Creating index \'%s\'', index.name)
+            index.create(bind=engine)
+
+
+def _migrate_event_timestamp(engine):
+    """Version 1: Adds the epoch based Event.timestamp column, backfills it from
+    Event.time and creates the time, (priority, time) and (name, time) indexes.
+
+    This is a startup migration, not an online one: it runs from initialise_db
+    when db_core is imported, which under gunicorn --preload is in the master
+    before the workers are forked, so no request is served until the backfill
+    is done. The small transactions only keep the other corenet processes (eg.
+    db_retention) from waiting on one long write lock meanwhile.
+    """
+    if 'timestamp' not in _column_names(engine, 'event'):
+        engine.execute('ALTER TABLE event ADD COLUMN timestamp FLOAT')
+
+    backfilled = 0
+    while True:
+        rows = engine.execute('SELECT rowid, time FROM event WHERE timestamp IS NULL LIMIT {}'
+                              .format(MIGRATION_BATCH_SIZE)).fetchall()
+        if not rows:
+            break
+        updates = []
+        for rowid, time in rows:
+            try:
+                timestamp = iso_to_epoch(time)
+            except ValueError:
+                logger.error('Event %s has an unsupported time \'%s\', using 0', rowid, time)
+                timestamp = 0.0
+            updates.append((timestamp, rowid))
+        with engine.begin() as conn:
+            conn.execute('UPDATE event SET timestamp = ? WHERE rowid = ?', updates)
+        backfilled += len(updates)
+        logger.info('Backfilled timestamps for %s events', backfilled)
+
+    _create_missing_indexes(engine, Event.__table__,
+                            ('ix_event_timestamp', 'ix_event_priority_timestamp', 'ix_event_name_timestamp'))
+
+
+def _number_rows(engine, table, order_by, counter_name):
+    """Numbers the rows of a table that have no sequence number yet, in order,
+    and stores the last number in the named counter
+    """
+    if 'seq' not in _column_names(engine, table.name):
+        engine.execute('ALTER TABLE {} ADD COLUMN seq INTEGER'.format(table.name))
+    Counter.__table__.create(bind=engine, checkfirst=True)
+
+    last_seq = engine.execute('SELECT COALESCE(MAX(seq), 0) FROM {}'.format(table.name)).scalar()
+    rowids = [row[0] for row in engine.execute('SELECT rowid FROM {} WHERE seq IS NULL ORDER BY {}, rowid'
+                                               .format(table.name, order_by))]
+    for i in range(0, len(rowids), MIGRATION_BATCH_SIZE):
+        updates = [(last_seq + i + j + 1, rowid) for j, rowid in enumerate(rowids[i:i + MIGRATION_BATCH_SIZE])]
+        with engine.begin() as conn:
+            conn.execute('UPDATE {} SET seq = ? WHERE rowid = ?'.format(table.name), updates)
+        logger.info('Numbered %s of %s rows in %s', i + len(updates), len(rowids), table.name)
+
+    with engine.begin() as conn:
+        conn.execute('INSERT OR REPLACE INTO counter (name, value) VALUES (?, (SELECT COALESCE(MAX(seq), 0) FROM {}))'
+                     .format(table.name), (counter_name,))
+
+
+def _migrate_event_seq(engine):
+    """Version 2: Adds the Event.seq sequence number and the counter table
+    that hands them out. Existing Events are numbered in time order.
+    """
+    _number_rows(engine, Event.__table__, 'timestamp', 'event')
+    _create_missing_indexes(engine, Event.__table__, ('ix_event_seq',))
+
+
+def _migrate_execution_seq(engine):
+    """Version 3: Adds the Execution.seq sequence number. Existing Executions
+    are numbered in time order.
+    """
+    _number_rows(engine, Execution.__table__, 'time', 'execution')
+    _create_missing_indexes(engine, Execution.__table__, ('ix_execution_seq',))
+
+
+def _rewrite_json_columns(engine, table_name, columns):
+    """Replaces stored text that is not valid JSON in the given columns, walking
+    the table by rowid in small transactions
+    """
+    last_rowid = 0
+    rewritten = 0
+    while True:
+        rows = engine.execute('SELECT rowid, {} FROM {} WHERE rowid > ? ORDER BY rowid LIMIT {}'
+                              .format(', '.join(columns), table_name, MIGRATION_BATCH_SIZE),
+                              (last_rowid,)).fetchall()
+        if not rows:
+            break
+        last_rowid = rows[-1][0]
+        updates = []
+        for row in rows:
+            values = [json_text(value) for value in row[1:]]
+            if values != list(row[1:]):
+                updates.append(values + [row[0]])
+        if updates:
+            with engine.begin() as conn:
+                conn.execute('UPDATE {} SET {} WHERE rowid = ?'
+                             .format(table_name, ', '.join('{} = ?'.format(column) for column in columns)),
+                             updates)
+            rewritten += len(updates)
+    logger.info('Rewrote %s rows in %s as valid JSON', rewritten, table_name)
+
+
+def _migrate_json_bodies(engine):
+    """Version 4: Makes sure the Event body and the Execution binded_events and
+    commands columns only hold valid JSON text, so reads can splice them into
+    responses without decoding them. Text that is not JSON becomes a JSON string.
+    """
+    _rewrite_json_columns(engine, 'event', ('body',))
+    _rewrite_json_columns(engine, 'execution', ('binded_events', 'commands'))
+
+
+def _migrate_event_summary(engine):
+    """Version 5: Adds the event_summary table that the retention process
+    downsamples old Events into
+    """
+    EventSummary.__table__.create(bind=engine, checkfirst=True)
+
+
+MIGRATIONS = [
+    (1, _migrate_event_timestamp),
+    (2, _migrate_event_seq),
+    (3, _migrate_execution_seq),
+    (4, _migrate_json_bodies),
+    (5, _migrate_event_summary),
+]
+
+
+def migrate(engine, new_database=False):
+    """Upgrades the core database to SCHEMA_VERSION. Runs at startup, before the
+    Database serves any request
+
+    :param engine: Engine bound to the core database
+    :param new_database: [True] if the tables were just created with the current
+                         schema and only need to be stamped with the version
+    :type new_database: bool
+    """
+    if new_database:
+        set_schema_version(engine, SCHEMA_VERSION)
+        return
+
+    version = get_schema_version(engine)
+    for target_version, migration in MIGRATIONS:
+        if version >= target_version:
+            continue
+        logger.info('Migrating database schema from version %s to %s', version, target_version)
+        migration(engine)
+        set_schema_version(engine, target_version)
+        version = target_version
+
+
+def explain_query(engine, query):
+    """Gets the SQLite query plan for a query
+
+    :param engine: Engine bound to the core database
+    :param query: SQLAlchemy ORM query or selectable
+    :return: Detail column of each step in the query plan
+    :rtype: list
+    """
+    statement = getattr(query, 'statement', query)
+    sql = str(statement.compile(dialect=engine.dialect, compile_kwargs={'literal_binds': True}))
+    return [row[-1] for row in engine.execute('EXPLAIN QUERY PLAN {}'.format(sql))]
+
+
+def plan_uses_index(plan):
+    """Determines whether a query plan avoids full table scans and sorting
+
+    :param plan: Output of explain_query
+    :type plan: list
+    :return: [True] if every table access uses an index
+    :rtype: bool
+    """
+    for step in plan:
+        if 'USE TEMP B-TREE' in step:
+            return False
+        if re.match(r'^SCAN (TABLE )?\w+$', step):
+            return False
+    return True
+
+
+def check_query_plans(engine, queries):
+    """Checks that each query is answered using an index
+
+    :param engine: Engine bound to the core database
+    :param queries: Endpoint name to the query it runs
+    :type queries: dict
+    :return: [True] if every query uses an index
+    :rtype: bool
+    """
+    success = True
+    for name, query in sorted(queries.items()):
+        plan = explain_query(engine, query)
+        uses_index = plan_uses_index(plan)
+        success = success and uses_index
+        logger.info('%s %s', 'OK  ' if uses_index else 'SCAN', name)
+        for step in plan:
+            logger.info('       %s', step)
+    return success
+
+
+if __name__ == '__main__':
+    # Migrates core.db and proves that every endpoint query uses an index
+    from db_core import endpoint_queries, engine
+
+    if not check_query_plans(engine, endpoint_queries()):
+        sys.exit(1)
@@ -0,0 +1,104 @@
+import json
+import threading
+from collections import OrderedDict
+
+# Constants
+FRAGMENT_CACHE_SIZE = 10000  # Serialised rows kept per table
+
+_dumps = json.dumps
+
+
+def json_text(value):
+    """Makes sure a value can be spliced into a response as JSON text
+
+    Bodies are stored as the JSON text the collectors sent. Text that is not
+    valid JSON is stored as a JSON string instead, so reads never have to
+    parse it.
+
+    :param value: Text that should contain JSON, or any JSON serialisable object
+    :return: Valid JSON text
+    :rtype: str
+    """
+    if value is None:
+        return 'null'
+    if not isinstance(value, str):
+        return _dumps(value)
+    try:
+        json.loads(value)
+    except ValueError:
+        return _dumps(value)
+    return value
+
+
+class FragmentCache(object):
+    def __init__(self, maxsize=FRAGMENT_CACHE_SIZE):
+        """Least recently used cache of serialised rows keyed by UUID. Rows are
+        never updated after they are inserted, so entries never go stale
+
+        :param maxsize: Number of rows to keep
+        :type maxsize: int
+        """
+        self.maxsize = maxsize
+        self._fragments = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, build, row):
+        with self._lock:
+            fragment = self._fragments.get(key)
+            if fragment is not None:
+                self._fragments.move_to_end(key)
+                return fragment
+        fragment = build(row)
+        with self._lock:
+            self._fragments[key] = fragment
+            if len(self._fragments) > self.maxsize:
+                self._fragments.popitem(last=False)
+        return fragment
+
+
+event_fragments = FragmentCache()
+execution_fragments = FragmentCache()
+
+
+def _event_fragment(row):
+    return ('{{"seq": {}, "uuid": {}, "time": {}, "name": {}, "type": {}, "priority": {}, "body": {}}}'
+            .format(_dumps(row.seq), _dumps(row.uuid), _dumps(row.time), _dumps(row.name),
+                    _dumps(row.type), _dumps(row.priority), row.body))
+
+
+def _execution_fragment(row):
+    return ('{{"seq": {}, "uuid": {}, "name": {}, "binded_events": {}, "time": {}, "commands": {}, "status": {}}}'
+            .format(_dumps(row.seq), _dumps(row.uuid), _dumps(row.name), row.binded_events,
+                    _dumps(row.time), row.commands, _dumps(row.status)))
+
+
+def event_fragment(row):
+    """Serialises an Event row to JSON by splicing in the stored body text
+    instead of decoding and encoding it again
+
+    :param row: Event row with every column of the Event table
+    :return: JSON object text
+    :rtype: str
+    """
+    return event_fragments.get(row.uuid, _event_fragment, row)
+
+
+def execution_fragment(row):
+    """Serialises an Execution row to JSON by splicing in the stored
+    binded_events and commands text
+
+    :param row: Execution row with every column of the Execution table
+    :return: JSON object text
+    :rtype: str
+    """
+    return execution_fragments.get(row.uuid, _execution_fragment, row)
+
+
+def json_array(fragments):
+    """Joins serialised rows into a JSON list
+
+    :param fragments: JSON object texts
+    :type fragments: list
+    :rtype: str
+    """
+    return '[' + ', '.join(fragments) + ']'
@@ -0,0 +1,166 @@
+import logging
+import os
+import threading
+from concurrent.futures import Future
+from queue import Queue
+
+from sqlalchemy import create_engine, event
+from sqlalchemy.pool import QueuePool, StaticPool
+
+# Constants
+STORAGE_MODE = 'wal'  # 'wal' or 'default' (rollback journal, as SQLite ships)
+BUSY_TIMEOUT = 30  # seconds a connection waits for a lock held by another process
+READ_POOL_SIZE = 16  # Read connections kept open per worker
+WRITE_QUEUE_SIZE = 10000  # Writes waiting for the writer thread
+SQLITE_PRAGMAS = {
+    'wal': [
+        ('journal_mode', 'WAL'),
+        ('synchronous', 'NORMAL'),  # fsync at checkpoints only, safe with WAL
+        ('cache_size', -65536),  # 64 MiB page cache per connection
+        ('mmap_size', 268435456),  # 256 MiB memory mapped reads
+        ('temp_store', 'MEMORY'),
+        ('busy_timeout', BUSY_TIMEOUT * 1000),
+    ],
+    'default': [],
+}
+
+# Logging
+logger = logging.getLogger(__name__)
+
+
+def _set_pragmas(engine, storage_mode):
+    pragmas = SQLITE_PRAGMAS[storage_mode]
+
+    @event.listens_for(engine, 'connect')
+    def set_pragmas(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        for name, value in pragmas:
+            cursor.execute('PRAGMA {} = {}'.format(name, value))
+        cursor.close()
+
+
+def create_read_engine(database_name, storage_mode=STORAGE_MODE):
+    """Creates the engine used for reads and schema changes
+
+    In WAL mode readers never block the writer or each other, so the connections
+    are pooled and shared between the request threads of a worker.
+
+    :param database_name: Filename of the database
+    :type database_name: str
+    :param storage_mode: 'wal' or 'default'
+    :type storage_mode: str
+    :return: SQLAlchemy engine
+    """
+    url = 'sqlite:///{}'.format(database_name)
+    if storage_mode == 'default':
+        return create_engine(url, convert_unicode=True)
+
+    engine = create_engine(url,
+                           convert_unicode=True,
+                           poolclass=QueuePool,
+                           pool_size=READ_POOL_SIZE,
+                           max_overflow=READ_POOL_SIZE,
+                           connect_args={'check_same_thread': False, 'timeout': BUSY_TIMEOUT})
+    _set_pragmas(engine, storage_mode)
+    return engine
+
+
+def create_write_engine(database_name, storage_mode=STORAGE_MODE):
+    """Creates the engine used by the DBWriter
+
+    It holds a single connection and starts every transaction with
+    BEGIN IMMEDIATE, so the write lock is taken up front instead of being
+    upgraded from a read lock halfway through, which SQLite can only resolve
+    by failing with "database is locked".
+
+    :param database_name: Filename of the database
+    :type database_name: str
+    :param storage_mode: 'wal' or 'default'
+    :type storage_mode: str
+    :return: SQLAlchemy engine
+    """
+    engine = create_engine('sqlite:///{}'.format(database_name),
+                           convert_unicode=True,
+                           poolclass=StaticPool,
+                           connect_args={'check_same_thread': False, 'timeout': BUSY_TIMEOUT})
+    _set_pragmas(engine, storage_mode)
+
+    @event.listens_for(engine, 'connect')
+    def disable_pysqlite_transactions(dbapi_connection, connection_record):
+        # Let the 'begin' listener below control when transactions start
+        dbapi_connection.isolation_level = None
+
+    @event.listens_for(engine, 'begin')
+    def begin_immediate(conn):
+        conn.execute('BEGIN IMMEDIATE')
+
+    return engine
+
+
+class DBWriter(object):
+    def __init__(self, engine, max_queue_size=WRITE_QUEUE_SIZE):
+        """Runs every write for this process on one thread and connection
+
+        Request threads hand their writes over and wait for the result, so
+        writes never contend with each other inside a worker and reads stay
+        concurrent on the read engine.
+
+        The thread is started lazily and restarted after a fork, so the writer
+        is safe to create before gunicorn forks its workers (--preload).
+
+        :param engine: Engine from create_write_engine
+        :param max_queue_size: Writes that can wait before callers block
+        :type max_queue_size: int
+        """
+        self.engine = engine
+        self.max_queue_size = max_queue_size
+        self._queue = None
+        self._pid = None
+        self._start_lock = threading.Lock()
+
+    def execute(self, fn, *args, **kwargs):
+        """Runs fn(conn, *args, **kwargs) in a write transaction on the writer thread
+
+        The transaction is committed if fn returns and rolled back if it raises.
+
+        :param fn: Callable that takes an open connection as its first argument
+        :raises Exception: Any exception raised by fn
+        :return: Whatever fn returned
+        """
+        self._ensure_started()
+        future = Future()
+        self._queue.put((future, fn, args, kwargs))
+        return future.result()
+
+    def pending(self):
+        """Number of writes waiting for the writer thread"""
+        if self._queue is None:
+            return 0
+        return self._queue.qsize()
+
+    def _ensure_started(self):
+        if self._pid == os.getpid():
+            return
+        with self._start_lock:
+            if self._pid == os.getpid():
+                return
+            # Connections inherited from a parent process must not be reused
+            self.engine.dispose()
+            self._queue = Queue(maxsize=self.max_queue_size)
+            thread = threading.Thread(name='DBWriter', target=self._run, args=(self._queue,))
+            thread.daemon = True
+            thread.start()
+            self._pid = os.getpid()
+
+    def _run(self, queue):
+        while True:
+            future, fn, args, kwargs = queue.get()
+            if not future.set_running_or_notify_cancel():
+                continue
+            try:
+                with self.engine.begin() as conn:
+                    result = fn(conn, *args, **kwargs)
+            except Exception as e:
+                future.set_exception(e)
+            else:
+                future.set_result(result)
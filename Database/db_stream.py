@@ -0,0 +1,102 @@
+import logging
+import os
+import threading
+import time
+
+# Constants
+POLL_INTERVAL = 0.5  # seconds between counter checks while anyone is subscribed
+
+# Logging
+logger = logging.getLogger(__name__)
+
+
+class ChangeNotifier(object):
+    def __init__(self, read_counters, poll_interval=POLL_INTERVAL):
+        """Wakes up stream subscribers when new rows are inserted
+
+        Inserts made by this worker wake subscribers straight away through
+        notify(). Inserts made by other gunicorn workers are picked up by a
+        single poller thread per worker which reads the shared sequence
+        counters, and only while at least one stream is subscribed.
+
+        :param read_counters: Callable returning the current counters as a dict
+                              (eg. {'event': 10, 'execution': 2})
+        :param poll_interval: Seconds between counter checks
+        :type poll_interval: float
+        """
+        self.read_counters = read_counters
+        self.poll_interval = poll_interval
+        self._condition = threading.Condition()
+        self._counters = None
+        self._subscribers = 0
+        self._has_subscribers = threading.Event()
+        self._pid = None
+        self._start_lock = threading.Lock()
+
+    def subscribe(self):
+        """Registers a stream and gets the current counters
+
+        :return: Counter name to last sequence number
+        :rtype: dict
+        """
+        self._ensure_started()
+        self._refresh()
+        with self._condition:
+            self._subscribers += 1
+            self._has_subscribers.set()
+            return dict(self._counters)
+
+    def unsubscribe(self):
+        """Removes a stream that was registered with subscribe"""
+        with self._condition:
+            self._subscribers -= 1
+            if self._subscribers <= 0:
+                self._subscribers = 0
+                self._has_subscribers.clear()
+
+    def notify(self):
+        """Wakes up the subscribers after this worker inserted new rows"""
+        if self._subscribers:
+            self._refresh()
+
+    def wait_for_change(self, seen, timeout):
+        """Blocks until the counters differ from the ones already seen
+
+        :param seen: Counters the caller has already handled
+        :type seen: dict
+        :param timeout: Maximum number of seconds to wait
+        :type timeout: float
+        :return: The current counters, equal to seen if nothing changed in time
+        :rtype: dict
+        """
+        with self._condition:
+            if self._counters == seen:
+                self._condition.wait(timeout)
+            return dict(self._counters)
+
+    def _refresh(self):
+        counters = self.read_counters()
+        with self._condition:
+            if counters != self._counters:
+                self._counters = counters
+                self._condition.notify_all()
+
+    def _ensure_started(self):
+        if self._pid == os.getpid():
+            return
+        with self._start_lock:
+            if self._pid == os.getpid():
+                return
+            thread = threading.Thread(name='ChangeNotifier', target=self._run)
+            thread.daemon = True
+            thread.start()
+            self._pid = os.getpid()
+
+    def _run(self):
+        while True:
+            self._has_subscribers.wait()
+            try:
+                self._refresh()
+            except Exception as e:
+                logger.error('Could not read the change counters: %s', e)
+            time.sleep(self.poll_interval)
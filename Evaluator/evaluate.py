@@ -1,11 +1,18 @@
+import argparse
+import itertools
 import json
 import logging
+import os
 import time
-import threading
-from datetime import datetime, timedelta
+from concurrent.futures import ThreadPoolExecutor
+
 import requests
 import yaml
 
+from link_store import LINK_STATE_FILE, LinkStore
+from sharding import HashRing, shard_keys
+from timer_scheduler import TimerScheduler
+
 # Constants
 DATABASE_URL = 'http://0.0.0.0'
 DATABASE_PORT = 5000
@@ -14,6 +21,13 @@ EXECUTOR_PORT = 5001
 EVALUATION_INTERVAL = 20  # Seconds
 EVALUATION_CONFIG_FILE = 'evaluation_config.yaml'
 EVALUATION_LINK_FILE = 'evaluation_link.yaml'
+EVALUATION_CURSOR_FILE = 'evaluation_cursor.json'
+WORKER_CURSOR_FILE = 'evaluation_cursor.{}.json'  # Cursor of each worker when there are several
+EVENTS_PAGE_SIZE = 1000  # Events fetched per /get_events_since request
+EXECUTION_RETRIES = 5  # Times an execution refused with 429 is sent again
+EXECUTION_RETRY_DELAY = 30  # Seconds, when the Executor sends no Retry-After
+EXECUTION_TIMEOUT = 10  # Seconds
+EXECUTION_WORKERS = 4  # Executions posted at the same time
 
 # Logging
 logger = logging.getLogger(__name__)
@@ -24,22 +38,41 @@ handler.setLevel(logging.DEBUG)
 
 logger.addHandler(handler)
 
+# Owns the timeouts of every Link, so flapping links do not add threads
+link_timers = TimerScheduler(name='LinkTimers')
+# Keys of the execution retries on link_timers
+execution_retries = itertools.count()
+# Posts the executions, so a slow Executor never holds up the Link timers
+execution_pool = ThreadPoolExecutor(max_workers=EXECUTION_WORKERS)
+
 
 class Link(object):
-    def __init__(self, link, configs=[None, None]):
+    def __init__(self, link, configs=[None, None], timers=None, store=None):
         """Creates a link object to track the status of two coupled
         events.
 
+        With a store the status and the pending timeouts survive restarts
+        and are only changed with compare-and-set, so that Evaluators sharing
+        the store never activate the same event twice.
+
         :param link: Coupling information between first and second events
         :type link: dict: {1: 'First event name',
                            2: 'Second event name',
                            'default': 'default event'}
+        :param timers: Scheduler of the timeouts, defaults to link_timers
+        :type timers: TimerScheduler, optional
+        :param store: Durable store of the status, None to keep it in memory
+        :type store: LinkStore, optional
         """
         self.links = {}
         self.configs = {}
         self.timeout = 0
+        self.timers = timers or link_timers
+        self.store = store
+        self.resets = {}  # Event name to the time its timeout resets it
         event_name_1 = link[1]
         event_name_2 = link[2]
+        self.link_id = '{} <-> {}'.format(event_name_1, event_name_2)
 
         # Set the status of both events as unactivated
         self.links[event_name_1] = False
@@ -61,6 +94,46 @@ class Link(object):
         if 'timeout' in link.keys():
             self.timeout = link['timeout']
 
+        if self.store is not None:
+            self._restore()
+
+    def _restore(self):
+        """Loads the stored status, or stores the default one for a new link, and
+        schedules the timeouts that were pending when the Evaluator stopped
+        """
+        state, _ = self.store.get(self.link_id)
+        if state is None:
+            self.store.compare_and_set(self.link_id, 0, {'links': self.links, 'resets': self.resets})
+            state, _ = self.store.get(self.link_id)
+        self.links = state['links']
+        self.resets = state['resets']
+        for event_name, reset_time in self.resets.items():
+            other_event_name = self._get_other_event(self.links, event_name)
+            self.start_timer(event_name, self.configs[other_event_name], max(0, reset_time - time.time()))
+
+    def _update(self, change):
+        """Applies a change to the status, with compare-and-set against the store
+        when there is one, retrying with the latest status on conflicts
+
+        :param change: Callable taking the links and resets dicts, which it may modify
+        :return: Whatever change returned
+        """
+        if self.store is None:
+            return change(self.links, self.resets)
+        while True:
+            state, version = self.store.get(self.link_id)
+            if state is None:
+                state = {'links': dict(self.links), 'resets': dict(self.resets)}
+            links = dict(state['links'])
+            resets = dict(state['resets'])
+            result = change(links, resets)
+            unchanged = links == state['links'] and resets == state['resets']
+            if unchanged or self.store.compare_and_set(self.link_id, version, {'links': links, 'resets': resets}):
+                self.links = links
+                self.resets = resets
+                return result
+            logger.debug('%s changed concurrently, retrying', self.link_id)
+
     def _get_other_event(self, link_dict, i_event_name):
         """Gets the name of the other event in the links dict
 
@@ -94,36 +167,59 @@ class Link(object):
                  [False] otherwise
         """
         logger.info('%s is %s', event_name, self.links[event_name])
-        if self.links[event_name] is False:
-            self.links[event_name] = True
-            if self.timeout == 0:
-                other_link = self._get_other_event(self.links, event_name)
-                self.links[other_link] = False
-            else:
-                # Get other config
-                other_event_name = self._get_other_event(self.links, event_name)
-                other_config = self.configs[other_event_name]
-                self.start_timer(event_name, other_config)
+        other_event_name = self._get_other_event(self.links, event_name)
+        reset_time = time.time() + self.timeout
+
+        def activate(links, resets):
+            if links[event_name] is not False:
+                # logger.info('%s is already active', event_name)
+                return False
+            links[event_name] = True
+            if self.timeout == 0 or other_event_name in resets:
+                # Flipped back before the other event timed out, its reset is not needed anymore
+                links[other_event_name] = False
+                resets.pop(other_event_name, None)
+            if self.timeout != 0:
+                resets[event_name] = reset_time
             return True
-        # logger.info('%s is already active', event_name)
-        return False
 
-    def start_timer(self, event_name, other_config):
-        """Spawns a thread which will unlock this link after the defined timeout
+        activated = self._update(activate)
+        if self.timeout != 0 and activated:
+            self.timers.cancel(self._timer_key(other_event_name))
+            self.start_timer(event_name, self.configs[other_event_name])
+        return activated
+
+    def _timer_key(self, event_name):
+        return (id(self), event_name)
+
+    def start_timer(self, event_name, other_config, delay=None):
+        """Schedules the unlock of this link after the defined timeout,
+        replacing any pending one for the same event
 
         :param event_name: Name of event
         :type event_name: str
         :param other_config: Imported evaluation config
         :type other_config: dict
+        :param delay: Seconds until the unlock, defaults to the timeout
+        :type delay: float, optional
         """
-        logger.info('Starting Reset Thread')
-        t = threading.Thread(target=self.reset_timer, args=(event_name, other_config))
-        t.start()
+        if delay is None:
+            delay = self.timeout
+        logger.info('Scheduling reset of \'%s\' in %ss', event_name, delay)
+        self.timers.schedule(self._timer_key(event_name), delay, self.reset_timer, event_name, other_config)
 
     def reset_timer(self, event_name, other_config):
-        """Reset the lock and activation for this evaluation"""
-        time.sleep(self.timeout)
-        self.links[event_name] = False
+        """Reset the lock and activation for this evaluation, run by the
+        scheduler once the timeout passed"""
+        def reset(links, resets):
+            if resets.pop(event_name, None) is None:
+                # Already reset, eg. because the link flipped back
+                return False
+            links[event_name] = False
+            return True
+
+        if not self._update(reset):
+            return
         logger.info('Resetting \'{}\' back to inactive'.format(event_name))
         Evaluator._send_execution(other_config)
 
@@ -139,38 +235,60 @@ class Link(object):
 class Evaluator(object):
     database_url = '{}:{}'.format(DATABASE_URL, DATABASE_PORT)
     execution_url = '{}:{}/exec_command'.format(EXECUTOR_URL, EXECUTOR_PORT)
-    get_events_interval_url = '{}/get_events_interval'.format(database_url)
+    get_events_since_url = '{}/get_events_since'.format(database_url)
 
-    def __init__(self):
+    def __init__(self, autostart=True, worker_index=0, workers=1):
         """Constantly checks the database for events and will set up
         execution commands depending on the event
+
+        Several Evaluators can share the work, each one only evaluates the
+        configs of the devices that consistent hashing assigns to it and
+        keeps its own cursor. Link states are shared through the LinkStore.
+
+        :param autostart: [True] to start the evaluation loop straight away,
+                          otherwise call evaluate_once
+        :type autostart: bool, optional
+        :param worker_index: Index of this Evaluator, from 0 to workers - 1
+        :type worker_index: int, optional
+        :param workers: Number of Evaluators sharing the configs
+        :type workers: int, optional
         """
+        if not 0 <= worker_index < workers:
+            raise ValueError('worker_index has to be between 0 and {}'.format(workers - 1))
+        self.worker_index = worker_index
+        self.ring = HashRing(workers)
+        self.cursor_file = EVALUATION_CURSOR_FILE if workers == 1 else WORKER_CURSOR_FILE.format(worker_index)
+        self.store = LinkStore(LINK_STATE_FILE)
         self.configs = []
+        self.rules_by_event = {}
+        self.required_events = []
         self.events = None
         self.links = {}
+        self.e_links = []
+        self.cursor = None
 
         # Load up inital configurations
+        self._load_links()
         self._import_config()
         self._import_links()
+        self._load_cursor()
 
-        # Starting execution delta of 0
-        interval_s = datetime(1, 1, 1)
-        interval_e = datetime(1, 1, 1)
-        evaluation_duration = interval_s - interval_e
-
-        while True:
-            # StartTime = CurrentTime - TimeInThePast - TimeTakenToEvaluate
-            s = (datetime.now() - timedelta(seconds=EVALUATION_INTERVAL) - evaluation_duration).isoformat()
-            # EndTime = CurrentTime
-            e = datetime.now().isoformat()
+        while autostart:
+            self.evaluate_once()
+            time.sleep(EVALUATION_INTERVAL)
 
-            interval_s = datetime.now()
-            self._get_events(s, e)
-            self._evaluate_events()
-            interval_e = datetime.now()
+    def evaluate_once(self):
+        """Evaluates every event that was added since the last evaluation
 
-            evaluation_duration = interval_s - interval_e
-            time.sleep(EVALUATION_INTERVAL)
+        :return: [True] if the events could be retrieved, [False] otherwise
+        :rtype: bool
+        """
+        if not self._get_events():
+            return False
+        self._evaluate_events()
+        self._save_cursor()
+        logger.debug('Link timers: %s', link_timers.stats())
+        return True
 
     def _import_config(self):
         """Imports the Evaluation configuration which contain all the predefined
@@ -180,63 +298,124 @@ class Evaluator(object):
         """
         config = None
         with open(EVALUATION_CONFIG_FILE, 'r') as conf:
-            config = yaml.load(conf.read())
+            config = yaml.safe_load(conf.read())
             logging.info('Imported \'%s\'', EVALUATION_CONFIG_FILE)
         if not config:
             raise FileNotFoundError('Could not load config')
-        self.configs = config
-
-    def _import_links(self):
-        """Imports the Link configuration settings to determine which pair of
-        events are connected together
+        # Configs are sharded by device, the two configs of a link always go to the same worker
+        keys = shard_keys(config, self.e_links)
+        self.configs = [c for c in config if self.ring.owner(keys[c['name']]) == self.worker_index]
+        logger.info('Evaluating %s of %s configs as worker %s', len(self.configs), len(config), self.worker_index)
+        self._index_configs()
+
+    def _index_configs(self):
+        """Compiles the configs into an index from event name to the positions of
+        the configs that need it, so that an evaluation only touches the configs
+        of the events it received
+        """
+        self.rules_by_event = {}
+        self.required_events = []
+        for position, config in enumerate(self.configs):
+            events = set(config['events'] or [])
+            self.required_events.append(len(events))
+            for event_name in events:
+                self.rules_by_event.setdefault(event_name, []).append(position)
+
+    def _load_links(self):
+        """Loads the Link configuration settings, which pair of events are
+        connected together
 
         :raises FileNotFoundError: If link file is empty
         """
         e_links = None
         with open(EVALUATION_LINK_FILE, 'r') as f_links:
-            e_links = yaml.load(f_links.read())
+            e_links = yaml.safe_load(f_links.read())
         if not e_links:
             raise FileNotFoundError('Could not load config')
+        self.e_links = e_links
+
+    def _import_links(self):
+        """Creates a Link for each pair of connected configs of this Evaluator
 
-        for e_link in e_links:
-            for i in self.configs:
-                if i['name'] == e_link[1]:
-                    config1 = i
-                if i['name'] == e_link[2]:
-                    config2 = i
+        :raises ValueError: If a config of a Link is missing
+        """
+        configs_by_name = dict((config['name'], config) for config in self.configs)
+        for e_link in self.e_links:
+            config1 = configs_by_name.get(e_link[1])
+            config2 = configs_by_name.get(e_link[2])
+            if self.ring.workers > 1 and config1 is None and config2 is None:
+                # Belongs to the devices of another worker
+                continue
+            missing = [name for name, config in ((e_link[1], config1), (e_link[2], config2)) if config is None]
+            if missing:
+                raise ValueError('Link {} <-> {} is missing its config {}'
+                                 .format(e_link[1], e_link[2], ' and '.join(missing)))
 
-            link = Link(e_link, [config1, config2])
+            link = Link(e_link, [config1, config2], store=self.store)
             logger.info('Imported Link: %s <-> %s', e_link[1], e_link[2])
             self.links[e_link[1]] = link
             self.links[e_link[2]] = link
 
-    def _get_events(self, start_time, end_time):
-        """REST call to the database to retrieve a list of events for a
-        specified interval
-
-        :params start_time: Initial period for when to get the events
-        :type start_time: str
-        :params end_time: Final period for when to get the events
-        :type end_time: str
+    def _load_cursor(self):
+        """Loads the sequence number of the last evaluated event, so that a
+        restarted Evaluator carries on where it stopped
         """
-        self.events = []
-        # Ensure start and end times are in iso8601 format
-        query_url = '{}?start_time={}&end_time={}'.format(self.get_events_interval_url, start_time, end_time)
-        logger.info('Querying %s', query_url)
         try:
-            r = requests.get(query_url, timeout=60)
-            if r.status_code != 200:
-                logger.error('Query unsuccessful')
-                return
-        except requests.exceptions.ReadTimeout:
-            logger.info('Timed out..')
+            with open(self.cursor_file, 'r') as f:
+                self.cursor = json.load(f)['cursor']
+            logger.info('Resuming from event %s', self.cursor)
+        except (IOError, ValueError, KeyError):
+            # Without a saved cursor only events from now on are evaluated
+            self.cursor = None
+
+    def _save_cursor(self):
+        """Stores the sequence number of the last evaluated event"""
+        temp_file = '{}.tmp'.format(self.cursor_file)
+        with open(temp_file, 'w') as f:
+            json.dump({'cursor': self.cursor}, f)
+        os.replace(temp_file, self.cursor_file)
+
+    def _get_events(self):
+        """REST call to the database to retrieve every event that was added since
+        the last evaluation, following the cursor page by page
+
+        :return: [True] if the events were retrieved, [False] otherwise
+        :rtype: bool
+        """
+        self.events = []
+        cursor = self.cursor
+        if cursor is None:
+            # Start at the newest event without evaluating the history
+            limit = 0
+            cursor = 0
         else:
-            logger.info('Query successful')
-            if isinstance(r.json(), list):
-                self.events = r.json()
-            else:
-                logger.error('Something weird was returned')
-                logger.error(r.json)
+            limit = EVENTS_PAGE_SIZE
+
+        while True:
+            query_url = '{}?cursor={}&limit={}'.format(self.get_events_since_url, cursor, limit)
+            logger.debug('Querying %s', query_url)
+            try:
+                r = requests.get(query_url, timeout=60)
+                if r.status_code != 200:
+                    logger.error('Query unsuccessful')
+                    return False
+            except requests.exceptions.RequestException as e:
+                logger.error('Could not get events: %s', e)
+                return False
+
+            reply = r.json()
+            if limit == 0:
+                self.cursor = reply['head']
+                logger.info('Starting from event %s', self.cursor)
+                return True
+            self.events.extend(reply['events'])
+            cursor = reply['cursor']
+            if not reply['more']:
+                break
+
+        logger.info('Got %s new events', len(self.events))
+        self.cursor = cursor
+        return True
 
     def _evaluate_events(self):
         """Determine which events to execute based on the configuration that
@@ -249,17 +428,20 @@ class Evaluator(object):
         unique_events = set([event['name'] for event in self.events])
         logger.debug('Unique events: %s', str(unique_events))
 
-        for config in self.configs:
-            events = config['events']
-            if not events:
+        # Counts down the events each candidate config is still missing
+        missing = {}
+        for event_name in unique_events:
+            for position in self.rules_by_event.get(event_name, ()):
+                missing[position] = missing.get(position, self.required_events[position]) - 1
+
+        for position in sorted(position for position, count in missing.items() if count == 0):
+            config = self.configs[position]
+            logger.debug('Executing commands for %s', config['name'])
+            status = self._check_if_already_executed(config)
+            if status is False:
+                # logger.debug('%s already executed ... skipping', config['name'])
                 continue
-            if set(events).issubset(unique_events):
-                logger.debug('Executing commands for %s', config['name'])
-                status = self._check_if_already_executed(config)
-                if status is False:
-                    # logger.debug('%s already executed ... skipping', config['name'])
-                    continue
-                self._send_execution(config)
+            self._send_execution(config)
 
     def _check_if_already_executed(self, config):
         """Determine if the event has already been previously executed
@@ -275,14 +457,32 @@ class Evaluator(object):
         return status
 
     @staticmethod
-    def _send_execution(config):
+    def _send_execution(config, attempt=0):
+        """Sends an Execution message to the Executor in the background,
+        see _post_execution
+
+        :param config: Execution configuration for the defined event, imported from
+                       the evaluation config.
+        :type config: dict
+        :param attempt: Number of times the execution was refused already
+        :type attempt: int, optional
+        """
+        execution_pool.submit(Evaluator._post_execution, config, attempt)
+
+    @staticmethod
+    def _post_execution(config, attempt=0):
         """POST message to the Execution endpoint. Sends an Execution
         message to the Executor to carry out a series of actions based
         on what was evaluated
 
+        When the queue of the Executor is full (429) the execution is sent again
+        after Retry-After seconds, up to EXECUTION_RETRIES times.
+
         :param config: Execution configuration for the defined event, imported from
                        the evaluation config.
         :type config: dict
+        :param attempt: Number of times the execution was refused already
+        :type attempt: int, optional
         """
         try:
             # Format json output
@@ -298,12 +498,34 @@ class Evaluator(object):
             # Sent Execution message to Executor
             logging.info('Executing %s!', config['name'])
             logger.info('Posting to %s', Evaluator.execution_url)
-            r = requests.post(Evaluator.execution_url, json=body, headers=headers)
-            if r.status_code != 200:
-                logger.error('Could not send executions to the Executor, %s', r.status_code)
+            r = requests.post(Evaluator.execution_url, json=body, headers=headers, timeout=EXECUTION_TIMEOUT)
+            if r.status_code == 429 and attempt < EXECUTION_RETRIES:
+                try:
+                    delay = float(r.headers.get('Retry-After', EXECUTION_RETRY_DELAY))
+                except ValueError:
+                    delay = EXECUTION_RETRY_DELAY
+                logger.warning('Executor is busy, sending %s again in %ss', config['name'], delay)
+                link_timers.schedule(('execution', next(execution_retries)), delay,
+                                     Evaluator._send_execution, config, attempt + 1)
+            # The Executor accepts the commands with 202 and runs them in the background
+            elif r.status_code not in (200, 202):
+                logger.error('Could not send %s to the Executor after %s attempts, %s',
+                             config['name'], attempt + 1, r.status_code)
         except Exception as e:
             logger.error(e)
 
 
+def parse_worker_args(description):
+    """Parses the sharding options shared by the Evaluator and the rule engine
+
+    :rtype: argparse.Namespace
+    """
+    arg_parser = argparse.ArgumentParser(description=description)
+    arg_parser.add_argument('--worker-index', type=int, default=0, help='Index of this Evaluator, from 0')
+    arg_parser.add_argument('--workers', type=int, default=1, help='Number of Evaluators sharing the devices')
+    return arg_parser.parse_args()
+
+
 if __name__ == '__main__':
-    Evaluator()
+    options = parse_worker_args('Evaluates the Events of the Database')
+    Evaluator(worker_index=options.worker_index, workers=options.workers)
@@ -0,0 +1,72 @@
+import json
+import logging
+import sqlite3
+import threading
+
+# Constants
+LINK_STATE_FILE = 'link_state.db'
+BUSY_TIMEOUT = 30  # seconds to wait for another Evaluator to finish writing
+
+# Logging
+logger = logging.getLogger(__name__)
+
+
+class LinkStore(object):
+    def __init__(self, path=LINK_STATE_FILE):
+        """Durable Link states shared by every Evaluator process on the host
+
+        Each Link is one row holding its state as JSON and a version number
+        which is incremented on every change. Changes are only written with
+        compare_and_set, so two Evaluators can never both activate the same
+        event.
+
+        :param path: SQLite file of the states
+        :type path: str
+        """
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, timeout=BUSY_TIMEOUT, check_same_thread=False, isolation_level=None)
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        self._conn.execute('CREATE TABLE IF NOT EXISTS link_state ('
+                           'link TEXT PRIMARY KEY, '
+                           'state TEXT NOT NULL, '
+                           'version INTEGER NOT NULL)')
+
+    def get(self, link_id):
+        """Reads the state of a Link
+
+        :param link_id: Identifier of the Link
+        :type link_id: str
+        :return: The state and its version, (None, 0) if it was never stored
+        :rtype: tuple
+        """
+        with self._lock:
+            row = self._conn.execute('SELECT state, version FROM link_state WHERE link = ?', (link_id,)).fetchone()
+        if row is None:
+            return None, 0
+        return json.loads(row[0]), row[1]
+
+    def compare_and_set(self, link_id, version, state):
+        """Stores the state of a Link if it is still at the version it was read at
+
+        :param link_id: Identifier of the Link
+        :type link_id: str
+        :param version: Version returned by get, 0 for a Link that was never stored
+        :type version: int
+        :param state: New state, anything that can be serialised to JSON
+        :return: [True] if the state was stored, [False] if it changed in the meantime
+        :rtype: bool
+        """
+        state_json = json.dumps(state, sort_keys=True)
+        with self._lock:
+            if version == 0:
+                cursor = self._conn.execute('INSERT OR IGNORE INTO link_state (link, state, version) VALUES (?, ?, 1)',
+                                            (link_id, state_json))
+            else:
+                cursor = self._conn.execute('UPDATE link_state SET state = ?, version = version + 1 '
+                                            'WHERE link = ? AND version = ?', (state_json, link_id, version))
+        return cursor.rowcount == 1
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
@@ -0,0 +1,276 @@
+import calendar
+import json
+import logging
+import time
+from collections import deque
+from datetime import datetime
+
+import requests
+
+from evaluate import EVALUATION_INTERVAL, Evaluator, parse_worker_args
+
+# Constants
+DEFAULT_WINDOW = EVALUATION_INTERVAL  # seconds, matches what a single polling evaluation used to see
+STREAM_READ_TIMEOUT = 60  # seconds, the Database sends a keep-alive every 15s
+STREAM_RETRY_INTERVAL = 30  # seconds of polling the event feed before reconnecting to the stream
+FALLBACK_POLL_INTERVAL = 1  # seconds between polls of the event feed while the stream is down
+CURSOR_SAVE_INTERVAL = 1  # seconds between writes of the cursor file
+ISO_FORMATS = (
+    '%Y-%m-%dT%H:%M:%S.%f',
+    '%Y-%m-%dT%H:%M:%S',
+    '%Y-%m-%d %H:%M:%S.%f',
+    '%Y-%m-%d %H:%M:%S',
+)
+
+# Logging
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.INFO)
+
+handler = logging.StreamHandler()
+handler.setLevel(logging.DEBUG)
+
+logger.addHandler(handler)
+
+
+def event_time(event):
+    """Gets the time of an Event in seconds
+
+    Timestamps are compared with each other only, so they are all treated as UTC.
+
+    :param event: Event as sent by the Database
+    :type event: dict
+    :return: Seconds since the epoch, None if the Event has no readable timestamp
+    :rtype: float
+    """
+    for iso_format in ISO_FORMATS:
+        try:
+            date = datetime.strptime(event.get('time'), iso_format)
+        except (TypeError, ValueError):
+            continue
+        return calendar.timegm(date.timetuple()) + date.microsecond / 1e6
+    return None
+
+
+class WindowedRule(object):
+    def __init__(self, config, default_window=DEFAULT_WINDOW):
+        """Incrementally evaluated condition of an evaluation config
+
+        The config fires when every one of its events occurred at least count
+        times within window seconds, and in the listed order if ordered is set.
+        These keys extend the evaluation_config.yaml format:
+
+            window: 60      # seconds, defaults to DEFAULT_WINDOW
+            count: 3        # occurrences of each event, defaults to 1
+            ordered: true   # events have to occur in the listed order, defaults to false
+
+        The collector only sends states when they change (and as a heartbeat), so
+        count occurrences within a window mean the state was entered count times,
+        ie. it flapped.
+
+        :param config: Evaluation config
+        :type config: dict
+        :param default_window: Window of configs without a window key
+        :type default_window: float
+        """
+        self.config = config
+        self.events = list(config['events'] or [])
+        self.window = float(config.get('window', default_window))
+        self.count = int(config.get('count', 1))
+        self.ordered = bool(config.get('ordered', False))
+        self._occurrences = dict((event_name, deque()) for event_name in self.events)
+        self._latest = None
+
+    def observe(self, event_name, timestamp):
+        """Records an occurrence of one of the events of the rule
+
+        The occurrences are cleared when the rule fires, so every firing needs
+        new occurrences of all events.
+
+        :param event_name: Name of the Event
+        :type event_name: str
+        :param timestamp: Time of the Event in seconds
+        :type timestamp: float
+        :return: [True] if the rule fired
+        :rtype: bool
+        """
+        if self._latest is None or timestamp > self._latest:
+            self._latest = timestamp
+        horizon = self._latest - self.window
+        if timestamp < horizon:
+            # Arrived too late to be within the window of the newest occurrence
+            return False
+
+        occurrences = self._occurrences[event_name]
+        if occurrences and timestamp < occurrences[-1]:
+            # Keeps the occurrences sorted when the feed is slightly out of order
+            occurrences = deque(sorted(list(occurrences) + [timestamp]))
+            self._occurrences[event_name] = occurrences
+        else:
+            occurrences.append(timestamp)
+
+        for times in self._occurrences.values():
+            while times and times[0] < horizon:
+                times.popleft()
+            if len(times) < self.count:
+                return False
+        if self.ordered and not self._in_order():
+            return False
+
+        for times in self._occurrences.values():
+            times.clear()
+        return True
+
+    def _in_order(self):
+        # Greedily takes the earliest occurrences of each event that follow
+        # the ones taken for the previous event
+        previous = None
+        for event_name in self.events:
+            times = [t for t in self._occurrences[event_name] if previous is None or t > previous]
+            if len(times) < self.count:
+                return False
+            previous = times[self.count - 1]
+        return True
+
+
+class RuleEngine(object):
+    def __init__(self, configs, default_window=DEFAULT_WINDOW):
+        """Evaluates the evaluation configs one Event at a time, only touching
+        the rules that mention the Event
+
+        :param configs: Evaluation configs
+        :type configs: list
+        :param default_window: Window of configs without a window key
+        :type default_window: float
+        """
+        self.rules = []
+        self.rules_by_event = {}
+        for config in configs:
+            if not config['events']:
+                continue
+            rule = WindowedRule(config, default_window)
+            self.rules.append(rule)
+            for event_name in set(rule.events):
+                self.rules_by_event.setdefault(event_name, []).append(rule)
+
+    def process(self, event):
+        """Feeds an Event to the rules that mention it
+
+        :param event: Event with at least a name and a time
+        :type event: dict
+        :return: Configs of the rules that fired
+        :rtype: list
+        """
+        rules = self.rules_by_event.get(event['name'])
+        if not rules:
+            return []
+        timestamp = event_time(event)
+        if timestamp is None:
+            # Its arrival time would not order correctly against the other Events
+            logger.warning('Skipping %s %s, its time %r cannot be read', event['name'], event.get('uuid'),
+                           event.get('time'))
+            return []
+        return [rule.config for rule in rules if rule.observe(event['name'], timestamp)]
+
+
+class StreamingEvaluator(Evaluator):
+    stream_url = '{}/stream?topics=events'.format(Evaluator.database_url)
+
+    def __init__(self, default_window=DEFAULT_WINDOW, autostart=True, worker_index=0, workers=1):
+        """Evaluates Events as soon as the Database streams them, instead of
+        every EVALUATION_INTERVAL, with the windowed rules of RuleEngine
+
+        Falls back to polling the cursor feed of the Database while the stream
+        cannot be reached. Links, executions and the cursor file are the same
+        as for the Evaluator. Rule windows only live in memory.
+
+        :param default_window: Window of configs without a window key
+        :type default_window: float
+        :param autostart: [True] to start consuming Events straight away,
+                          otherwise call run
+        :type autostart: bool, optional
+        :param worker_index: Index of this Evaluator, from 0 to workers - 1
+        :type worker_index: int, optional
+        :param workers: Number of Evaluators sharing the configs
+        :type workers: int, optional
+        """
+        super(StreamingEvaluator, self).__init__(autostart=False, worker_index=worker_index, workers=workers)
+        self.engine = RuleEngine(self.configs, default_window)
+        self._cursor_saved_at = 0
+        self._saved_cursor = self.cursor
+        if autostart:
+            self.run()
+
+    def run(self):
+        """Consumes the stream forever, polling the cursor feed whenever the
+        stream is unavailable
+        """
+        while True:
+            try:
+                self._consume_stream()
+            except (requests.exceptions.RequestException, ValueError) as e:
+                logger.error('Event stream unavailable (%s), polling for %ss', e, STREAM_RETRY_INTERVAL)
+            self._poll_until(time.time() + STREAM_RETRY_INTERVAL)
+
+    def handle_event(self, event):
+        """Evaluates a single Event and sends the executions of the rules it
+        completed
+
+        :param event: Event as sent by the Database, with its sequence number
+        :type event: dict
+        """
+        for config in self.engine.process(event):
+            logger.debug('Executing commands for %s', config['name'])
+            if self._check_if_already_executed(config):
+                self._send_execution(config)
+        if 'seq' in event:
+            self.cursor = event['seq']
+        if time.time() - self._cursor_saved_at >= CURSOR_SAVE_INTERVAL:
+            self._flush_cursor()
+
+    def _flush_cursor(self):
+        if self.cursor != self._saved_cursor:
+            self._save_cursor()
+            self._saved_cursor = self.cursor
+        self._cursor_saved_at = time.time()
+
+    def _consume_stream(self):
+        headers = {}
+        if self.cursor is not None:
+            # The stream resumes after the Event cursor, executions are not requested
+            headers['Last-Event-ID'] = '{}:0'.format(self.cursor)
+        logger.info('Connecting to %s', self.stream_url)
+        with requests.get(self.stream_url, headers=headers, stream=True,
+                          timeout=(10, STREAM_READ_TIMEOUT)) as r:
+            if r.status_code != 200:
+                raise requests.exceptions.HTTPError('Stream returned {}'.format(r.status_code))
+            r.encoding = r.encoding or 'utf-8'
+            message = {}
+            # The stream is chunked, so each chunk is handed over as soon as it arrives
+            for line in r.iter_lines(chunk_size=None, decode_unicode=True):
+                if line:
+                    field, _, value = line.partition(':')
+                    if not field:
+                        # Keep-alive comment, the stream is idle
+                        self._flush_cursor()
+                    message[field] = value[1:] if value.startswith(' ') else value
+                    continue
+                if message.get('event') == 'event' and 'data' in message:
+                    self.handle_event(json.loads(message['data']))
+                message = {}
+        raise requests.exceptions.ConnectionError('Stream closed by the Database')
+
+    def _poll_until(self, deadline):
+        while time.time() < deadline:
+            if self._get_events():
+                cursor = self.cursor
+                for event in self.events:
+                    self.handle_event(event)
+                # _get_events already moved to the end of the feed
+                self.cursor = cursor
+                self._flush_cursor()
+            time.sleep(FALLBACK_POLL_INTERVAL)
+
+
+if __name__ == '__main__':
+    options = parse_worker_args('Evaluates the Events streamed by the Database')
+    StreamingEvaluator(worker_index=options.worker_index, workers=options.workers)
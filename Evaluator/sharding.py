@@ -0,0 +1,88 @@
+import bisect
+import hashlib
+
+# Constants
+VIRTUAL_NODES = 100  # points per worker on the ring, evens out the share of each worker
+
+
+def config_device(config):
+    """Gets the network device an evaluation config is about, from its device
+    key or else from the suffix of its first event (eg. P1 for bgp.peers.down.P1)
+
+    :param config: Evaluation config
+    :type config: dict
+    :return: Name of the device, None if the config has no events
+    :rtype: str
+    """
+    if config.get('device'):
+        return str(config['device'])
+    if not config.get('events'):
+        return None
+    return config['events'][0].rsplit('.', 1)[-1]
+
+
+def shard_keys(configs, links):
+    """Gets the key each evaluation config is sharded by, its device, except
+    that configs coupled by links share the key of the first of them, so that a
+    worker always holds both configs of its links
+
+    :param configs: Evaluation configs, in file order
+    :type configs: list
+    :param links: Links between configs (see evaluation_link.yaml)
+    :type links: list
+    :return: Config name to its shard key
+    :rtype: dict
+    """
+    # Union-find over config names, the root of a group is its first config
+    position = dict((config['name'], i) for i, config in enumerate(configs))
+    parent = {}
+
+    def find(name):
+        while parent.get(name, name) != name:
+            name = parent[name]
+        return name
+
+    for link in links:
+        root1, root2 = find(link[1]), find(link[2])
+        if root1 != root2:
+            first, second = sorted((root1, root2), key=lambda name: position.get(name, len(position)))
+            parent[second] = first
+
+    keys = dict((config['name'], config_device(config) or config['name']) for config in configs)
+    return dict((name, keys.get(find(name), find(name))) for name in keys)
+
+
+def _hash(key):
+    return int(hashlib.md5(key.encode('utf-8')).hexdigest()[:16], 16)
+
+
+class HashRing(object):
+    def __init__(self, workers, virtual_nodes=VIRTUAL_NODES):
+        """Consistent hashing of devices to Evaluator workers, so that changing
+        the number of workers only moves the devices of about one worker
+
+        :param workers: Number of Evaluator workers
+        :type workers: int
+        :param virtual_nodes: Points per worker on the ring
+        :type virtual_nodes: int
+        """
+        if workers < 1:
+            raise ValueError('There has to be at least one worker')
+        self.workers = workers
+        points = sorted((_hash('{}-{}'.format(worker, node)), worker)
+                        for worker in range(workers) for node in range(virtual_nodes))
+        self._hashes = [point[0] for point in points]
+        self._workers = [point[1] for point in points]
+
+    def owner(self, key):
+        """Gets the worker a key (eg. a device name) belongs to
+
+        :param key: Key to place on the ring
+        :type key: str
+        :return: Index of the worker, from 0 to workers - 1
+        :rtype: int
+        """
+        if self.workers == 1:
+            return 0
+        position = bisect.bisect(self._hashes, _hash(key)) % len(self._hashes)
+        return self._workers[position]
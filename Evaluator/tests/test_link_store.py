@@ -0,0 +1,68 @@
+import threading
+
+import pytest
+
+from link_store import LinkStore
+
+
+@pytest.fixture
+def stores(tmp_path):
+    """Two stores on the same file, as two Evaluator processes would open it"""
+    path = str(tmp_path / 'link_state.db')
+    first, second = LinkStore(path), LinkStore(path)
+    yield first, second
+    first.close()
+    second.close()
+
+
+def test_unknown_link_is_at_version_0(stores):
+    assert stores[0].get('P1 Interface Up') == (None, 0)
+
+
+def test_only_one_store_creates_a_link(stores):
+    first, second = stores
+    assert first.compare_and_set('P1 Interface Up', 0, {'active': 1})
+    assert not second.compare_and_set('P1 Interface Up', 0, {'active': 2})
+    assert second.get('P1 Interface Up') == ({'active': 1}, 1)
+
+
+def test_stale_version_is_refused(stores):
+    first, second = stores
+    first.compare_and_set('P1 Interface Up', 0, {'active': 1})
+    _, version = second.get('P1 Interface Up')
+
+    assert first.compare_and_set('P1 Interface Up', version, {'active': 2})
+    assert not second.compare_and_set('P1 Interface Up', version, {'active': 1})
+    assert second.get('P1 Interface Up') == ({'active': 2}, 2)
+
+    # Read again, the change is based on the current state
+    state, version = second.get('P1 Interface Up')
+    assert second.compare_and_set('P1 Interface Up', version, {'active': 1})
+    assert first.get('P1 Interface Up') == ({'active': 1}, 3)
+
+
+def test_links_are_versioned_separately(stores):
+    first, second = stores
+    first.compare_and_set('P1 Interface Up', 0, {'active': 1})
+    assert second.compare_and_set('P2 Interface Up', 0, {'active': 2})
+    assert first.get('P2 Interface Up') == ({'active': 2}, 1)
+
+
+def test_no_change_is_lost_under_contention(stores):
+    increments = 50
+
+    def increment(store):
+        for _ in range(increments):
+            while True:
+                state, version = store.get('P1 Interface Up')
+                count = state['count'] if state else 0
+                if store.compare_and_set('P1 Interface Up', version, {'count': count + 1}):
+                    break
+
+    threads = [threading.Thread(target=increment, args=(store,)) for store in stores + stores]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert stores[0].get('P1 Interface Up') == ({'count': 4 * increments}, 4 * increments)
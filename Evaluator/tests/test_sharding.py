@@ -0,0 +1,65 @@
+import os
+
+import pytest
+import yaml
+
+from sharding import HashRing, config_device, shard_keys
+
+EVALUATOR_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def config(name, *events, **keys):
+    config = {'name': name, 'events': list(events)}
+    config.update(keys)
+    return config
+
+
+def link(name1, name2):
+    return {1: name1, 2: name2, 'default': 1}
+
+
+def test_config_device():
+    assert config_device(config('P1 BGP Peers Down', 'bgp.peers.down.P1')) == 'P1'
+    assert config_device(config('Core Down', 'bgp.peers.down.P1', device='PE2')) == 'PE2'
+    assert config_device(config('Nothing')) is None
+
+
+def test_unlinked_configs_are_keyed_by_device():
+    configs = [config('P1 Interface Down', 'oper_status.interface.down.P1'),
+               config('P2 Interface Down', 'oper_status.interface.down.P2'),
+               config('Nothing')]
+    assert shard_keys(configs, []) == {'P1 Interface Down': 'P1', 'P2 Interface Down': 'P2', 'Nothing': 'Nothing'}
+
+
+def test_linked_configs_share_the_key_of_the_first_config():
+    configs = [config('P2 Interface Up', 'oper_status.interface.up.P2'),
+               config('P1 Interface Down', 'oper_status.interface.down.P1'),
+               config('P3 Interface Down', 'oper_status.interface.down.P3')]
+    keys = shard_keys(configs, [link('P1 Interface Down', 'P2 Interface Up')])
+    assert keys == {'P2 Interface Up': 'P2', 'P1 Interface Down': 'P2', 'P3 Interface Down': 'P3'}
+
+
+def test_chained_links_form_one_group():
+    configs = [config('A', 'a.P1'), config('B', 'b.P2'), config('C', 'c.P3'), config('D', 'd.P4')]
+    keys = shard_keys(configs, [link('C', 'D'), link('B', 'C'), link('A', 'B')])
+    assert set(keys.values()) == {'P1'}
+
+
+@pytest.mark.parametrize('workers', [1, 2, 3, 5])
+def test_every_link_lands_on_one_worker(workers):
+    with open(os.path.join(EVALUATOR_DIR, 'evaluation_config.yaml')) as f:
+        configs = yaml.safe_load(f)
+    with open(os.path.join(EVALUATOR_DIR, 'evaluation_link.yaml')) as f:
+        links = yaml.safe_load(f)
+
+    ring = HashRing(workers)
+    keys = shard_keys(configs, links)
+    owners = dict((name, ring.owner(key)) for name, key in keys.items())
+    assert set(owners.values()) <= set(range(workers))
+    for e_link in links:
+        assert owners[e_link[1]] == owners[e_link[2]]
+
+
+def test_ring_needs_a_worker():
+    with pytest.raises(ValueError):
+        HashRing(0)
@@ -0,0 +1,119 @@
+import heapq
+import itertools
+import logging
+import threading
+import time
+
+# Constants
+COMPACT_MIN_SIZE = 64  # Heaps smaller than this are never compacted
+
+# Logging
+logger = logging.getLogger(__name__)
+
+
+class TimerScheduler(object):
+    def __init__(self, name='TimerScheduler'):
+        """Runs delayed callbacks on a single thread, ordered in a heap by due time
+
+        Every timer has a key, scheduling a key that is already pending
+        reschedules it, and a pending key can be cancelled. Cancelled and
+        rescheduled entries stay in the heap until they are due and are then
+        skipped, unless they outnumber the pending timers, in which case the
+        heap is rebuilt from the pending timers only. The thread is started with
+        the first timer.
+
+        :param name: Name of the scheduler thread
+        :type name: str
+        """
+        self.name = name
+        self._heap = []
+        self._timers = {}
+        self._sequence = itertools.count()
+        self._condition = threading.Condition()
+        self._thread = None
+        self._fired = 0
+        self._cancelled = 0
+
+    def schedule(self, key, delay, fn, *args):
+        """Calls fn(*args) after delay seconds, replacing any pending timer of key
+
+        :param key: Hashable identifier of the timer
+        :param delay: Seconds to wait
+        :type delay: float
+        :param fn: Callable run on the scheduler thread, it should not block for long
+        """
+        due = time.time() + delay
+        entry = (due, next(self._sequence), key)
+        with self._condition:
+            self._timers[key] = (entry, fn, args)
+            heapq.heappush(self._heap, entry)
+            self._compact()
+            if self._thread is None:
+                self._thread = threading.Thread(name=self.name, target=self._run)
+                self._thread.daemon = True
+                self._thread.start()
+            if self._heap[0] is entry:
+                self._condition.notify()
+
+    def cancel(self, key):
+        """Cancels the pending timer of key
+
+        :return: [True] if a timer was pending
+        :rtype: bool
+        """
+        with self._condition:
+            if self._timers.pop(key, None) is None:
+                return False
+            self._cancelled += 1
+            self._compact()
+            return True
+
+    def is_pending(self, key):
+        """[True] if key has a timer that has not fired yet"""
+        with self._condition:
+            return key in self._timers
+
+    def pending(self):
+        """Number of timers that have not fired yet"""
+        with self._condition:
+            return len(self._timers)
+
+    def stats(self):
+        """Number of pending, fired and cancelled timers, and of entries in the heap
+
+        :rtype: dict
+        """
+        with self._condition:
+            return {'pending': len(self._timers), 'fired': self._fired, 'cancelled': self._cancelled,
+                    'heap': len(self._heap)}
+
+    def _compact(self):
+        # Called with the lock held, drops the stale entries once they are more
+        # than half of the heap, so that links rescheduled or cancelled over and
+        # over do not grow it without bound
+        if len(self._heap) < COMPACT_MIN_SIZE or len(self._heap) <= 2 * len(self._timers):
+            return
+        self._heap = [timer[0] for timer in self._timers.values()]
+        heapq.heapify(self._heap)
+
+    def _run(self):
+        while True:
+            with self._condition:
+                while True:
+                    # Drop the entries of cancelled and rescheduled timers
+                    while self._heap and self._timers.get(self._heap[0][2], (None,))[0] is not self._heap[0]:
+                        heapq.heappop(self._heap)
+                    if not self._heap:
+                        self._condition.wait()
+                        continue
+                    delay = self._heap[0][0] - time.time()
+                    if delay <= 0:
+                        break
+                    self._condition.wait(delay)
+                entry = heapq.heappop(self._heap)
+                _, fn, args = self._timers.pop(entry[2])
+                self._fired += 1
+            try:
+                fn(*args)
+            except Exception as e:
+                logger.exception('Timer %s failed: %s', entry[2], e)
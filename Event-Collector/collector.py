@@ -1,3 +1,4 @@
+import argparse
 import ast
 import logging
 import threading
@@ -7,6 +8,7 @@ from flask_restful import Api, Resource, reqparse
 from gevent.pywsgi import WSGIServer
 
 from lib.appformix_collector import AppformixCollector
+from lib.device_simulator import DeviceSimulator
 from lib.junos_collector import JunosCollector
 
 # Constants
@@ -29,10 +31,18 @@ logger = logging.getLogger(__name__)
 logger.setLevel(logging.INFO)
 logger.addHandler(handler)
 
+ds_logger = logging.getLogger('lib.device_simulator')
+ds_logger.setLevel(logging.INFO)
+ds_logger.addHandler(handler)
+
 jc_logger = logging.getLogger('lib.junos_collector')
 jc_logger.setLevel(logging.DEBUG)
 jc_logger.addHandler(handler)
 
+es_logger = logging.getLogger('lib.event_shipper')
+es_logger.setLevel(logging.INFO)
+es_logger.addHandler(handler)
+
 ac_logger = logging.getLogger('lib.appformix_collector')
 ac_logger.setLevel(logging.DEBUG)
 ac_logger.addHandler(handler)
@@ -42,15 +52,25 @@ ac = AppformixCollector()
 
 
 class Collector(object):
-    def __init__(self):
+    def __init__(self, simulator_config=None):
         """Instantiates Collector modules in separate threads to monitor data
 
         Modules
         -------
         JunosCollector: Monitor Junos network device statuses
+
+        :param simulator_config: Path to a simulator scenario, to collect from simulated
+                                 devices instead of the ones in DEVICE_CONFIG
+        :type simulator_config: str, optional
         """
+        jc_kwargs = {}
+        if simulator_config:
+            logger.info('Simulating the network devices of \'%s\'', simulator_config)
+            jc_kwargs['device_factory'], jc_kwargs['device_config'] = DeviceSimulator.from_config(simulator_config)
+
         threads = []
-        jc_thread = threading.Thread(name='JunosCollector', target=JunosCollector, args=(DEVICE_CONFIG,))
+        jc_thread = threading.Thread(name='JunosCollector', target=JunosCollector, args=(DEVICE_CONFIG,),
+                                     kwargs=jc_kwargs)
         jc_thread.daemon = True
 
         threads.append(jc_thread)
@@ -89,4 +109,8 @@ api.add_resource(AppformixCollectorAPI, '/appformix')
 
 
 if __name__ == '__main__':
-    Collector()
+    arg_parser = argparse.ArgumentParser(description='Collects Events from the network devices')
+    arg_parser.add_argument('--simulate', metavar='SCENARIO',
+                            help='Collect from simulated devices (eg. config/simulator.yaml)')
+    options = arg_parser.parse_args()
+    Collector(simulator_config=options.simulate)
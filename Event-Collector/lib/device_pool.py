@@ -0,0 +1,107 @@
+import logging
+import threading
+from collections import defaultdict, deque
+from concurrent.futures import Future, ThreadPoolExecutor
+
+# Constants
+MAX_WORKERS = 32
+MAX_RPCS_PER_DEVICE = 1
+
+# Logging
+logger = logging.getLogger(__name__)
+
+
+class DevicePool(object):
+    def __init__(self, max_workers=MAX_WORKERS, max_per_device=MAX_RPCS_PER_DEVICE):
+        """Bounded thread pool which runs work for many network devices in parallel
+        while limiting how much work runs against any single device at once.
+
+        Work for a device that is already at its limit waits in a per-device queue
+        instead of occupying a worker thread, so a slow device never starves the
+        others.
+
+        :param max_workers: Number of worker threads shared by every device
+        :type max_workers: int
+        :param max_per_device: Default number of concurrent jobs per device
+        :type max_per_device: int
+        """
+        self.max_per_device = max_per_device
+        self.device_limits = {}
+        self._executor = ThreadPoolExecutor(max_workers=max_workers)
+        self._lock = threading.Lock()
+        self._running = defaultdict(int)
+        self._waiting = defaultdict(deque)
+
+    def set_device_limit(self, device_name, limit):
+        """Overrides the number of concurrent jobs allowed for a single device
+
+        :param device_name: Name of the network device
+        :type device_name: str
+        :param limit: Maximum number of concurrent jobs
+        :type limit: int
+        """
+        self.device_limits[device_name] = max(1, int(limit))
+
+    def submit(self, device_name, fn, *args, **kwargs):
+        """Schedules fn to run against a device as soon as the device has a free slot
+
+        :param device_name: Name of the network device the job runs against
+        :type device_name: str
+        :param fn: Callable to run
+        :return: Future holding the result of fn
+        :rtype: concurrent.futures.Future
+        """
+        future = Future()
+        job = (future, fn, args, kwargs)
+        limit = self.device_limits.get(device_name, self.max_per_device)
+        with self._lock:
+            if self._running[device_name] >= limit:
+                self._waiting[device_name].append(job)
+                return future
+            self._running[device_name] += 1
+        self._executor.submit(self._run, device_name, job)
+        return future
+
+    def map_devices(self, device_names, fn, *args, **kwargs):
+        """Runs fn(device_name, *args, **kwargs) for every device and waits for
+        all of them to finish
+
+        :param device_names: Names of the network devices
+        :type device_names: list
+        :param fn: Callable that takes the device name as its first argument
+        :return: Device name to Future
+        :rtype: dict
+        """
+        futures = {}
+        for device_name in device_names:
+            futures[device_name] = self.submit(device_name, fn, device_name, *args, **kwargs)
+        for future in futures.values():
+            try:
+                future.result()
+            except Exception:
+                # Errors are left on the future for the caller to inspect
+                pass
+        return futures
+
+    def _run(self, device_name, job):
+        while job is not None:
+            future, fn, args, kwargs = job
+            if future.set_running_or_notify_cancel():
+                try:
+                    result = fn(*args, **kwargs)
+                except Exception as e:
+                    future.set_exception(e)
+                else:
+                    future.set_result(result)
+
+            # Keep this worker on the same device while it has queued jobs
+            with self._lock:
+                if self._waiting[device_name]:
+                    job = self._waiting[device_name].popleft()
+                else:
+                    job = None
+                    self._running[device_name] -= 1
+
+    def shutdown(self, wait=True):
+        """Stops the worker threads once all submitted jobs have finished"""
+        self._executor.shutdown(wait=wait)
@@ -0,0 +1,245 @@
+import logging
+import os
+import threading
+import time
+
+import yaml
+from jnpr.junos.exception import ConnectError, RpcError
+from lxml import etree
+
+# Constants
+REPLIES_DIRECTORY = 'config/simulator'
+DEVICE_NAME_FORMAT = 'sim-{:04d}'
+FAILURE_ACTIONS = ('disconnect', 'recover', 'rpc_error', 'reply', 'latency')
+
+# Logging
+logger = logging.getLogger(__name__)
+
+
+class DeviceSimulator(object):
+    def __init__(self, replies_directory=REPLIES_DIRECTORY, latency=0, failures=None):
+        """Stands in for jnpr.junos.Device so the collector and the Executor can
+        run against thousands of synthetic devices in-process, without a network
+
+        RPC replies are replayed from recorded XML files. The file for an RPC is
+        looked up as <replies_directory>/<device name>/<rpc-name>.xml first and
+        then as <replies_directory>/<rpc-name>.xml (eg. get-interface-information.xml),
+        so every device shares the recorded replies unless it has its own.
+        Files are parsed once and shared between devices, so callers must not
+        modify the replies.
+
+        Failures are either scripted with failures, relative to when the
+        simulator was created, or set directly with the disconnect,
+        fail_rpc, set_reply and set_latency methods.
+
+        :param replies_directory: Directory of the recorded replies
+        :type replies_directory: str
+        :param latency: Seconds every RPC takes
+        :type latency: float
+        :param failures: Scripted failures, each a dict with 'at' (seconds after start),
+                         'device', 'action' (one of FAILURE_ACTIONS) and the arguments
+                         of the action ('rpc', 'count', 'reply', 'latency')
+        :type failures: list
+        """
+        self.replies_directory = replies_directory
+        self.latency = latency
+        self.devices = {}
+        self.rpc_count = 0
+        self._replies = {}
+        self._overrides = {}
+        self._rpc_failures = {}
+        self._latencies = {}
+        self._disconnected = set()
+        self._lock = threading.Lock()
+        self._start = time.time()
+        self._failures = sorted(failures or [], key=lambda failure: failure['at'])
+        for failure in self._failures:
+            if failure['action'] not in FAILURE_ACTIONS:
+                raise ValueError('Unknown simulator action \'{}\''.format(failure['action']))
+
+    @classmethod
+    def from_config(cls, config_path):
+        """Creates a simulator from a yaml scenario
+
+        :param config_path: Path to the scenario (eg. config/simulator.yaml)
+        :type config_path: str
+        :return: The simulator and a collector device config for the synthetic devices,
+                 with the same layout as devices.yaml
+        :rtype: tuple
+        """
+        with open(config_path, 'r') as f:
+            config = yaml.safe_load(f.read())
+        simulator = cls(replies_directory=config.get('replies', REPLIES_DIRECTORY),
+                        latency=config.get('latency', 0),
+                        failures=config.get('failures'))
+        device_config = {'devices': simulator.device_configs(config.get('devices', 1))}
+        for key in ('heartbeat_interval', 'monitored_interfaces', 'monitored_devices'):
+            if key in config:
+                device_config[key] = config[key]
+        return simulator, device_config
+
+    def device_configs(self, count):
+        """Generates the entries of a devices.yaml for synthetic devices
+
+        :param count: Number of devices
+        :type count: int
+        :return: Device configs with a name, ip, user and password
+        :rtype: list
+        """
+        return [{'name': DEVICE_NAME_FORMAT.format(i), 'ip': DEVICE_NAME_FORMAT.format(i),
+                 'user': 'simulator', 'password': 'simulator'}
+                for i in range(count)]
+
+    def __call__(self, host, **kwargs):
+        """Creates a simulated device, with the same arguments as jnpr.junos.Device
+
+        The host is used as the device name.
+
+        :param host: Name of the simulated device
+        :type host: str
+        :rtype: SimulatedDevice
+        """
+        device = SimulatedDevice(self, host)
+        with self._lock:
+            self.devices[host] = device
+        return device
+
+    def disconnect(self, device_name):
+        """Makes a device refuse connections and RPCs until it recovers"""
+        with self._lock:
+            self._disconnected.add(device_name)
+
+    def recover(self, device_name):
+        """Undoes disconnect and any pending RPC failures of a device"""
+        with self._lock:
+            self._disconnected.discard(device_name)
+            for key in [key for key in self._rpc_failures if key[0] == device_name]:
+                del self._rpc_failures[key]
+
+    def fail_rpc(self, device_name, rpc_name, count=1):
+        """Makes the next count calls of an RPC on a device raise RpcError"""
+        with self._lock:
+            self._rpc_failures[(device_name, rpc_name)] = count
+
+    def set_reply(self, device_name, rpc_name, reply_name):
+        """Replays a different recorded reply for an RPC of a device
+        (eg. 'get-interface-information-down' for an interface failure)
+
+        :param reply_name: Name of the reply file without .xml, None to go back
+                           to the default reply
+        :type reply_name: str
+        """
+        with self._lock:
+            if reply_name is None:
+                self._overrides.pop((device_name, rpc_name), None)
+            else:
+                self._overrides[(device_name, rpc_name)] = reply_name
+
+    def set_latency(self, device_name, latency):
+        """Overrides the seconds every RPC on a device takes"""
+        with self._lock:
+            self._latencies[device_name] = latency
+
+    def check_connect(self, device):
+        self._apply_failures()
+        if device.name in self._disconnected:
+            raise ConnectError(device, 'Simulated connection failure')
+
+    def rpc(self, device, rpc_name, **kwargs):
+        """Replies to an RPC called on a simulated device
+
+        :raises ConnectError: If the device is disconnected
+        :raises RpcError: If a failure is scheduled for the RPC
+        :return: The recorded reply
+        :rtype: lxml.etree._Element
+        """
+        self._apply_failures()
+        latency = self._latencies.get(device.name, self.latency)
+        if latency:
+            time.sleep(latency)
+        with self._lock:
+            self.rpc_count += 1
+            if device.name in self._disconnected:
+                raise ConnectError(device, 'Simulated connection failure')
+            remaining = self._rpc_failures.get((device.name, rpc_name))
+            if remaining:
+                self._rpc_failures[(device.name, rpc_name)] = remaining - 1
+                raise RpcError(cmd=rpc_name, errs='Simulated RPC failure', dev=device)
+            reply_name = self._overrides.get((device.name, rpc_name), rpc_name.replace('_', '-'))
+        return self._reply(device.name, reply_name)
+
+    def _reply(self, device_name, reply_name):
+        for path in (os.path.join(self.replies_directory, device_name, '{}.xml'.format(reply_name)),
+                     os.path.join(self.replies_directory, '{}.xml'.format(reply_name))):
+            if path not in self._replies:
+                # Missing files are remembered too, so replaying costs no file system calls
+                reply = etree.parse(path).getroot() if os.path.exists(path) else None
+                with self._lock:
+                    self._replies[path] = reply
+            if self._replies[path] is not None:
+                return self._replies[path]
+        raise RpcError(cmd=reply_name, errs='No recorded reply for {}'.format(reply_name))
+
+    def _apply_failures(self):
+        if not self._failures or self._failures[0]['at'] > time.time() - self._start:
+            return
+        with self._lock:
+            due = []
+            while self._failures and self._failures[0]['at'] <= time.time() - self._start:
+                due.append(self._failures.pop(0))
+        for failure in due:
+            logger.info('Simulating %s on %s', failure['action'], failure['device'])
+            if failure['action'] == 'disconnect':
+                self.disconnect(failure['device'])
+            elif failure['action'] == 'recover':
+                self.recover(failure['device'])
+            elif failure['action'] == 'rpc_error':
+                self.fail_rpc(failure['device'], failure['rpc'], failure.get('count', 1))
+            elif failure['action'] == 'reply':
+                self.set_reply(failure['device'], failure['rpc'], failure.get('reply'))
+            elif failure['action'] == 'latency':
+                self.set_latency(failure['device'], failure['latency'])
+
+
+class SimulatedRPC(object):
+    def __init__(self, device):
+        self._device = device
+
+    def __getattr__(self, rpc_name):
+        def rpc(**kwargs):
+            return self._device.simulator.rpc(self._device, rpc_name, **kwargs)
+        return rpc
+
+
+class SimulatedDevice(object):
+    def __init__(self, simulator, name):
+        """Simulated Junos device with the parts of the jnpr.junos.Device interface
+        that the collector and the Executor use
+
+        :param simulator: Simulator that replies for this device
+        :type simulator: DeviceSimulator
+        :param name: Name of the device
+        :type name: str
+        """
+        self.simulator = simulator
+        self.name = name
+        self.hostname = name
+        self.user = 'simulator'
+        self._port = 830
+        self.connected = False
+        self.rpc = SimulatedRPC(self)
+
+    def open(self):
+        self.simulator.check_connect(self)
+        self.connected = True
+        return self
+
+    def close(self):
+        self.connected = False
+
+    def cli(self, command, **kwargs):
+        reply = self.simulator.rpc(self, 'cli', command=command)
+        return reply.text or ''
+
+    def __repr__(self):
+        return 'SimulatedDevice({})'.format(self.name)
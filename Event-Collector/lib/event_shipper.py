@@ -0,0 +1,200 @@
+import logging
+import threading
+import time
+from queue import Empty, Full, Queue
+
+import requests
+from requests.adapters import HTTPAdapter
+
+# Constants
+MAX_QUEUE_SIZE = 10000  # Events held in memory while the Database is slow
+BATCH_SIZE = 500  # Events per /create_events request
+FLUSH_INTERVAL = 2  # seconds
+MAX_RETRIES = 5
+RETRY_BACKOFF = 0.5  # seconds, doubled after every failed attempt
+MAX_RETRY_BACKOFF = 30  # seconds
+REQUEST_TIMEOUT = 10  # seconds
+
+# Logging
+logger = logging.getLogger(__name__)
+
+
+class EventShipper(object):
+    def __init__(self, endpoint, max_queue_size=MAX_QUEUE_SIZE, batch_size=BATCH_SIZE,
+                 flush_interval=FLUSH_INTERVAL, max_retries=MAX_RETRIES, on_drop=None):
+        """Ships events to the Database in batches from a background thread so
+        that collection never waits on the Database.
+
+        Events are flushed once batch_size events are waiting or flush_interval
+        seconds after the first event of a batch arrived, whichever comes first.
+
+        :param endpoint: URL of the Database batch endpoint (/create_events)
+        :type endpoint: str
+        :param max_queue_size: Events that can wait to be sent before new events are dropped
+        :type max_queue_size: int
+        :param batch_size: Maximum number of events sent per request
+        :type batch_size: int
+        :param flush_interval: Maximum time in seconds an event waits for its batch to fill
+        :type flush_interval: float
+        :param max_retries: Number of times a failed batch is resent before it is dropped
+        :type max_retries: int
+        :param on_drop: Called with the state keys (see put) of the events of a
+                        batch that was dropped, so they can be sent again
+        :type on_drop: callable, optional
+        """
+        self.endpoint = endpoint
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.max_retries = max_retries
+        self.on_drop = on_drop
+        self.queue = Queue(maxsize=max_queue_size)
+
+        self.session = requests.Session()
+        self.session.headers.update({'Content-Type': 'application/json'})
+        self.session.mount('http://', HTTPAdapter(pool_connections=1, pool_maxsize=1))
+        self.session.mount('https://', HTTPAdapter(pool_connections=1, pool_maxsize=1))
+
+        self.counters = {
+            'queued': 0,     # Accepted into the queue
+            'sent': 0,       # Stored by the Database
+            'rejected': 0,   # Refused by the Database (duplicate or invalid)
+            'dropped': 0,    # Discarded after every retry failed
+            'overflow': 0,   # Discarded because the queue was full
+            'retries': 0,    # Failed requests that were retried
+            'batches': 0,    # Successful requests
+        }
+        self._reported_overflow = 0
+        self._counters_lock = threading.Lock()
+        self._thread = threading.Thread(name='EventShipper', target=self._run)
+        self._thread.daemon = True
+
+    def start(self):
+        """Starts the background thread which sends the queued events"""
+        logger.info('Starting EventShipper for %s', self.endpoint)
+        self._thread.start()
+
+    def put(self, event, state_key=None):
+        """Queues an event without blocking
+
+        :param event: Event message that is compatible with the Database schema
+        :type event: dict
+        :param state_key: Passed to on_drop if the event is dropped after being queued
+        :type state_key: tuple, optional
+        :return: [True] if the event was queued, [False] if it was dropped because
+                 the queue is full
+        :rtype: bool
+        """
+        try:
+            self.queue.put_nowait((event, state_key))
+        except Full:
+            self._count('overflow')
+            return False
+        self._count('queued')
+        return True
+
+    def stats(self):
+        """Snapshot of the shipper counters and current queue depth
+
+        :return: Counter name to value
+        :rtype: dict
+        """
+        with self._counters_lock:
+            stats = dict(self.counters)
+        stats['pending'] = self.queue.qsize()
+        return stats
+
+    def _count(self, counter, amount=1):
+        with self._counters_lock:
+            self.counters[counter] += amount
+
+    def _run(self):
+        while True:
+            batch = self._next_batch()
+            try:
+                self._ship(batch)
+            except Exception as e:
+                logger.error('Unexpected error while shipping events: %s', e)
+                self._drop(batch)
+            self._report_overflow()
+
+    def _next_batch(self):
+        """Waits for the next batch of events to fill up or time out
+
+        :return: Between 1 and batch_size (event, state key) pairs
+        :rtype: list
+        """
+        batch = [self.queue.get()]
+        deadline = time.time() + self.flush_interval
+        while len(batch) < self.batch_size:
+            remaining = deadline - time.time()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(self.queue.get(timeout=remaining))
+            except Empty:
+                break
+        return batch
+
+    def _ship(self, batch):
+        """Sends a batch to the Database, retrying with exponential backoff
+
+        :param batch: (event, state key) pairs to send
+        :type batch: list
+        :return: [True] if the Database accepted the batch, [False] if it was dropped
+        :rtype: bool
+        """
+        events = [event for event, _ in batch]
+        backoff = RETRY_BACKOFF
+        for attempt in range(self.max_retries + 1):
+            if attempt:
+                self._count('retries')
+                time.sleep(backoff)
+                backoff = min(backoff * 2, MAX_RETRY_BACKOFF)
+
+            try:
+                r = self.session.post(self.endpoint, json=events, timeout=REQUEST_TIMEOUT)
+            except requests.exceptions.RequestException as e:
+                logger.error('Could not send %s events to the database: %s', len(batch), e)
+                continue
+
+            if r.status_code in (201, 207):
+                self._record_results(events, r.json()['results'])
+                return True
+            if r.status_code < 500 and r.status_code != 429:
+                # The Database will never accept this batch, retrying will not help
+                logger.error('Database refused %s events. %s', len(batch), r.status_code)
+                break
+            logger.error('Database could not store %s events. %s', len(batch), r.status_code)
+
+        logger.error('Dropping %s events after %s attempts', len(batch), attempt + 1)
+        self._drop(batch)
+        return False
+
+    def _drop(self, batch):
+        self._count('dropped', len(batch))
+        state_keys = [state_key for _, state_key in batch if state_key is not None]
+        if self.on_drop is None or not state_keys:
+            return
+        try:
+            self.on_drop(state_keys)
+        except Exception as e:
+            logger.error('Could not report %s dropped events: %s', len(state_keys), e)
+
+    def _record_results(self, batch, results):
+        rejected = 0
+        for result in results:
+            if result['status'] != 'created':
+                rejected += 1
+                logger.error('Event %s was not added to the database: %s', result['uuid'], result['status'])
+        self._count('batches')
+        self._count('sent', len(batch) - rejected)
+        self._count('rejected', rejected)
+        logger.debug('Sent %s events to the database', len(batch))
+
+    def _report_overflow(self):
+        with self._counters_lock:
+            overflow = self.counters['overflow']
+        if overflow > self._reported_overflow:
+            logger.error('%s events were dropped because the queue was full',
+                         overflow - self._reported_overflow)
+            self._reported_overflow = overflow
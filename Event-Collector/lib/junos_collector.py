@@ -4,93 +4,124 @@ import logging.config
 import threading
 import time
 import uuid
-from copy import deepcopy
 from datetime import datetime
-from multiprocessing import JoinableQueue
 
-import requests
 import yaml
 from jnpr.junos import Device
 from jnpr.junos.exception import ConnectError, RpcError
 
+from .device_pool import DevicePool
+from .event_shipper import EventShipper
+from .rpc_extract import (BGP_SUMMARY, INTERFACE_STATUS, LDP_SESSIONS, OSPF_INTERFACES, OSPF_NEIGHBORS,
+                          PCEP_STATUSES)
+from .state_table import HEARTBEAT_INTERVAL, StateTable
+
 # Constants
 DATABASE_URL = 'http://0.0.0.0'
 DATABASE_PORT = 5000
 COLLECTION_INTERVAL = 60 # seconds
+MAX_WORKERS = 32  # Threads shared by every (device, RPC) pair
+MAX_RPCS_PER_DEVICE = 1  # Concurrent RPCs per device unless overridden in the device config
+MONITORED_INTERFACES = ['ge-0/0/0', 'ge-0/0/1', 'ge-0/0/2', 'ge-0/0/0.0', 'ge-0/0/1.0', 'ge-0/0/2.0']
+MONITORED_DEVICES = {  # Devices each protocol is collected from, None for every device
+    'bgp_peers': ['P1', 'P2', 'P3'],
+    'ldp_session': ['P1', 'P2', 'P3', 'PE1', 'PE2', 'PE3', 'PE4'],
+    'ospf_neighbors': ['P1', 'P2', 'P3', 'PE1', 'PE2', 'PE3', 'PE4'],
+    'ospf_interfaces': ['P1', 'P2', 'P3', 'PE1', 'PE2', 'PE3', 'PE4'],
+    'pcep_status': ['P1', 'P2', 'P3', 'PE1', 'PE2', 'PE3', 'PE4'],
+}
 
 # Logging
 logger = logging.getLogger(__name__)
 
 
-class Message(object):
-    def __init__(self, endpoint, msg, headers):
-        self.endpoint = endpoint
-        self.event_msg = msg
-        self.headers = headers
-
-    def send_message(self):
-        requests.post(self.endpoint, json=self.event_msg, headers=self.headers)
-        logger.info('%s - %s - %s', self.event_msg['uuid'], self.event_msg['time'], self.event_msg['name'])
-
 class JunosCollector(object):
-    def __init__(self, config_path):
+    def __init__(self, config_path, max_workers=MAX_WORKERS, max_rpcs_per_device=MAX_RPCS_PER_DEVICE,
+                 heartbeat_interval=HEARTBEAT_INTERVAL, device_factory=Device, device_config=None, autostart=True):
         """Collector module for Junos RPC information, statistics and status
 
         :param config_path: Location of the credentials for each network device
         :type config_path: str
+        :param max_workers: Number of threads used to run RPCs, defaults to MAX_WORKERS
+        :type max_workers: int, optional
+        :param max_rpcs_per_device: Number of RPCs that may run on one device at the same
+                                    time, defaults to MAX_RPCS_PER_DEVICE. Can be overridden
+                                    per device with 'max_concurrent_rpcs' in the device config
+        :type max_rpcs_per_device: int, optional
+        :param heartbeat_interval: Seconds after which an unchanged state is sent again,
+                                   defaults to HEARTBEAT_INTERVAL. Can be overridden with
+                                   'heartbeat_interval' at the top of the device config
+        :type heartbeat_interval: int, optional
+        :param device_factory: Creates the device objects, called with the same arguments
+                               as jnpr.junos.Device (eg. a DeviceSimulator), defaults to Device
+        :type device_factory: callable, optional
+        :param device_config: Device config to use instead of reading config_path, with
+                              the same layout as devices.yaml
+        :type device_config: dict, optional
+        :param autostart: [True] to start the monitoring loop straight away, otherwise
+                          call start_monitoring, or shipper.start and then collect_once
+        :type autostart: bool, optional
         """
+        self.device_factory = device_factory
+        self.monitored_interfaces = set(MONITORED_INTERFACES)
+        self.monitored_devices = dict((metric, set(device_names)) for metric, device_names in MONITORED_DEVICES.items())
         self.connected_devices = {}
         self.network_devices = {}
         self.broken_devices = {}
-        self.db_event_endpoint = '{}:{}/create_event'.format(DATABASE_URL, DATABASE_PORT)
-        self.requests_queue = JoinableQueue(maxsize=0)
-        self._import_network_devices(config_path)
-        self.start_monitoring()
-
-    def empty_requests(self):
-        """Checks for any outgoing events destined for the database and sends them"""
-        while True:
-            request = self.requests_queue.get()
-            request.send_message()
-            #self.requests_queue.task_done()
+        self.db_events_endpoint = '{}:{}/create_events'.format(DATABASE_URL, DATABASE_PORT)
+        self.shipper = EventShipper(self.db_events_endpoint, on_drop=self._forget_dropped_states)
+        self.device_pool = DevicePool(max_workers=max_workers, max_per_device=max_rpcs_per_device)
+        self.states = StateTable(heartbeat_interval=heartbeat_interval)
+        if device_config is None:
+            self._import_network_devices(config_path)
+        else:
+            self._add_network_devices(device_config)
+        if autostart:
+            self.start_monitoring()
 
     def start_monitoring(self):
         """Monitoring loop which collects information from each device
         for a specified interval
         """
-        t_queue = threading.Thread(target=self.empty_requests)
-        t_queue.start()
+        self.shipper.start()
 
         while True:
-            threads = []
-            start_time = time.time()
-            self.check_broken_device()
-            t = threading.Thread(target=self.t_interface_statuses)
-            threads.append(t)
-            t = threading.Thread(target=self.t_bgp_peers)
-            threads.append(t)
-            t = threading.Thread(target=self.t_ldp_sessions)
-            threads.append(t)
-            t = threading.Thread(target=self.t_ospf_neighbors)
-            threads.append(t)
-            t = threading.Thread(target=self.t_pcep_statuses)
-            threads.append(t)
-
-            for thread in threads:
-                thread.start()
-
-            for thread in threads:
-                thread.join()
-
-            end_time = time.time()
-            duration = end_time - start_time
+            duration = self.collect_once()
+            logger.info('Collection took %.2fs, states: %s, event shipper: %s',
+                        duration, self.states.stats(), self.shipper.stats())
 
             sleep_duration = COLLECTION_INTERVAL - int(duration)
             if sleep_duration < 0:
                 sleep_duration = 0
             time.sleep(sleep_duration)
 
-        t_queue.join()
+    def collect_once(self):
+        """Runs a single collection cycle over every device
+
+        :return: Duration of the cycle in seconds
+        :rtype: float
+        """
+        threads = []
+        start_time = time.time()
+        self.check_broken_device()
+        t = threading.Thread(target=self.t_interface_statuses)
+        threads.append(t)
+        t = threading.Thread(target=self.t_bgp_peers)
+        threads.append(t)
+        t = threading.Thread(target=self.t_ldp_sessions)
+        threads.append(t)
+        t = threading.Thread(target=self.t_ospf_neighbors)
+        threads.append(t)
+        t = threading.Thread(target=self.t_pcep_statuses)
+        threads.append(t)
+
+        for thread in threads:
+            thread.start()
+
+        for thread in threads:
+            thread.join()
+
+        return time.time() - start_time
 
     def t_interface_statuses(self):
         # Interface Status
@@ -121,16 +152,49 @@ class JunosCollector(object):
         self.monitor_pcep_statuses(pcep_statuses)
 
     def add_event_to_db(self, event_msg):
-        """Sends collected information as events to the Database endpoint
+        """Queues collected information as an event for the Database endpoint.
+        The EventShipper sends it in the background so that collection never
+        waits on the Database
 
         :param event_msg: Event message that is compatible with the Database schema
         :type event_msg: dict
         """
-        headers = {
-            'Content-Type': 'application/json',
-        }
-        requests.post(self.db_event_endpoint, json=event_msg, headers=headers)
-        # self.requests_queue.put(Message(self.db_event_endpoint, event_msg, headers))
+        self.shipper.put(event_msg)
+
+    def emit_state(self, device_name, metric, name, priority, body, type='cli'):
+        """Sends the collected state of a device as an Event, but only if it
+        changed since it was last sent or the heartbeat interval has passed
+
+        :param device_name: Name of the network device
+        :type device_name: str
+        :param metric: What was collected (eg. oper_status)
+        :type metric: str
+        :param name: Name of the Event
+        :type name: str
+        :param priority: Priority of the Event (eg. INFORMATION/WARNING/CRITICAL)
+        :type priority: str
+        :param body: Any other extra information related to the Event
+        :type body: dict
+        :param type: Type of Event, defaults to cli
+        :type type: str, optional
+        """
+        if not self.states.should_emit(device_name, metric, name, body):
+            return
+        event = self._create_event(name=name, type=type, priority=priority, body=body)
+        state_key = (device_name, metric, name, body)
+        if not self.shipper.put(event, state_key):
+            # Not queued, the transition is sent again on the next cycle
+            self.states.forget(*state_key)
+
+    def _forget_dropped_states(self, state_keys):
+        """Called by the EventShipper with the states of the Events it dropped,
+        so that they are sent again on the next cycle
+
+        :param state_keys: (device, metric, name, body) of each dropped Event
+        :type state_keys: list
+        """
+        for state_key in state_keys:
+            self.states.forget(*state_key)
 
     def _import_network_devices(self, network_device_file):
         """Import the hostnames, username and password for each network device
@@ -142,13 +206,32 @@ class JunosCollector(object):
         logger.debug('Loading network devices into JunosCollector')
         with open(network_device_file, 'r') as f:
             import_devices = yaml.load(f.read())
+        self._add_network_devices(import_devices)
+
+    def _add_network_devices(self, import_devices):
+        """Applies an imported device config and connects to each network device
+
+        :param import_devices: Contents of the device config
+        :type import_devices: dict
+        """
+        if 'heartbeat_interval' in import_devices:
+            self.states.heartbeat_interval = import_devices['heartbeat_interval']
+        if 'monitored_interfaces' in import_devices:
+            self.monitored_interfaces = set(import_devices['monitored_interfaces'])
+        for metric, device_names in import_devices.get('monitored_devices', {}).items():
+            # 'all' collects the metric from every device
+            self.monitored_devices[metric] = None if device_names == 'all' else set(device_names)
 
         for device in import_devices['devices']:
             self.network_devices[device['name']] = device
+            if 'max_concurrent_rpcs' in device:
+                self.device_pool.set_device_limit(device['name'], device['max_concurrent_rpcs'])
             logger.debug('Imported credentials for %s', device['name'])
 
-        for _, device in self.network_devices.items():
-            self._connect_to_device(device)
+        self.device_pool.map_devices(list(self.network_devices.keys()), self._connect_to_device_by_name)
+
+    def _connect_to_device_by_name(self, device_name):
+        self._connect_to_device(self.network_devices[device_name])
 
     def _connect_to_device(self, device):
         """Connects to the network device via Netconf
@@ -159,7 +242,8 @@ class JunosCollector(object):
         """
         try:
             logger.debug('Connecting to %s', device['ip'])
-            dev = Device(host=device['ip'], user=device['user'], password=device['password'], attempts=1, timeout=1)
+            dev = self.device_factory(host=device['ip'], user=device['user'], password=device['password'],
+                                      attempts=1, timeout=1)
             dev.open()
             logger.info('Successfully connected to %s', device['ip'])
         except (ConnectError, RpcError) as e:
@@ -193,81 +277,88 @@ class JunosCollector(object):
         return event
 
     def check_broken_device(self):
-        for dev_name, dev in self.broken_devices.items():
+        """Attempts to reconnect every broken device in parallel"""
+        self.device_pool.map_devices(list(self.broken_devices.keys()), self._reconnect_device)
+
+    def _reconnect_device(self, dev_name):
+        dev = self.broken_devices[dev_name]
+        try:
+            dev.open()
+            dev = self.broken_devices.pop(dev_name)
+            self.connected_devices[dev_name] = dev
+            # The device may have changed while it was unreachable
+            self.states.forget_device(dev_name)
+            self.send_connection_error(True, dev_name, 'Reconnected to device {}'.format(dev_name))
+        except Exception as e:
+            logger.error(e)
+            self.send_connection_error(False, dev_name, e)
+
+    def _collect_rpc(self, rpc_name, to_monitor=None, **rpc_kwargs):
+        """Runs an RPC on every connected device in parallel, one job per
+        (device, RPC) pair on the shared device pool
+
+        Devices which fail with a connection or RPC error are moved to the
+        broken device list.
+
+        :param rpc_name: Name of the PyEZ RPC (eg. get_bgp_summary_information)
+        :type rpc_name: str
+        :param to_monitor: Names of the devices to run the RPC on, [None] for every device
+        :type to_monitor: list, optional
+        :return: RPC reply for every device that replied, keyed by device name
+        :rtype: dict
+        """
+        device_names = [dev_name for dev_name, connected_dev in list(self.connected_devices.items())
+                        if connected_dev is not None and (to_monitor is None or dev_name in to_monitor)]
+        futures = self.device_pool.map_devices(device_names, self._run_rpc, rpc_name, **rpc_kwargs)
+
+        rpc_replies = {}
+        for dev_name, future in futures.items():
             try:
-                dev.open()
-                dev = self.broken_devices.pop(dev_name)
-                self.connected_devices[dev_name] = dev
-                self.send_connection_error(True, dev_name, 'Reconnected to device {}'.format(dev_name))
+                rpc_reply = future.result()
+            except (ConnectError, RpcError) as e:
+                logger.error('%s failed on %s: %s', rpc_name, dev_name, e)
+                self.safely_set_device_broken(dev_name)
             except Exception as e:
-                logger.error(e)
-                self.send_connection_error(False, dev_name, e)
+                logger.error('%s failed on %s: %s', rpc_name, dev_name, e)
+            else:
+                if rpc_reply is not None:
+                    rpc_replies[dev_name] = rpc_reply
+        return rpc_replies
+
+    def _run_rpc(self, dev_name, rpc_name, **rpc_kwargs):
+        connected_dev = self.connected_devices.get(dev_name)
+        if connected_dev is None:
+            # Moved to the broken devices by another RPC in the meantime
+            return None
+        return getattr(connected_dev.rpc, rpc_name)(**rpc_kwargs)
 
     def send_connection_error(self, status, device_name, msg):
         if status is True:
-            event = self._create_event(name='connection.up.{}'.format(device_name),
-                                        type='connection',
-                                        priority='information',
-                                        body={'Information': str(msg)})
-            self.add_event_to_db(event)
+            self.emit_state(device_name, 'connection',
+                            name='connection.up.{}'.format(device_name),
+                            type='connection',
+                            priority='information',
+                            body={'Information': str(msg)})
         else:
-            event = self._create_event(name='connection.down.{}'.format(device_name),
-                                        type='connection',
-                                        priority='critical',
-                                        body={'error': str(msg)})
-            self.add_event_to_db(event)
+            self.emit_state(device_name, 'connection',
+                            name='connection.down.{}'.format(device_name),
+                            type='connection',
+                            priority='critical',
+                            body={'error': str(msg)})
 
     def get_interface_status(self):
         device_interface_statuses = {}
-        rpc_replies = {}
-        to_monitor = ['ge-0/0/0', 'ge-0/0/1', 'ge-0/0/2', 'ge-0/0/0.0', 'ge-0/0/1.0', 'ge-0/0/2.0']
-        for dev_name, connected_dev in self.connected_devices.items():
-            if connected_dev is None:
-                continue
-
-            try:
-                rpc_reply = connected_dev.rpc.get_interface_information(terse=True)
-            except (ConnectError, RpcError) as e:
-                self.safely_set_device_broken(dev_name)
-            else:
-                rpc_replies[dev_name] = rpc_reply
+        rpc_replies = self._collect_rpc('get_interface_information', terse=True)
 
         for dev_name, rpc_reply in rpc_replies.items():
-            device_interface_statuses[dev_name] = []
-            interface_status = {}
-            logical_interfaces = rpc_reply.xpath('//physical-interface|//logical-interface')
-
-            for logical_interface in logical_interfaces:
-                name = logical_interface.xpath('.//name')[0].text.replace('\n', '')
-                if name not in to_monitor:
-                    continue
-                admin_status = logical_interface.xpath('.//admin-status')[0].text.replace('\n', '')
-                oper_status = logical_interface.xpath('.//oper-status')[0].text.replace('\n', '')
-                interface_status[name] = {
-                    'admin-status': admin_status,
-                    'oper-status': oper_status,
-                }
-            device_interface_statuses[dev_name] = interface_status
+            device_interface_statuses[dev_name] = INTERFACE_STATUS.extract_by_key(rpc_reply,
+                                                                                  include=self.monitored_interfaces)
 
         return device_interface_statuses
 
     def get_bgp_peers(self):
         device_bgp_peer_count = {}
-        rpc_replies = {}
-        to_monitor = ['P1', 'P2', 'P3']
-
-        for dev_name, connected_dev in self.connected_devices.items():
-            if connected_dev is None:
-                continue
-            if dev_name not in to_monitor:
-                continue
-
-            try:
-                rpc_reply = connected_dev.rpc.get_bgp_summary_information()
-            except (ConnectError, RpcError) as e:
-                self.safely_set_device_broken(dev_name)
-            else:
-                rpc_replies[dev_name] = rpc_reply
+        rpc_replies = self._collect_rpc('get_bgp_summary_information', self.monitored_devices['bgp_peers'])
 
         for dev_name, rpc_reply in rpc_replies.items():
             device_bgp_peer_count[dev_name] = {}
@@ -275,13 +366,11 @@ class JunosCollector(object):
             device_bgp_peer_count[dev_name]['down-peer-count'] = 0
 
             try:
-                peer_count_xpath = rpc_reply.xpath('//bgp-information/peer-count')
-                down_peer_count_xpath = rpc_reply.xpath('//bgp-information/down-peer-count')
-
-                if peer_count_xpath:
-                    device_bgp_peer_count[dev_name]['peer-count'] = int(peer_count_xpath[0].text)
-                if peer_count_xpath:
-                    device_bgp_peer_count[dev_name]['down-peer-count'] = int(down_peer_count_xpath[0].text)
+                for bgp_summary in BGP_SUMMARY.extract(rpc_reply)[:1]:
+                    if bgp_summary['peer-count']:
+                        device_bgp_peer_count[dev_name]['peer-count'] = int(bgp_summary['peer-count'])
+                    if bgp_summary['down-peer-count']:
+                        device_bgp_peer_count[dev_name]['down-peer-count'] = int(bgp_summary['down-peer-count'])
             except Exception as e:
                 logger.error(e)
 
@@ -306,31 +395,16 @@ class JunosCollector(object):
 
     def get_ldp_session(self):
         ldp_neighbors = {}
-        rpc_replies = {}
-        to_monitor = ['P1', 'P2', 'P3', 'PE1', 'PE2', 'PE3', 'PE4']
-        for dev_name, connected_dev in self.connected_devices.items():
-            if connected_dev is None:
-                continue
-            if dev_name not in to_monitor:
-                continue
-
-            try:
-                rpc_reply = connected_dev.rpc.get_ldp_session_information()
-            except (ConnectError, RpcError) as e:
-                self.safely_set_device_broken(dev_name)
-            else:
-                rpc_replies[dev_name] = rpc_reply
+        rpc_replies = self._collect_rpc('get_ldp_session_information', self.monitored_devices['ldp_session'])
 
         for dev_name, rpc_reply in rpc_replies.items():
             ldp_neighbors[dev_name] = {}
             ldp_neighbors[dev_name]['ldp-session-state'] = ''
             ldp_neighbors[dev_name]['ldp-neighbor-address'] = ''
             try:
-                ldp_session_xpath = rpc_reply.xpath('//ldp-session-information/ldp-session')
-
-                for ldp_session in ldp_session_xpath:
-                    ldp_neighbors[dev_name]['ldp-session-state'] = ldp_session.xpath('.//ldp-session-state')[0].text
-                    ldp_neighbors[dev_name]['ldp-neighbor-address'] = ldp_session.xpath('.//ldp-neighbor-address')[0].text
+                ldp_sessions = LDP_SESSIONS.extract(rpc_reply)
+                if ldp_sessions:
+                    ldp_neighbors[dev_name] = ldp_sessions[-1]
             except Exception as e:
                 logger.error(e)
 
@@ -338,20 +412,7 @@ class JunosCollector(object):
 
     def get_ospf_neighbors(self):
         o_ospf_neighbors = {}
-        rpc_replies = {}
-        to_monitor = ['P1', 'P2', 'P3', 'PE1', 'PE2', 'PE3', 'PE4']
-        for dev_name, connected_dev in self.connected_devices.items():
-            if connected_dev is None:
-                continue
-            if dev_name not in to_monitor:
-                continue
-
-            try:
-                rpc_reply = connected_dev.rpc.get_ospf_neighbor_information()
-            except (ConnectError, RpcError) as e:
-                self.safely_set_device_broken(dev_name)
-            else:
-                rpc_replies[dev_name] = rpc_reply
+        rpc_replies = self._collect_rpc('get_ospf_neighbor_information', self.monitored_devices['ospf_neighbors'])
 
         for dev_name, rpc_reply in rpc_replies.items():
             o_ospf_neighbors[dev_name] = {}
@@ -360,49 +421,20 @@ class JunosCollector(object):
             o_ospf_neighbors[dev_name]['neighbor-id'] = ''
             o_ospf_neighbors[dev_name]['interface-name'] = ''
             try:
-                ospf_neighbor_xpath = rpc_reply.xpath('//ospf-neighbor-information/ospf-neighbor')
-                for ospf_neighbor in ospf_neighbor_xpath:
-                    o_ospf_neighbors[dev_name]['neighbor-address'] = ospf_neighbor.xpath('.//neighbor-address')[0].text
-                    o_ospf_neighbors[dev_name]['ospf-neighbor-state'] = ospf_neighbor.xpath('.//ospf-neighbor-state')[0].text
-                    o_ospf_neighbors[dev_name]['neighbor-id'] = ospf_neighbor.xpath('.//neighbor-id')[0].text
-                    o_ospf_neighbors[dev_name]['interface-name'] = ospf_neighbor.xpath('.//interface-name')[0].text
+                ospf_neighbors = OSPF_NEIGHBORS.extract(rpc_reply)
+                if ospf_neighbors:
+                    o_ospf_neighbors[dev_name] = ospf_neighbors[-1]
             except Exception as e:
                 logger.error(e)
         return o_ospf_neighbors
 
     def get_ospf_interfaces(self):
         o_ospf_interfaces = {}
-        rpc_replies = {}
-        to_monitor = ['P1', 'P2', 'P3', 'PE1', 'PE2', 'PE3', 'PE4']
-
-        ospf_interfaces_template = {}
-        ospf_interfaces_template['interface-name'] = ''
-        ospf_interfaces_template['ospf-area'] = ''
-        ospf_interfaces_template['ospf-interface-state'] = ''
-
-        for dev_name, connected_dev in self.connected_devices.items():
-            if connected_dev is None:
-                continue
-            if dev_name not in to_monitor:
-                continue
-
-            try:
-                rpc_reply = connected_dev.rpc.get_ospf_interface_information()
-            except (ConnectError, RpcError) as e:
-                self.safely_set_device_broken(dev_name)
-            else:
-                rpc_replies[dev_name] = rpc_reply
+        rpc_replies = self._collect_rpc('get_ospf_interface_information', self.monitored_devices['ospf_interfaces'])
 
         for dev_name, rpc_reply in rpc_replies.items():
             try:
-                ospf_interfaces_xpath = rpc_reply.xpath('//ospf-interface-information/ospf-interface')
-                o_ospf_interfaces[dev_name] = []
-                for i, ospf_interface in enumerate(ospf_interfaces_xpath):
-                    o_ospf_interface = deepcopy(ospf_interfaces_template)
-                    o_ospf_interface['interface-name'] = ospf_interface.xpath('.//interface-name')[0].text
-                    o_ospf_interface['ospf-area'] = ospf_interface.xpath('.//ospf-area')[0].text
-                    o_ospf_interface['ospf-interface-state'] = ospf_interface.xpath('.//ospf-interface-state')[0].text
-                    o_ospf_interfaces[dev_name].append(o_ospf_interface)
+                o_ospf_interfaces[dev_name] = OSPF_INTERFACES.extract(rpc_reply)
             except Exception as e:
                 logger.error(e)
 
@@ -410,39 +442,11 @@ class JunosCollector(object):
 
     def get_pcep_statuses(self):
         o_pcep_statuses = {}
-        rpc_replies = {}
-        to_monitor = ['P1', 'P2', 'P3', 'PE1', 'PE2', 'PE3', 'PE4']
-
-        pcep_statuses_template = {}
-        pcep_statuses_template['session-name'] = ''
-        pcep_statuses_template['session-type'] = ''
-        pcep_statuses_template['session-provisioning'] = ''
-        pcep_statuses_template['session-status'] = ''
-
-        for dev_name, connected_dev in self.connected_devices.items():
-            if connected_dev is None:
-                continue
-            if dev_name not in to_monitor:
-                continue
-
-            try:
-                rpc_reply = connected_dev.rpc.get_path_computation_client_status()
-            except (ConnectError, RpcError) as e:
-                self.safely_set_device_broken(dev_name)
-            else:
-                rpc_replies[dev_name] = rpc_reply
+        rpc_replies = self._collect_rpc('get_path_computation_client_status', self.monitored_devices['pcep_status'])
 
         for dev_name, rpc_reply in rpc_replies.items():
             try:
-                pcep_status_xpath = rpc_reply.xpath('//path-computation-client-status/pcc-status-sessions/pcc-status-sessions-entry')
-                o_pcep_statuses[dev_name] = []
-                for i, pcep_status in enumerate(pcep_status_xpath):
-                    o_pcep_status = deepcopy(pcep_statuses_template)
-                    o_pcep_status['session-name'] = pcep_status.xpath('.//session-name')[0].text
-                    o_pcep_status['session-type'] = pcep_status.xpath('.//session-type')[0].text
-                    o_pcep_status['session-provisioning'] = pcep_status.xpath('.//session-provisioning')[0].text
-                    o_pcep_status['session-status'] = pcep_status.xpath('.//session-status')[0].text
-                    o_pcep_statuses[dev_name].append(o_pcep_status)
+                o_pcep_statuses[dev_name] = PCEP_STATUSES.extract(rpc_reply)
             except Exception as e:
                 logger.error(e)
         return o_pcep_statuses
@@ -456,17 +460,15 @@ class JunosCollector(object):
                     break
 
             if oper_status is False:
-                event = self._create_event(name='oper_status.interface.down.{}'.format(device_name),
-                                           type='cli',
-                                           priority='critical',
-                                           body={device_name: interfaces})
-                self.add_event_to_db(event)
+                self.emit_state(device_name, 'oper_status',
+                                name='oper_status.interface.down.{}'.format(device_name),
+                                priority='critical',
+                                body={device_name: interfaces})
             else:
-                event = self._create_event(name='oper_status.interface.up.{}'.format(device_name),
-                                           type='cli',
-                                           priority='information',
-                                           body={device_name: interfaces})
-                self.add_event_to_db(event)
+                self.emit_state(device_name, 'oper_status',
+                                name='oper_status.interface.up.{}'.format(device_name),
+                                priority='information',
+                                body={device_name: interfaces})
 
     def monitor_admin_status(self, interface_status):
         for device_name, interfaces in interface_status.items():
@@ -477,68 +479,58 @@ class JunosCollector(object):
                     break
 
             if admin_status is False:
-                event = self._create_event(name='admin_status.interface.down.{}'.format(device_name),
-                                           type='cli',
-                                           priority='critical',
-                                           body={device_name: interfaces})
-                self.add_event_to_db(event)
+                self.emit_state(device_name, 'admin_status',
+                                name='admin_status.interface.down.{}'.format(device_name),
+                                priority='critical',
+                                body={device_name: interfaces})
             else:
-                event = self._create_event(name='admin_status.interface.up.{}'.format(device_name),
-                                           type='cli',
-                                           priority='information',
-                                           body={device_name: interfaces})
-                self.add_event_to_db(event)
+                self.emit_state(device_name, 'admin_status',
+                                name='admin_status.interface.up.{}'.format(device_name),
+                                priority='information',
+                                body={device_name: interfaces})
 
     def monitor_bgp_peers(self, bgp_peer_count):
         for device_name, bgp_peer_count in bgp_peer_count.items():
+            body = {device_name: {
+                'up-peer-count': bgp_peer_count['peer-count'] - bgp_peer_count['down-peer-count'],
+                'down-peer-count': bgp_peer_count['down-peer-count'],
+            }}
             if bgp_peer_count['down-peer-count'] == 0:
-                event = self._create_event(name='bgp.peers.up.{}'.format(device_name),
-                                           type='cli',
-                                           priority='information',
-                                           body={device_name: {
-                                                'up-peer-count': bgp_peer_count['peer-count'] - bgp_peer_count['down-peer-count'],
-                                                'down-peer-count': bgp_peer_count['down-peer-count'],
-                                           }})
-                self.add_event_to_db(event)
+                self.emit_state(device_name, 'bgp_peers',
+                                name='bgp.peers.up.{}'.format(device_name),
+                                priority='information',
+                                body=body)
             else:
-                event = self._create_event(name='bgp.peers.down.{}'.format(device_name),
-                                           type='cli',
-                                           priority='critical',
-                                           body={device_name: {
-                                                'up-peer-count': bgp_peer_count['peer-count'] - bgp_peer_count['down-peer-count'],
-                                                'down-peer-count': bgp_peer_count['down-peer-count'],
-                                           }})
-                self.add_event_to_db(event)
+                self.emit_state(device_name, 'bgp_peers',
+                                name='bgp.peers.down.{}'.format(device_name),
+                                priority='critical',
+                                body=body)
 
     def monitor_ldp_session(self, ldp_neighbors):
         for device_name, ldp_neighbor in ldp_neighbors.items():
             if ldp_neighbor['ldp-session-state'] == 'Operational':
-                event = self._create_event(name='ldp.session.up.{}'.format(device_name),
-                                           type='cli',
-                                           priority='information',
-                                           body={device_name: ldp_neighbor})
-                self.add_event_to_db(event)
+                self.emit_state(device_name, 'ldp_session',
+                                name='ldp.session.up.{}'.format(device_name),
+                                priority='information',
+                                body={device_name: ldp_neighbor})
             else:
-                event = self._create_event(name='ldp.session.down.{}'.format(device_name),
-                                           type='cli',
-                                           priority='critical',
-                                           body={device_name: ldp_neighbor})
-                self.add_event_to_db(event)
+                self.emit_state(device_name, 'ldp_session',
+                                name='ldp.session.down.{}'.format(device_name),
+                                priority='critical',
+                                body={device_name: ldp_neighbor})
 
     def monitor_ospf_neighbors(self, ospf_neighbors):
         for device_name, ospf_neighbor in ospf_neighbors.items():
             if ospf_neighbor['ospf-neighbor-state'] == 'Full':
-                event = self._create_event(name='ospf.neighbors.up.{}'.format(device_name),
-                                           type='cli',
-                                           priority='information',
-                                           body={device_name: ospf_neighbor})
-                self.add_event_to_db(event)
+                self.emit_state(device_name, 'ospf_neighbors',
+                                name='ospf.neighbors.up.{}'.format(device_name),
+                                priority='information',
+                                body={device_name: ospf_neighbor})
             else:
-                event = self._create_event(name='ospf.neighbors.down.{}'.format(device_name),
-                                           type='cli',
-                                           priority='critical',
-                                           body={device_name: ospf_neighbor})
-                self.add_event_to_db(event)
+                self.emit_state(device_name, 'ospf_neighbors',
+                                name='ospf.neighbors.down.{}'.format(device_name),
+                                priority='critical',
+                                body={device_name: ospf_neighbor})
 
     def monitor_pcep_statuses(self, pcep_statuses):
         for device_name, pcep_status in pcep_statuses.items():
@@ -549,17 +541,15 @@ class JunosCollector(object):
                     break
 
             if status is True:
-                event = self._create_event(name='pcep.status.up.{}'.format(device_name),
-                                           type='cli',
-                                           priority='information',
-                                           body={device_name: pcep_status})
-                self.add_event_to_db(event)
+                self.emit_state(device_name, 'pcep_status',
+                                name='pcep.status.up.{}'.format(device_name),
+                                priority='information',
+                                body={device_name: pcep_status})
             else:
-                event = self._create_event(name='pcep.status.down.{}'.format(device_name),
-                                           type='cli',
-                                           priority='critical',
-                                           body={device_name: pcep_status})
-                self.add_event_to_db(event)
+                self.emit_state(device_name, 'pcep_status',
+                                name='pcep.status.down.{}'.format(device_name),
+                                priority='critical',
+                                body={device_name: pcep_status})
 
     def monitor_ospf_interfaces(self, d_ospf_interfaces):
         for device_name, ospf_interfaces in d_ospf_interfaces.items():
@@ -570,17 +560,15 @@ class JunosCollector(object):
                     break
 
             if status is True:
-                event = self._create_event(name='ospf.interfaces.up.{}'.format(device_name),
-                                           type='cli',
-                                           priority='information',
-                                           body={device_name: ospf_interfaces})
-                self.add_event_to_db(event)
+                self.emit_state(device_name, 'ospf_interfaces',
+                                name='ospf.interfaces.up.{}'.format(device_name),
+                                priority='information',
+                                body={device_name: ospf_interfaces})
             else:
-                event = self._create_event(name='ospf.interfaces.down.{}'.format(device_name),
-                                           type='cli',
-                                           priority='critical',
-                                           body={device_name: ospf_interfaces})
-                self.add_event_to_db(event)
+                self.emit_state(device_name, 'ospf_interfaces',
+                                name='ospf.interfaces.down.{}'.format(device_name),
+                                priority='critical',
+                                body={device_name: ospf_interfaces})
 
 
 if __name__ == '__main__':
@@ -0,0 +1,116 @@
+from lxml import etree
+
+
+class RecordExtractor(object):
+    def __init__(self, rows, fields, key=None):
+        """Turns an RPC reply into a list of flat records with precompiled XPath
+        expressions, instead of compiling a new expression for every field of
+        every element
+
+        Field paths are relative to the row element and should name direct
+        children (eg. 'oper-status' rather than './/oper-status'), which
+        avoids searching the whole subtree of each row. Values are
+        whitespace-normalised strings, '' when the field is missing.
+
+        :param rows: XPath selecting one element per record
+                     (eg. '//ospf-interface-information/ospf-interface')
+        :type rows: str
+        :param fields: (field name, relative XPath) pairs, in record order
+        :type fields: tuple
+        :param key: Name of the field that records can be filtered on
+        :type key: str, optional
+        """
+        self.rows = etree.XPath(rows)
+        self.fields = [(name, etree.XPath('normalize-space({})'.format(path))) for name, path in fields]
+        self.key = key
+        self._included_rows = None
+        if key:
+            # Filters inside libxml2 against a '|' separated list of the wanted keys
+            self._included_rows = etree.XPath('({})[contains($include, concat("|", normalize-space({}), "|"))]'
+                                              .format(rows, dict(fields)[key]))
+
+    def extract(self, reply, include=None):
+        """Extracts the records of an RPC reply
+
+        :param reply: RPC reply as returned by PyEZ
+        :type reply: lxml.etree._Element
+        :param include: Only extract the rows whose key field is in this set,
+                        checked before any other field is read. Keys must not
+                        contain '|'
+        :type include: set, optional
+        :return: One dict per row, with only the configured fields
+        :rtype: list
+        """
+        if include is not None and not include:
+            return []
+        if include is not None and self._included_rows is not None:
+            rows = self._included_rows(reply, include='|{}|'.format('|'.join(include)))
+        else:
+            rows = self.rows(reply)
+        return [dict((name, path(row)) for name, path in self.fields) for row in rows]
+
+    def extract_by_key(self, reply, include=None):
+        """Extracts the records of an RPC reply keyed by their key field, without
+        repeating it in the record. Later rows with the same key win
+
+        :param reply: RPC reply as returned by PyEZ
+        :type reply: lxml.etree._Element
+        :param include: Only extract the rows whose key field is in this set
+        :type include: set, optional
+        :return: Key field value to record
+        :rtype: dict
+        """
+        records = {}
+        for record in self.extract(reply, include):
+            records[record.pop(self.key)] = record
+        return records
+
+
+INTERFACE_STATUS = RecordExtractor(
+    rows='//physical-interface|//logical-interface',
+    fields=(
+        ('name', 'name'),
+        ('admin-status', 'admin-status'),
+        ('oper-status', 'oper-status'),
+    ),
+    key='name')
+
+BGP_SUMMARY = RecordExtractor(
+    rows='//bgp-information',
+    fields=(
+        ('peer-count', 'peer-count'),
+        ('down-peer-count', 'down-peer-count'),
+    ))
+
+LDP_SESSIONS = RecordExtractor(
+    rows='//ldp-session-information/ldp-session',
+    fields=(
+        ('ldp-session-state', 'ldp-session-state'),
+        ('ldp-neighbor-address', 'ldp-neighbor-address'),
+    ))
+
+OSPF_NEIGHBORS = RecordExtractor(
+    rows='//ospf-neighbor-information/ospf-neighbor',
+    fields=(
+        ('neighbor-address', 'neighbor-address'),
+        ('ospf-neighbor-state', 'ospf-neighbor-state'),
+        ('neighbor-id', 'neighbor-id'),
+        ('interface-name', 'interface-name'),
+    ))
+
+OSPF_INTERFACES = RecordExtractor(
+    rows='//ospf-interface-information/ospf-interface',
+    fields=(
+        ('interface-name', 'interface-name'),
+        ('ospf-area', 'ospf-area'),
+        ('ospf-interface-state', 'ospf-interface-state'),
+    ))
+
+PCEP_STATUSES = RecordExtractor(
+    rows='//path-computation-client-status/pcc-status-sessions/pcc-status-sessions-entry',
+    fields=(
+        ('session-name', 'session-name'),
+        ('session-type', 'session-type'),
+        ('session-provisioning', 'session-provisioning'),
+        ('session-status', 'session-status'),
+    ))
@@ -0,0 +1,100 @@
+import json
+import logging
+import threading
+import time
+
+# Constants
+HEARTBEAT_INTERVAL = 900  # seconds between repeats of an unchanged state, 0 to never repeat
+
+# Logging
+logger = logging.getLogger(__name__)
+
+
+class StateTable(object):
+    def __init__(self, heartbeat_interval=HEARTBEAT_INTERVAL):
+        """Last emitted state of every (device, metric) pair, so that Events are
+        only sent when a state changes
+
+        The table only lives in memory, so a restarted collector starts empty and
+        sends the full state of every device on its first cycle.
+
+        :param heartbeat_interval: Seconds after which an unchanged state is sent
+                                   again, 0 to only send changes
+        :type heartbeat_interval: int
+        """
+        self.heartbeat_interval = heartbeat_interval
+        self._states = {}
+        self._lock = threading.Lock()
+        self._emitted = 0
+        self._suppressed = 0
+
+    def should_emit(self, device_name, metric, name, body):
+        """Records a collected state and decides whether it has to be sent
+
+        A state is sent when it was never sent before, when the Event name or
+        body differ from the last one sent for the same (device, metric), or
+        when the heartbeat interval has passed since it was last sent.
+
+        :param device_name: Name of the network device
+        :type device_name: str
+        :param metric: What was collected (eg. oper_status)
+        :type metric: str
+        :param name: Name of the Event that describes the state
+        :type name: str
+        :param body: Body of the Event
+        :type body: dict
+        :return: [True] if the Event has to be sent
+        :rtype: bool
+        """
+        signature = (name, json.dumps(body, sort_keys=True))
+        now = time.time()
+        key = (device_name, metric)
+        with self._lock:
+            last = self._states.get(key)
+            if last is not None and last[0] == signature:
+                if not self.heartbeat_interval or now - last[1] < self.heartbeat_interval:
+                    self._suppressed += 1
+                    return False
+            self._states[key] = (signature, now)
+            self._emitted += 1
+        return True
+
+    def forget(self, device_name, metric, name, body):
+        """Drops the state of a (device, metric) if it is still the given one,
+        so it is sent again on the next cycle (eg. when its Event was dropped)
+
+        :param device_name: Name of the network device
+        :type device_name: str
+        :param metric: What was collected (eg. oper_status)
+        :type metric: str
+        :param name: Name of the Event that was not sent
+        :type name: str
+        :param body: Body of the Event that was not sent
+        :type body: dict
+        """
+        signature = (name, json.dumps(body, sort_keys=True))
+        key = (device_name, metric)
+        with self._lock:
+            last = self._states.get(key)
+            # A newer state may have been recorded since, it is kept
+            if last is not None and last[0] == signature:
+                del self._states[key]
+
+    def forget_device(self, device_name):
+        """Drops the states of a device, so its full state is sent on the next
+        cycle (eg. after it reconnected and may have changed unseen)
+
+        :param device_name: Name of the network device
+        :type device_name: str
+        """
+        with self._lock:
+            for key in [key for key in self._states if key[0] == device_name]:
+                del self._states[key]
+
+    def stats(self):
+        """Number of states sent and suppressed since the collector started
+
+        :rtype: dict
+        """
+        with self._lock:
+            return {'emitted': self._emitted, 'suppressed': self._suppressed}
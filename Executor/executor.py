@@ -7,16 +7,21 @@ from flask import Flask, json
 from flask_restful import Api, Resource, reqparse
 from gevent.pywsgi import WSGIServer
 
+from lib.command_plan import PlanRunner
+from lib.job_queue import LANES, RETRY_AFTER, JobQueue, QueueFull
 from lib.northstar_trigger import NorthstarTrigger
+from lib.optimisation_scheduler import OptimisationScheduler
 from lib.junos_cli_trigger import JunosCliTrigger
 from lib.junos_backup_trigger import BackupTrigger
 from lib.junos_trigger import JunosTrigger
+from lib.session_pool import SessionPool
 
 # Constants
 HOST = '0.0.0.0'
 PORT = 5001
 DATABASE_URL = 'http://0.0.0.0'
 DATABASE_PORT = 5000
+OPTIMISATION_WINDOW = 10  # seconds, path optimisations requested within it run once
 # Logging
 handler = logging.StreamHandler()
 handler.setLevel(logging.INFO)
@@ -37,10 +42,34 @@ jbt_logger = logging.getLogger('lib.junos_backup_trigger')
 jbt_logger.setLevel(logging.DEBUG)
 jbt_logger.addHandler(handler)
 
+bs_logger = logging.getLogger('lib.backup_store')
+bs_logger.setLevel(logging.DEBUG)
+bs_logger.addHandler(handler)
+
 jt_logger = logging.getLogger('lib.junos_trigger')
 jt_logger.setLevel(logging.DEBUG)
 jt_logger.addHandler(handler)
 
+cp_logger = logging.getLogger('lib.command_plan')
+cp_logger.setLevel(logging.DEBUG)
+cp_logger.addHandler(handler)
+
+jq_logger = logging.getLogger('lib.job_queue')
+jq_logger.setLevel(logging.DEBUG)
+jq_logger.addHandler(handler)
+
+nc_logger = logging.getLogger('lib.northstar_client')
+nc_logger.setLevel(logging.DEBUG)
+nc_logger.addHandler(handler)
+
+os_logger = logging.getLogger('lib.optimisation_scheduler')
+os_logger.setLevel(logging.DEBUG)
+os_logger.addHandler(handler)
+
+sp_logger = logging.getLogger('lib.session_pool')
+sp_logger.setLevel(logging.DEBUG)
+sp_logger.addHandler(handler)
+
 # Flask Settings
 app = Flask(__name__)
 api = Api(app)
@@ -48,9 +77,39 @@ parser = reqparse.RequestParser()
 
 # Init Execution modules
 ns = NorthstarTrigger()
-jcli = JunosCliTrigger()
-bt = BackupTrigger()
-jt = JunosTrigger()
+optimisations = OptimisationScheduler(ns.trigger_path_optimisation, window=OPTIMISATION_WINDOW)
+sessions = SessionPool()  # Shared by the Junos triggers, one session per device
+jcli = JunosCliTrigger(pool=sessions)
+bt = BackupTrigger(pool=sessions)
+jt = JunosTrigger(pool=sessions)
+runner = PlanRunner()
+
+
+def start_job(job):
+    """Runs the plan of a job from the JobQueue, stores its Execution and
+    tells the queue once it is done
+
+    :param job: Job from the JobQueue
+    :type job: dict
+    """
+    python_commands = job['commands']
+
+    def run_command(command):
+        return ExecuteCommands.run_command(command, job['job_id'])
+
+    def complete(results):
+        status_message = ExecuteCommands.collect_results(python_commands, results)
+        try:
+            ExecuteCommands.send_execution(job['name'], job['binded_events'], python_commands,
+                                           status_message, job['job_id'])
+        finally:
+            jobs.finish(job['job_id'], 'completed' if status_message == 'Completed' else 'failed',
+                        python_commands)
+
+    runner.submit(python_commands, run_command, complete)
+
+
+jobs = JobQueue(start_job)
 
 
 class ExecuteCommands(Resource):
@@ -58,6 +117,11 @@ class ExecuteCommands(Resource):
         """POST method for handling any decisions made by the Evaluator, executing
         all the required commands and storing the results into the Database
 
+        The plan is queued in the JobQueue and its commands run in the
+        background, see PlanRunner, and the Execution is stored once all of
+        them finished. Commands on the same device keep their order,
+        everything else runs at the same time.
+
         Supported command types:
         - northstar: Execute NorthStar SDWAN commands
         - cli:  Execute Junos RPC commands
@@ -67,51 +131,90 @@ class ExecuteCommands(Resource):
         :param commands: List of actions to take
         :param evaluation_name: Name of Evaluation that is to be taken
         :param binded_events: Set of events which triggered the decision
+        :param priority: Lane of the job, critical or informational, defaults to
+                         critical unless the plan only has show commands and backups
+
+        :return: The job id, which is also the uuid of the Execution, with 202 Accepted,
+                 or 429 Too Many Requests when the lane of the job is full
         """
         parser.add_argument('commands', type=str)
         parser.add_argument('evaluation_name', type=str)
         parser.add_argument('binded_events', type=str)
+        parser.add_argument('priority', type=str, choices=LANES)
 
         args = parser.parse_args()
 
-        status_message = 'Completed'
-        status = True
         new_uuid = str(uuid.uuid4())
         python_commands = json.loads(args.commands)
 
-        for i, command in enumerate(python_commands):
-            try:
-                if 'cli' == command['type']:
-                    logger.info('Found CLI command')
-                    output, status = jcli.execute(command)
-                elif 'northstar' == command['type']:
-                    logger.info('Found Northstar command')
-                    output, status = ns.execute(command)
-                elif 'junos_backup' == command['type']:
-                    logger.info('Found JunosBackup command')
-                    output, status = bt.execute(command, new_uuid)
-                elif 'junos' == command['type']:
-                    logger.info('Found JunosTrigger command')
-                    output, status = jt.execute(command)
-                else:
-                    logger.error('Command type not supported: %s', command['type'])
-                    status_message = 'Failed'
-                    status = False
-            except Exception as e:
-                logger.error('An error occurred %s', e)
+        try:
+            jobs.submit(new_uuid, args.evaluation_name, args.binded_events, python_commands, args.priority)
+        except QueueFull as e:
+            logger.error('Rejected %s: %s', args.evaluation_name, e)
+            return {'Error': str(e)}, 429, {'Retry-After': str(RETRY_AFTER)}
+        logger.info('Queued %s as job %s', args.evaluation_name, new_uuid)
+        return {'job_id': new_uuid}, 202
+
+    @staticmethod
+    def run_command(command, new_uuid):
+        """Runs a single command with the trigger of its type
+
+        :param command: Command of the evaluation
+        :type command: dict
+        :param new_uuid: Unique ID of the Execution
+        :type new_uuid: str
+        :return: The output and [True] if the command succeeded
+        :rtype: tuple
+        """
+        if 'cli' == command['type']:
+            logger.info('Found CLI command')
+            return jcli.execute(command)
+        elif 'northstar' == command['type']:
+            logger.info('Found Northstar command')
+            if command['cmd'] == 'trigger.optimisation':
+                # Collapsed with the optimisations of the other plans
+                return optimisations.request()
+            return ns.execute(command)
+        elif 'junos_backup' == command['type']:
+            logger.info('Found JunosBackup command')
+            return bt.execute(command, new_uuid)
+        elif 'junos' == command['type']:
+            logger.info('Found JunosTrigger command')
+            return jt.execute(command)
+        logger.error('Command type not supported: %s', command['type'])
+        return None, False
+
+    @staticmethod
+    def collect_results(python_commands, results):
+        """Stores the output of every command in the command and works out the
+        status of the whole Execution
+
+        :param python_commands: Commands of the evaluation
+        :type python_commands: list
+        :param results: (output, status) of each command, or the exception it raised
+        :type results: list
+        :return: 'Completed' if every command succeeded, 'Failed' otherwise
+        :rtype: str
+        """
+        status_message = 'Completed'
+        for i, result in enumerate(results):
+            if isinstance(result, Exception):
+                logger.error('An error occurred %s', result)
                 status_message = 'Failed'
-                python_commands[i]['output'] = 'An error occured.\n {}'.format(str(e))
+                python_commands[i]['output'] = 'An error occured.\n {}'.format(str(result))
                 continue
-            else:
-                python_commands[i]['output'] = str(output)
-                if not output or status is False :
-                    status_message = 'Failed'
-
-        self.send_execution(args, python_commands, status_message, new_uuid)
+            output, status = result
+            if output is None:
+                # Unsupported command type
+                status_message = 'Failed'
+                continue
+            python_commands[i]['output'] = str(output)
+            if not output or status is False:
+                status_message = 'Failed'
+        return status_message
 
-    def send_execution(self, args, python_commands, status_message, new_uuid):
-        name = args.evaluation_name
-        binded_events = args.binded_events
+    @staticmethod
+    def send_execution(name, binded_events, python_commands, status_message, new_uuid):
         time = datetime.now().isoformat()
 
         headers = {
@@ -129,8 +232,38 @@ class ExecuteCommands(Resource):
         logger.info('Sent execution event %s', r.status_code)
 
 
+class JobStatus(Resource):
+    def get(self, job_id):
+        """GET method for the status of a job accepted by /exec_command
+
+        :param job_id: Job id returned by /exec_command
+        :return: The job with its status (queued, running, completed, failed or
+                 interrupted), its position in its lane while queued, and the
+                 output of the commands once it finished
+        """
+        job = jobs.get(job_id)
+        if job is None:
+            return {'Error': 'Unknown job {}'.format(job_id)}, 404
+        return job, 200
+
+
+class JobStats(Resource):
+    def get(self):
+        """GET method for the number of jobs per status and lane"""
+        return jobs.stats(), 200
+
+
+class OptimisationStats(Resource):
+    def get(self):
+        """GET method for the path optimisations, with how many requests each one absorbed"""
+        return optimisations.stats(), 200
+
+
 # Routes for Executor API
 api.add_resource(ExecuteCommands, '/exec_command')
+api.add_resource(JobStatus, '/jobs/<string:job_id>')
+api.add_resource(JobStats, '/jobs')
+api.add_resource(OptimisationStats, '/optimisations')
 
 
 if __name__ == '__main__':
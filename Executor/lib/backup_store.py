@@ -0,0 +1,231 @@
+import difflib
+import gzip
+import hashlib
+import logging
+import os
+import sqlite3
+import threading
+import time
+import zlib
+
+# Constants
+BACKUP_FOLDER = 'backups'
+INDEX_FILE = 'index.db'
+BUSY_TIMEOUT = 30  # seconds
+RETENTION_DAYS = 90  # Backups older than this are removed...
+KEEP_LATEST = 10  # ...except for the latest ones of each device
+
+# Logging
+logger = logging.getLogger(__name__)
+
+
+class BackupStore(object):
+    def __init__(self, folder=BACKUP_FOLDER, retention_days=RETENTION_DAYS, keep_latest=KEEP_LATEST):
+        """Content addressed store of the configuration backups
+
+        Each distinct configuration is stored once, gzipped, under its SHA-256 in
+        blobs/. A SQLite index keeps every backup of a device (time, hash and
+        uuid of the Execution) and the diff between each configuration and the
+        previous different one.
+
+        Backups older than retention_days are removed when a device is backed
+        up, except for its keep_latest latest ones, along with the blobs and
+        diffs no backup refers to anymore.
+
+        :param folder: Folder of the blobs and of the index
+        :type folder: str
+        :param retention_days: Days after which backups are removed
+        :type retention_days: float
+        :param keep_latest: Backups of each device kept whatever their age
+        :type keep_latest: int
+        """
+        self.folder = folder
+        self.retention_days = retention_days
+        self.keep_latest = keep_latest
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(os.path.join(folder, INDEX_FILE), timeout=BUSY_TIMEOUT,
+                                     check_same_thread=False, isolation_level=None)
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        self._conn.execute('CREATE TABLE IF NOT EXISTS backup ('
+                           'id INTEGER PRIMARY KEY, '
+                           'device TEXT NOT NULL, '
+                           'created REAL NOT NULL, '
+                           'hash TEXT NOT NULL, '
+                           'uuid TEXT)')
+        self._conn.execute('CREATE INDEX IF NOT EXISTS backup_device ON backup (device, created)')
+        self._conn.execute('CREATE TABLE IF NOT EXISTS diff ('
+                           'old_hash TEXT NOT NULL, '
+                           'new_hash TEXT NOT NULL, '
+                           'diff BLOB NOT NULL, '
+                           'PRIMARY KEY (old_hash, new_hash))')
+
+    def blob_path(self, config_hash):
+        """Gets the location of a stored configuration
+
+        :param config_hash: SHA-256 of the configuration
+        :type config_hash: str
+        :rtype: str
+        """
+        return os.path.join(self.folder, 'blobs', config_hash[:2], '{}.gz'.format(config_hash))
+
+    def save(self, device, config, uuid):
+        """Stores a backup of a device
+
+        :param device: Name of the network device
+        :type device: str
+        :param config: Configuration of the device
+        :type config: str
+        :param uuid: Unique ID of the Execution the backup was taken by
+        :type uuid: str
+        :return: The backup, with the diff to the previous configuration of the
+                 device ('' when unchanged, None for the first backup)
+        :rtype: dict
+        """
+        config_hash = hashlib.sha256(config.encode('utf-8')).hexdigest()
+        path = self.blob_path(config_hash)
+        # The lock also keeps _prune from removing the blob before it is indexed
+        with self._lock:
+            if not os.path.exists(path):
+                if not os.path.isdir(os.path.dirname(path)):
+                    os.makedirs(os.path.dirname(path))
+                # Written under a temporary name, so a crash cannot leave a truncated blob
+                with gzip.open(path + '.tmp', 'wb') as f:
+                    f.write(config.encode('utf-8'))
+                os.rename(path + '.tmp', path)
+
+            previous = self._latest(device)
+            created = time.time()
+            self._conn.execute('INSERT INTO backup (device, created, hash, uuid) VALUES (?, ?, ?, ?)',
+                               (device, created, config_hash, uuid))
+            diff = None
+            if previous is not None:
+                diff = self._diff(previous['hash'], config_hash, config)
+            self._prune(device)
+
+        logger.info('Backed up %s as %s (%s)', device, config_hash,
+                    'unchanged' if diff == '' else 'first backup' if diff is None else 'changed')
+        return {'device': device, 'created': created, 'hash': config_hash, 'uuid': uuid, 'diff': diff}
+
+    def read(self, config_hash):
+        """Gets a stored configuration
+
+        :param config_hash: SHA-256 of the configuration
+        :type config_hash: str
+        :rtype: str
+        """
+        with gzip.open(self.blob_path(config_hash), 'rb') as f:
+            return f.read().decode('utf-8')
+
+    def latest(self, device):
+        """Gets the latest backup of a device
+
+        :param device: Name of the network device
+        :type device: str
+        :return: The backup, None if the device was never backed up
+        :rtype: dict
+        """
+        with self._lock:
+            return self._latest(device)
+
+    def at(self, device, when):
+        """Gets the backup of a device that was current at a point in time
+
+        :param device: Name of the network device
+        :type device: str
+        :param when: Unix time
+        :type when: float
+        :return: The backup, None if the device was not backed up yet
+        :rtype: dict
+        """
+        with self._lock:
+            row = self._conn.execute('SELECT device, created, hash, uuid FROM backup '
+                                     'WHERE device = ? AND created <= ? ORDER BY created DESC LIMIT 1',
+                                     (device, when)).fetchone()
+        return self._backup(row)
+
+    def history(self, device):
+        """Gets every backup of a device, oldest first
+
+        :param device: Name of the network device
+        :type device: str
+        :rtype: list
+        """
+        with self._lock:
+            rows = self._conn.execute('SELECT device, created, hash, uuid FROM backup '
+                                      'WHERE device = ? ORDER BY created', (device,)).fetchall()
+        return [self._backup(row) for row in rows]
+
+    def diff(self, device, since, until=None):
+        """Gets the changes to the configuration of a device between two points in time
+
+        :param device: Name of the network device
+        :type device: str
+        :param since: Unix time of the old configuration
+        :type since: float
+        :param until: Unix time of the new configuration, defaults to the latest backup
+        :type until: float, optional
+        :return: Unified diff, '' when unchanged, None when there was no backup at either point
+        :rtype: str
+        """
+        old = self.at(device, since)
+        new = self.at(device, until) if until is not None else self.latest(device)
+        if old is None or new is None:
+            return None
+        if old['hash'] == new['hash']:
+            return ''
+        with self._lock:
+            row = self._conn.execute('SELECT diff FROM diff WHERE old_hash = ? AND new_hash = ?',
+                                     (old['hash'], new['hash'])).fetchone()
+        if row is not None:
+            return zlib.decompress(row[0]).decode('utf-8')
+        return self._unified_diff(self.read(old['hash']), self.read(new['hash']), old['hash'], new['hash'])
+
+    @staticmethod
+    def _backup(row):
+        if row is None:
+            return None
+        return {'device': row[0], 'created': row[1], 'hash': row[2], 'uuid': row[3]}
+
+    def _latest(self, device):
+        row = self._conn.execute('SELECT device, created, hash, uuid FROM backup '
+                                 'WHERE device = ? ORDER BY created DESC LIMIT 1', (device,)).fetchone()
+        return self._backup(row)
+
+    @staticmethod
+    def _unified_diff(old_config, new_config, old_hash, new_hash):
+        return ''.join(difflib.unified_diff(old_config.splitlines(True), new_config.splitlines(True),
+                                            old_hash[:12], new_hash[:12]))
+
+    def _diff(self, old_hash, new_hash, new_config):
+        # Called with the lock held, stores the diff between consecutive configurations
+        if old_hash == new_hash:
+            return ''
+        row = self._conn.execute('SELECT diff FROM diff WHERE old_hash = ? AND new_hash = ?',
+                                 (old_hash, new_hash)).fetchone()
+        if row is not None:
+            return zlib.decompress(row[0]).decode('utf-8')
+        diff = self._unified_diff(self.read(old_hash), new_config, old_hash, new_hash)
+        self._conn.execute('INSERT INTO diff (old_hash, new_hash, diff) VALUES (?, ?, ?)',
+                           (old_hash, new_hash, sqlite3.Binary(zlib.compress(diff.encode('utf-8')))))
+        return diff
+
+    def _prune(self, device):
+        # Called with the lock held, removes the expired backups of a device
+        # and then the blobs and diffs that are no longer used
+        expired = self._conn.execute('SELECT id, hash FROM backup WHERE device = ? AND created < ? '
+                                     'AND id NOT IN (SELECT id FROM backup WHERE device = ? '
+                                     'ORDER BY created DESC LIMIT ?)',
+                                     (device, time.time() - self.retention_days * 86400,
+                                      device, self.keep_latest)).fetchall()
+        if not expired:
+            return
+        self._conn.executemany('DELETE FROM backup WHERE id = ?', [(row[0],) for row in expired])
+        for config_hash in set(row[1] for row in expired):
+            if self._conn.execute('SELECT 1 FROM backup WHERE hash = ? LIMIT 1', (config_hash,)).fetchone():
+                continue
+            self._conn.execute('DELETE FROM diff WHERE old_hash = ? OR new_hash = ?', (config_hash, config_hash))
+            try:
+                os.remove(self.blob_path(config_hash))
+            except OSError as e:
+                logger.warning('Could not remove blob %s: %s', config_hash, e)
+        logger.info('Removed %s expired backups of %s', len(expired), device)
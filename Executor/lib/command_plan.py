@@ -0,0 +1,163 @@
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+# Constants
+MAX_WORKERS = 16  # Commands running at the same time, over every plan
+READ_COMMAND_TYPES = ('cli', 'junos_backup')  # Show commands and backups do not change the device
+BARRIER_COMMANDS = ('trigger.optimisation',)  # Commands that act on the whole network
+
+# Logging
+logger = logging.getLogger(__name__)
+
+
+def command_device(command):
+    """Gets the network device a command acts on
+
+    :param command: Command of an evaluation config
+    :type command: dict
+    :return: Name of the device, None if the command is not about one device
+    :rtype: str
+    """
+    args = command.get('args')
+    if isinstance(args, dict):
+        args = args.get('device')
+    if not args or args == 'None':
+        return None
+    return str(args)
+
+
+def is_barrier(command):
+    """[True] if the command affects the whole network (eg. a path optimisation),
+    so it has to wait for every earlier command and every later command has to wait for it
+    """
+    if command.get('cmd') in BARRIER_COMMANDS:
+        return True
+    return command_device(command) is None
+
+
+def is_read(command):
+    """[True] if the command only reads from its device"""
+    return command.get('type') in READ_COMMAND_TYPES
+
+
+def build_dependencies(commands):
+    """Turns the commands of a plan into a dependency DAG
+
+    - Reads wait for the last write to the same device
+    - Writes wait for every earlier command on the same device
+    - Barriers wait for every earlier command and every later command waits for them
+
+    Independent commands, such as the show commands and the backup of a device,
+    or commands on different devices, can then run at the same time while the
+    order that matters is kept.
+
+    :param commands: Commands in the order of the plan
+    :type commands: list
+    :return: For every command, the set of positions of the commands it waits for
+    :rtype: list
+    """
+    dependencies = []
+    last_barrier = None
+    last_write = {}
+    since_barrier = []
+    device_steps = {}
+    for position, command in enumerate(commands):
+        if is_barrier(command):
+            waits_for = set(since_barrier)
+            if last_barrier is not None:
+                waits_for.add(last_barrier)
+            last_barrier = position
+            since_barrier = []
+            last_write = {}
+            device_steps = {}
+        else:
+            device = command_device(command)
+            if is_read(command):
+                waits_for = {last_write[device]} if device in last_write else set()
+            else:
+                waits_for = set(device_steps.get(device, ()))
+                last_write[device] = position
+            if last_barrier is not None and not waits_for:
+                waits_for.add(last_barrier)
+            device_steps.setdefault(device, []).append(position)
+            since_barrier.append(position)
+        dependencies.append(waits_for)
+    return dependencies
+
+
+class PlanRunner(object):
+    def __init__(self, max_workers=MAX_WORKERS):
+        """Runs the commands of plans on a shared thread pool, each command as
+        soon as the commands it depends on finished
+
+        Plans are driven by the completion of their commands, so no thread
+        waits for a plan to finish.
+
+        :param max_workers: Commands running at the same time
+        :type max_workers: int
+        """
+        self.pool = ThreadPoolExecutor(max_workers=max_workers)
+
+    def submit(self, commands, run_command, on_complete):
+        """Starts running a plan in the background
+
+        :param commands: Commands in the order of the plan
+        :type commands: list
+        :param run_command: Called with each command, its result is collected
+        :type run_command: callable
+        :param on_complete: Called with the list of results, in the order of the
+                            commands, once every command has run
+        :type on_complete: callable
+        """
+        Plan(self.pool, commands, run_command, on_complete).start()
+
+
+class Plan(object):
+    def __init__(self, pool, commands, run_command, on_complete):
+        self.pool = pool
+        self.commands = commands
+        self.run_command = run_command
+        self.on_complete = on_complete
+        self.results = [None] * len(commands)
+        self.waiting = [set(waits_for) for waits_for in build_dependencies(commands)]
+        self.dependents = [[] for _ in commands]
+        for position, waits_for in enumerate(self.waiting):
+            for dependency in waits_for:
+                self.dependents[dependency].append(position)
+        self.remaining = len(commands)
+        self._lock = threading.Lock()
+
+    def start(self):
+        if not self.commands:
+            self.on_complete(self.results)
+            return
+        # Collected first, as the first commands may finish while submitting
+        roots = [position for position, waits_for in enumerate(self.waiting) if not waits_for]
+        for position in roots:
+            self._submit(position)
+
+    def _submit(self, position):
+        future = self.pool.submit(self.run_command, self.commands[position])
+        future.add_done_callback(lambda f: self._done(position, f))
+
+    def _done(self, position, future):
+        try:
+            self.results[position] = future.result()
+        except Exception as e:
+            self.results[position] = e
+        ready = []
+        with self._lock:
+            self.remaining -= 1
+            finished = self.remaining == 0
+            for dependent in self.dependents[position]:
+                self.waiting[dependent].discard(position)
+                if not self.waiting[dependent]:
+                    ready.append(dependent)
+        for dependent in ready:
+            self._submit(dependent)
+        if finished:
+            try:
+                self.on_complete(self.results)
+            except Exception as e:
+                logger.exception('Could not complete the plan: %s', e)
@@ -0,0 +1,233 @@
+import json
+import logging
+import sqlite3
+import threading
+import time
+
+from .command_plan import command_device, is_read
+
+# Constants
+JOBS_FILE = 'jobs.db'
+BUSY_TIMEOUT = 30  # seconds
+MAX_RUNNING_JOBS = 8  # Plans running at the same time
+MAX_JOBS_PER_DEVICE = 1  # Plans touching the same device at the same time
+LANES = ('critical', 'informational')  # In the order they are served
+MAX_QUEUED = {
+    'critical': 1000,
+    'informational': 100,  # Rejected first, so show commands cannot crowd out remediation
+}
+RETRY_AFTER = 30  # seconds, sent with 429 replies
+JOB_STATUSES = ('queued', 'running', 'completed', 'failed', 'interrupted')
+
+# Logging
+logger = logging.getLogger(__name__)
+
+
+class QueueFull(Exception):
+    """Raised when a lane of the JobQueue holds MAX_QUEUED jobs"""
+
+
+def plan_lane(commands):
+    """Gets the lane of a plan, critical when it changes anything, informational
+    when it only runs show commands and backups
+
+    :param commands: Commands of the plan
+    :type commands: list
+    :rtype: str
+    """
+    if all(is_read(command) for command in commands):
+        return 'informational'
+    return 'critical'
+
+
+class JobQueue(object):
+    def __init__(self, start_job, path=JOBS_FILE, max_running=MAX_RUNNING_JOBS,
+                 max_per_device=MAX_JOBS_PER_DEVICE, max_queued=None):
+        """Persistent queue of the plans sent to the Executor
+
+        Jobs are started in lane order (critical before informational) and then
+        in the order they arrived, as long as fewer than max_running jobs run and
+        none of the devices of the job already has max_per_device jobs running.
+        A job that has to wait for a busy device does not hold back the jobs
+        behind it.
+
+        Jobs are stored in SQLite, so queued jobs survive a restart. Jobs that
+        were running when the Executor stopped are marked as interrupted rather
+        than run again, as they may have changed devices already.
+
+        :param start_job: Called with each job dict when it starts, has to call
+                          finish once the job is done
+        :type start_job: callable
+        :param path: SQLite file of the jobs
+        :type path: str
+        :param max_running: Jobs running at the same time
+        :type max_running: int
+        :param max_per_device: Jobs running at the same time on one device
+        :type max_per_device: int
+        :param max_queued: Lane to the number of jobs it can hold, defaults to MAX_QUEUED
+        :type max_queued: dict, optional
+        """
+        self.start_job = start_job
+        self.max_running = max_running
+        self.max_per_device = max_per_device
+        self.max_queued = max_queued or MAX_QUEUED
+        self._running = {}  # Job id to its devices
+        self._device_jobs = {}
+        self._condition = threading.Condition()
+        self._conn = sqlite3.connect(path, timeout=BUSY_TIMEOUT, check_same_thread=False, isolation_level=None)
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        self._conn.execute('CREATE TABLE IF NOT EXISTS job ('
+                           'id TEXT PRIMARY KEY, '
+                           'name TEXT, '
+                           'binded_events TEXT, '
+                           'commands TEXT NOT NULL, '
+                           'lane INTEGER NOT NULL, '
+                           'status TEXT NOT NULL, '
+                           'result TEXT, '
+                           'created REAL NOT NULL, '
+                           'started REAL, '
+                           'finished REAL)')
+        self._conn.execute('CREATE INDEX IF NOT EXISTS job_queued ON job (status, lane, created)')
+        interrupted = self._conn.execute('UPDATE job SET status = \'interrupted\', finished = ? '
+                                         'WHERE status = \'running\'', (time.time(),)).rowcount
+        if interrupted:
+            logger.warning('Marked %s jobs that were running at the last shutdown as interrupted', interrupted)
+        thread = threading.Thread(name='JobQueue', target=self._dispatch)
+        thread.daemon = True
+        thread.start()
+
+    def submit(self, job_id, name, binded_events, commands, lane=None):
+        """Queues a plan
+
+        :param job_id: Unique ID of the job, also used for its Execution
+        :type job_id: str
+        :param name: Name of the evaluation
+        :type name: str
+        :param binded_events: Serialised events which triggered the evaluation
+        :type binded_events: str
+        :param commands: Commands of the plan
+        :type commands: list
+        :param lane: One of LANES, defaults to the lane of the plan (see plan_lane)
+        :type lane: str, optional
+        :raises QueueFull: If the lane of the job is full
+        :raises ValueError: If the lane is unknown
+        """
+        lane = lane or plan_lane(commands)
+        if lane not in LANES:
+            raise ValueError('lane must be one of {}'.format(', '.join(LANES)))
+        with self._condition:
+            queued = self._conn.execute('SELECT COUNT(*) FROM job WHERE status = \'queued\' AND lane = ?',
+                                        (LANES.index(lane),)).fetchone()[0]
+            if queued >= self.max_queued[lane]:
+                raise QueueFull('{} jobs are already queued in the {} lane'.format(queued, lane))
+            self._conn.execute('INSERT INTO job (id, name, binded_events, commands, lane, status, created) '
+                               'VALUES (?, ?, ?, ?, ?, \'queued\', ?)',
+                               (job_id, name, binded_events, json.dumps(commands), LANES.index(lane), time.time()))
+            self._condition.notify()
+
+    def finish(self, job_id, status, commands):
+        """Records the end of a job and lets the next jobs start
+
+        :param job_id: Unique ID of the job
+        :type job_id: str
+        :param status: 'completed' or 'failed'
+        :type status: str
+        :param commands: Commands with their output
+        :type commands: list
+        """
+        with self._condition:
+            self._conn.execute('UPDATE job SET status = ?, result = ?, finished = ? WHERE id = ?',
+                               (status, json.dumps(commands), time.time(), job_id))
+            for device in self._running.pop(job_id, ()):
+                self._device_jobs[device] -= 1
+            self._condition.notify()
+
+    def get(self, job_id):
+        """Gets a job
+
+        :param job_id: Unique ID of the job
+        :type job_id: str
+        :return: The job, with its position in its lane while it is queued, None if it does not exist
+        :rtype: dict
+        """
+        with self._condition:
+            row = self._conn.execute('SELECT id, name, binded_events, commands, lane, status, result, '
+                                     'created, started, finished FROM job WHERE id = ?', (job_id,)).fetchone()
+            if row is None:
+                return None
+            job = self._job(row)
+            if job['status'] == 'queued':
+                job['position'] = self._conn.execute(
+                    'SELECT COUNT(*) FROM job WHERE status = \'queued\' AND lane = ? AND created < ?',
+                    (row[4], row[7])).fetchone()[0]
+        if job['result'] is not None:
+            job['commands'] = job.pop('result')
+        else:
+            del job['result']
+        return job
+
+    def stats(self):
+        """Number of jobs per status and of queued jobs per lane
+
+        :rtype: dict
+        """
+        with self._condition:
+            statuses = dict(self._conn.execute('SELECT status, COUNT(*) FROM job GROUP BY status').fetchall())
+            lanes = dict(self._conn.execute('SELECT lane, COUNT(*) FROM job WHERE status = \'queued\' '
+                                            'GROUP BY lane').fetchall())
+        return {
+            'jobs': dict((status, statuses.get(status, 0)) for status in JOB_STATUSES),
+            'queued': dict((lane, lanes.get(i, 0)) for i, lane in enumerate(LANES)),
+            'running_devices': sorted(device for device, count in self._device_jobs.items() if count),
+        }
+
+    @staticmethod
+    def _job(row):
+        return {
+            'job_id': row[0],
+            'name': row[1],
+            'binded_events': row[2],
+            'commands': json.loads(row[3]),
+            'lane': LANES[row[4]],
+            'status': row[5],
+            'result': json.loads(row[6]) if row[6] else None,
+            'created': row[7],
+            'started': row[8],
+            'finished': row[9],
+        }
+
+    def _next_job(self):
+        # Queued jobs in lane and arrival order, skipping the ones whose devices are busy
+        rows = self._conn.execute('SELECT id, name, binded_events, commands, lane, status, result, '
+                                  'created, started, finished FROM job WHERE status = \'queued\' '
+                                  'ORDER BY lane, created')
+        for row in rows:
+            job = self._job(row)
+            devices = set(command_device(command) for command in job['commands'])
+            devices.discard(None)
+            if all(self._device_jobs.get(device, 0) < self.max_per_device for device in devices):
+                return job, devices
+        return None, None
+
+    def _dispatch(self):
+        while True:
+            with self._condition:
+                job = None
+                while job is None:
+                    if len(self._running) < self.max_running:
+                        job, devices = self._next_job()
+                    if job is None:
+                        self._condition.wait()
+                job['started'] = time.time()
+                job['status'] = 'running'
+                self._conn.execute('UPDATE job SET status = \'running\', started = ? WHERE id = ?',
+                                   (job['started'], job['job_id']))
+                self._running[job['job_id']] = devices
+                for device in devices:
+                    self._device_jobs[device] = self._device_jobs.get(device, 0) + 1
+            logger.info('Starting job %s (%s)', job['job_id'], job['name'])
+            try:
+                self.start_job(job)
+            except Exception as e:
+                logger.exception('Could not start job %s: %s', job['job_id'], e)
+                self.finish(job['job_id'], 'failed', job['commands'])
@@ -1,6 +1,6 @@
 import logging
-from datetime import datetime
 
+from .backup_store import BackupStore
 from .conn_device import ConnDevice
 
 # Logging
@@ -18,33 +18,35 @@ class BackupTrigger(ConnDevice):
         :param backup_folder: str, optional
         """
         self.backup_folder = backup_folder
+        self.store = BackupStore(backup_folder)
 
         super(BackupTrigger, self).__init__(*args, **kwargs)
         logger.info('Started BackupTrigger')
 
     def backup_config(self, args, uuid):
         """Connects to the device specified in the arguments and
-        backs up the configuration into the backup folder
+        backs up the configuration into the BackupStore of the backup folder
 
         :param args: Device name to connect to
         :type args: str
         :param uuid: Unique ID corresponding to execution this command
                      was ran under
         :type uuid: str
-        :return: Message containing the location of the backup
+        :return: Message containing the location of the backup and the changes
+                 since the previous backup
         :rtype: str
         """
         command = 'show configuration | no-more'
-        dev = self.connected_devices[args].open()
-
         logger.info('Executing CLI command: %s', command)
-        output = dev.cli(command)
-        date = datetime.now().isoformat().replace(':', '_')
-        filename = '{}/config_{}_{}.conf'.format(self.backup_folder, date, uuid)
-        # Save configuration
-        with open(filename, 'w') as f:
-            f.write(output)
-        return 'Config was backed up to {}'.format(filename)
+        with self.pool.session(args) as dev:
+            output = dev.cli(command)
+        backup = self.store.save(args, output, uuid)
+        message = 'Config was backed up to {}'.format(self.store.blob_path(backup['hash']))
+        if backup['diff'] is None:
+            return message
+        if not backup['diff']:
+            return '{}\nNo changes since the previous backup'.format(message)
+        return '{}\nChanges since the previous backup:\n{}'.format(message, backup['diff'])
 
     def execute(self, vars, uuid):
         """Executes BackupTrigger valid commands
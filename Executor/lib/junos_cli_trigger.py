@@ -25,7 +25,7 @@ class JunosCliTrigger(ConnDevice):
                             defaults to 'config/devices.yaml'
         :param config_path: str, optional
         """
-        super(JunosCliTrigger, self).__init__(*args, **kwargs)
+        super(JunosCliTrigger, self).__init__(config_path, *args, **kwargs)
         logger.info('Started JunosCliTrigger')
 
     def run_junos_cli_cmd(self, command, args):
@@ -39,7 +39,8 @@ class JunosCliTrigger(ConnDevice):
         :return: Output of the command that was ran
         :rtype: str
         """
-        dev = self.connected_devices[args].open()
+        # StartShell opens its own SSH connection, so the NETCONF session is not borrowed
+        dev = self.pool.get(args)
 
         logger.info('Executing CLI command: %s', command)
 
@@ -29,10 +29,10 @@ class JunosTrigger(ConnDevice):
         :return: Output as a result of loading the new config and if it failed or suceeded
         :rtype: tuple
         """
-        dev = self.connected_devices[device_name].open()
         config_filepath = 'config_snippets/{}'.format(config_name)
         try:
-            with Config(dev, mode='exclusive') as cu, open(config_filepath, 'r') as config_snippet:
+            with self.pool.session(device_name) as dev, \
+                    Config(dev, mode='exclusive') as cu, open(config_filepath, 'r') as config_snippet:
                 cu.load(config_snippet.read(), format='text', merge=True)
                 output = cu.diff()
                 cu.commit()
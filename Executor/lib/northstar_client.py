@@ -0,0 +1,123 @@
+import logging
+import threading
+import time
+
+import requests
+from requests.adapters import HTTPAdapter
+
+# Constants
+TOKEN_PATH = '/oauth2/token'
+TOKEN_EXPIRY_SKEW = 60  # seconds before the token expires that a new one is requested
+POOL_SIZE = 16  # Connections kept open to NorthStar, as many as commands running at the same time
+REQUEST_TIMEOUT = 30  # seconds to connect to NorthStar and then between bytes of its reply
+
+# Logging
+logger = logging.getLogger(__name__)
+
+
+class NorthstarClient(object):
+    def __init__(self, base_url, username, password, verify=False, pool_size=POOL_SIZE, timeout=REQUEST_TIMEOUT):
+        """HTTP client of the NorthStar REST API
+
+        Requests share one keep-alive session, so a plan's NorthStar calls reuse
+        the same TLS connections. The OAuth token is requested once and reused
+        until TOKEN_EXPIRY_SKEW seconds before it expires, or until NorthStar
+        replies with 401, in which case it is renewed and the request sent again.
+        Every request gives up after timeout seconds without an answer, so an
+        unresponsive NorthStar cannot hold the commands waiting on it forever.
+
+        :param base_url: Scheme, hostname and port of NorthStar
+        :type base_url: str
+        :param username: NorthStar username
+        :type username: str
+        :param password: NorthStar password
+        :type password: str
+        :param verify: Verify the TLS certificate of NorthStar
+        :type verify: bool
+        :param pool_size: Connections kept open to NorthStar
+        :type pool_size: int
+        :param timeout: Default seconds to connect and to wait for each part of a reply
+        :type timeout: float
+        """
+        self.base_url = base_url
+        self.username = username
+        self.password = password
+        self.verify = verify
+        self.timeout = timeout
+        self.session = requests.Session()
+        self.session.verify = verify
+        self.session.mount('https://', HTTPAdapter(pool_connections=1, pool_maxsize=pool_size))
+        self.session.mount('http://', HTTPAdapter(pool_connections=1, pool_maxsize=pool_size))
+        self._authorization = None
+        self._expires_at = 0
+        self._token_lock = threading.Lock()
+
+    def _get_token(self, stale=None):
+        """Gets the Authorization header, requesting a new token when there is
+        none, when it is about to expire or when it is the stale one
+
+        :param stale: Authorization header NorthStar refused
+        :type stale: str, optional
+        :raises ConnectionError: When there is a problem in connecting to the Authentication API
+        :raises requests.exceptions.Timeout: When NorthStar does not answer in time
+        :rtype: str
+        """
+        with self._token_lock:
+            if (self._authorization and self._authorization != stale
+                    and (self._expires_at is None or time.time() < self._expires_at)):
+                return self._authorization
+
+            payload = {
+                'grant_type': 'password',
+                'username': self.username,
+                'password': self.password
+            }
+            logger.info('Connecting to {} with username: {}'.format(self.base_url, self.username))
+            r = self.session.post(self.base_url + TOKEN_PATH, data=payload, auth=(self.username, self.password),
+                                  timeout=self.timeout)
+            try:
+                assert r.status_code == 200, r.status_code
+                reply = r.json()
+                authorization = '{} {}'.format(reply['token_type'], reply['access_token'])
+            except (AssertionError, KeyError, ValueError) as e:
+                raise ConnectionError('Could not authenticate to NorthStar REST API: {}'.format(e))
+
+            self._authorization = authorization
+            # Without expires_in the token is kept until NorthStar refuses it
+            expires_in = reply.get('expires_in')
+            self._expires_at = time.time() + float(expires_in) - TOKEN_EXPIRY_SKEW if expires_in else None
+            logger.info('Authorization was successful, token expires in %s seconds', expires_in)
+            return authorization
+
+    def request(self, method, path, **kwargs):
+        """Sends an authenticated request to NorthStar
+
+        :param method: HTTP method
+        :type method: str
+        :param path: Path of the API (eg. /NorthStar/API/v2/tenant/1/topology/1/nodes)
+        :type path: str
+        :param kwargs: Passed on to requests (eg. json, data, timeout)
+        :raises ConnectionError: When there is a problem in connecting to the Authentication API
+        :raises requests.exceptions.Timeout: When NorthStar does not answer in time
+        :rtype: requests.Response
+        """
+        kwargs.setdefault('timeout', self.timeout)
+        headers = kwargs.pop('headers', {})
+        headers.setdefault('Content-Type', 'application/json')
+        authorization = self._get_token()
+        headers['Authorization'] = authorization
+        r = self.session.request(method, self.base_url + path, headers=headers, **kwargs)
+        if r.status_code == 401:
+            logger.info('NorthStar refused the token, requesting a new one')
+            headers['Authorization'] = self._get_token(stale=authorization)
+            r = self.session.request(method, self.base_url + path, headers=headers, **kwargs)
+        return r
+
+    def get(self, path, **kwargs):
+        return self.request('GET', path, **kwargs)
+
+    def post(self, path, **kwargs):
+        return self.request('POST', path, **kwargs)
+
+    def put(self, path, **kwargs):
+        return self.request('PUT', path, **kwargs)
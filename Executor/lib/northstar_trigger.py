@@ -1,18 +1,23 @@
 import logging
+import threading
+import time
 from datetime import datetime, timedelta
 import yaml
-import requests
+
+from .northstar_client import NorthstarClient
 
 # Constants
 NORTHSTAR_AUTH = 'config/auth.yaml'
+TOPOLOGY_PATH = '/NorthStar/API/v2/tenant/1/topology/1'
+NODE_CACHE_TTL = 300  # seconds, nodes rarely change
+MAINTENANCE_CACHE_TTL = 60  # seconds, maintenances are also created outside of CoreNet
 
 # Logging
 logger = logging.getLogger(__name__)
 
 
 class NorthstarTrigger(object):
-    access_token = None
-    token_type = None
+    client = None
     base_url = None
     username = None
     password = None
@@ -21,58 +26,111 @@ class NorthstarTrigger(object):
     def __init__(self, config_file=NORTHSTAR_AUTH):
         """NorthStar REST API Translator"""
         self._import_variables(config_file)
+        self.client = NorthstarClient(self.base_url, self.username, self.password, verify=self.verify)
+        # Hostname to nodeIndex and name to maintenance, with the time they were fetched
+        self._nodes = {}
+        self._nodes_fetched = None
+        self._maintenances = {}
+        self._maintenances_fetched = None
+        self._cache_lock = threading.RLock()
         logger.info('Started NorthStarTrigger')
 
     def _import_variables(self, config_file):
         """Imports authentication credentials for NorthStar"""
         with open(config_file) as file:
-            imported_vars = yaml.load(file.read())
+            imported_vars = yaml.safe_load(file.read())
 
         self.base_url = 'https://{}:{}'.format(imported_vars['hostname'], imported_vars['port'])
         self.username = imported_vars['username']
         self.password = imported_vars['password']
 
-    def _get_token(self):
-        """Requests the Token needed for making NorthStar API calls
-
-        :raises ConnectionError: When there is a problem in connecting to the Authentication API
-        """
-        payload = {
-            'grant_type': 'password',
-            'username': self.username,
-            'password': self.password
-        }
-        token_url = self.base_url + '/oauth2/token'
-        logger.info('Connecting to {} with username: {}'.format(self.base_url, self.username))
-        r = requests.post(token_url, data=payload, verify=self.verify, auth=(self.username, self.password))
-
-        try:
-            assert r.status_code == 200
-            reply = r.json()
-            self.access_token = reply['access_token']
-            self.token_type = reply['token_type']
-            logger.debug('Got token: {}'.format(self.access_token))
-            if self.access_token:
-                logger.info('Authorization was successful')
-        except IndexError as e:
-            raise ConnectionError('Could not authenticate to NorthStar REST API: {}'.format(e))
-
-    def _node_id_from_name(self, name, nodes):
-        """Gets the node ID corresponding to the Router name
+    def node_index(self, name):
+        """Gets the node ID corresponding to the Router name, from the node
+        cache which is fetched again after NODE_CACHE_TTL seconds, or straight
+        away when the router is not in it (eg. it was just added)
 
         :param name: Router name
         :type name: str
-        :param nodes: Northstar node list
-        :type nodes: list
-        :return: Node ID, [None] if router is not in the node
+        :return: Node ID, [None] if router is not in the topology
         :rtype: int
         """
-        for node in nodes:
-            if 'hostName' not in node.keys():
-                continue
-            if node['hostName'] == name:
-                return node['nodeIndex']
-        return None
+        with self._cache_lock:
+            fetched = False
+            if self._nodes_fetched is None or time.time() - self._nodes_fetched > NODE_CACHE_TTL:
+                self._fetch_nodes()
+                fetched = True
+            if name not in self._nodes and not fetched:
+                self._fetch_nodes()
+            return self._nodes.get(name)
+
+    def find_maintenance(self, name, fresh=False):
+        """Gets a maintenance by name, from the maintenance cache which is fetched
+        again after MAINTENANCE_CACHE_TTL seconds, after a maintenance is changed,
+        or straight away when the maintenance is not in it
+
+        :param name: Name of the maintenance
+        :type name: str
+        :param fresh: Fetch the maintenances whatever the cache holds, for
+                      decisions that change NorthStar
+        :type fresh: bool
+        :return: The maintenance, [None] if there is none with this name
+        :rtype: dict
+        """
+        with self._cache_lock:
+            fetched = False
+            if (fresh or self._maintenances_fetched is None
+                    or time.time() - self._maintenances_fetched > MAINTENANCE_CACHE_TTL):
+                self._fetch_maintenances()
+                fetched = True
+            if name not in self._maintenances and not fetched:
+                self._fetch_maintenances()
+            return self._maintenances.get(name)
+
+    def _fetch_nodes(self):
+        # Called with the cache lock held
+        self._nodes = dict((node['hostName'], node['nodeIndex'])
+                           for node in self.get_topology_elements() if 'hostName' in node)
+        self._nodes_fetched = time.time()
+
+    def _fetch_maintenances(self):
+        # Called with the cache lock held
+        self._maintenances = dict((m['name'], m) for m in self.get_maintenance_list())
+        self._maintenances_fetched = time.time()
+
+    def invalidate_cache(self, nodes=False):
+        """Forgets the cached maintenances, and the nodes if asked to, so they
+        are fetched again on next use
+
+        :param nodes: Also forget the nodes
+        :type nodes: bool
+        """
+        with self._cache_lock:
+            self._maintenances_fetched = None
+            if nodes:
+                self._nodes_fetched = None
+
+    def apply_notification(self, object_type, action, topo_object):
+        """Updates the caches from a NorthStar topology notification (as sent on
+        its REST notification interface) instead of fetching everything again
+
+        :param object_type: 'node' or 'maintenance', other notifications are ignored
+        :type object_type: str
+        :param action: 'add', 'update' or 'remove'
+        :type action: str
+        :param topo_object: The node or maintenance of the notification
+        :type topo_object: dict
+        """
+        with self._cache_lock:
+            if object_type == 'node' and 'hostName' in topo_object:
+                cache, key, value = self._nodes, topo_object['hostName'], topo_object.get('nodeIndex')
+            elif object_type == 'maintenance' and 'name' in topo_object:
+                cache, key, value = self._maintenances, topo_object['name'], topo_object
+            else:
+                return
+            if action == 'remove':
+                cache.pop(key, None)
+            elif value is not None:
+                cache[key] = value
 
     def get_topology_elements(self):
         """Retrieves a list of network nodes from the NorthStar API
@@ -81,16 +139,8 @@ class NorthstarTrigger(object):
         :return: List of nodes for each network device
         :rtype: list
         """
-        self._get_token()
-        topology_url = self.base_url + '/NorthStar/API/v2/tenant/1/topology/1/nodes'
-        auth = '{} {}'.format(self.token_type, self.access_token)
-        headers = {
-            'Authorization': auth,
-            'Content-Type': "application/json",
-        }
-
         logger.debug('Getting topology elements')
-        r = requests.get(topology_url, headers=headers, verify=self.verify)
+        r = self.client.get(TOPOLOGY_PATH + '/nodes')
 
         try:
             assert r.status_code == 200
@@ -107,16 +157,8 @@ class NorthstarTrigger(object):
         :return: List of NorthStar Links
         :rtype: list
         """
-        self._get_token()
-        links_url = self.base_url + '/NorthStar/API/v2/tenant/1/topology/1/links'
-        auth = '{} {}'.format(self.token_type, self.access_token)
-        headers = {
-            'Authorization': auth,
-            'Content-Type': "application/json",
-        }
-
         logger.debug('Getting links')
-        r = requests.get(links_url, headers=headers, verify=self.verify)
+        r = self.client.get(TOPOLOGY_PATH + '/links')
 
         try:
             assert r.status_code == 200
@@ -139,15 +181,9 @@ class NorthstarTrigger(object):
         :returns output and status
         :type returns: str, bool
         """
-        self._get_token()
-        maintenance_url = self.base_url + '/NorthStar/API/v2/tenant/1/topology/1/maintenances'
-        auth = '{} {}'.format(self.token_type, self.access_token)
+        maintenance_path = TOPOLOGY_PATH + '/maintenances'
         start_time = datetime.now()
         end_time = datetime.now() + timedelta(days=7)
-        headers = {
-            'Content-Type': 'application/json',
-            'Authorization': auth,
-        }
         body = {
             "topoObjectType": "maintenance",
             "topologyIndex": 1,
@@ -157,16 +193,15 @@ class NorthstarTrigger(object):
             "endTime": end_time.isoformat(),
             "elements": [{"topoObjectType": "node", "index": index}]
         }
-        existing_maintenances = self.get_maintenance_list()
-        maintenances_name = [m['name'] for m in existing_maintenances]
-        if event_name in maintenances_name:
+        if self.find_maintenance(event_name, fresh=True) is not None:
             output ='Maintenance name already in use {}... skipping'.format(event_name)
             logger.info(output)
             return output, True
 
         logger.debug('Putting device into maintenance')
-        logger.debug('Posting to: {}'.format(maintenance_url))
-        r = requests.post(maintenance_url, json=body, headers=headers, verify=self.verify)
+        logger.debug('Posting to: {}'.format(maintenance_path))
+        r = self.client.post(maintenance_path, json=body)
+        self.invalidate_cache()
         if r.status_code != 201:
             return r.json(), False
         logger.info('Successfully created maintenance event, Name:{} Start:{} End:{}'.format(event_name, start_time, end_time))
@@ -178,16 +213,8 @@ class NorthstarTrigger(object):
         :return: List of maintenances on NorthStar
         :rtype: list
         """
-        self._get_token()
-        maintenance_url = self.base_url + '/NorthStar/API/v2/tenant/1/topology/1/maintenances'
-        auth = '{} {}'.format(self.token_type, self.access_token)
-        headers = {
-            'Content-Type': 'application/json',
-            'Authorization': auth,
-        }
-
         logger.debug('Getting maintenance list')
-        r = requests.get(maintenance_url, headers=headers, verify=self.verify)
+        r = self.client.get(TOPOLOGY_PATH + '/maintenances')
         assert r.status_code == 200, r.status_code
         maintenance_list = r.json()
         logger.debug('Got the following maintenances')
@@ -204,14 +231,7 @@ class NorthstarTrigger(object):
         :param info: Existing maintenance object in json
         :type info: str
         """
-        self._get_token()
-        maintenance_url = self.base_url + '/NorthStar/API/v2/tenant/1/topology/1/maintenances/{}'.format(index)
-        auth = '{} {}'.format(self.token_type, self.access_token)
-        headers = {
-            'Content-Type': 'application/json',
-            'Authorization': auth,
-        }
-
+        maintenance_path = TOPOLOGY_PATH + '/maintenances/{}'.format(index)
         body = info
         if body['status'] != status:
             body['status'] = status
@@ -219,7 +239,8 @@ class NorthstarTrigger(object):
             logger.info('Maintenance status already in {}'.format(status))
             return
 
-        r = requests.put(maintenance_url, json=body, headers=headers, verify=self.verify)
+        r = self.client.put(maintenance_path, json=body)
+        self.invalidate_cache()
         logger.debug('Updating maintenance to {}'.format(status))
         assert r.status_code == 200, r.status_code
 
@@ -229,18 +250,9 @@ class NorthstarTrigger(object):
         :return: Output message if there is one or [False] if it failed
         :rtype: str or bool
         """
-        self._get_token()
-        path_optimisation_url = self.base_url + '/NorthStar/API/v2/tenant/1/topology/1/rpc/optimize'
-
-        auth = '{} {}'.format(self.token_type, self.access_token)
-        headers = {
-            'Content-Type': 'application/json',
-            'Authorization': auth,
-        }
-
         logger.debug('Triggering path optimisation')
         try:
-            r = requests.request('POST', path_optimisation_url, data='', headers=headers, verify=self.verify)
+            r = self.client.post(TOPOLOGY_PATH + '/rpc/optimize', data='')
             response = r.json()
             assert r.status_code == 200, r.status_code
         except AssertionError:
@@ -264,8 +276,7 @@ class NorthstarTrigger(object):
         :return: Message saying that the maintenance was created
         :rtype: str
         """
-        topology_info = self.get_topology_elements()
-        index = self._node_id_from_name(router_name, topology_info)
+        index = self.node_index(router_name)
         if not isinstance(index, int):
             output = 'Could not find device \'{}\''.format(router_name)
             logger.error(output)
@@ -285,19 +296,12 @@ class NorthstarTrigger(object):
         :return: Message saying that the maintenance was deleted
         :rtype: str
         """
-        maintenance_list = self.get_maintenance_list()
-        maintenance_index = None
-        maintenance_name = None
-
-        for maintenance in maintenance_list:
-            if event_name == maintenance['name']:
-                maintenance_index = maintenance['maintenanceIndex']
-                maintenance_info = maintenance
-                maintenance_name = maintenance['name']
-
-        if maintenance_name:
-            self.update_maintenance('cancelled', maintenance_index, maintenance_info)
-            self.update_maintenance('deleted', maintenance_index, maintenance_info)
+        maintenance = self.find_maintenance(event_name, fresh=True)
+        if maintenance is not None:
+            # Copied, as update_maintenance changes the status of the maintenance it is given
+            maintenance_info = dict(maintenance)
+            self.update_maintenance('cancelled', maintenance_info['maintenanceIndex'], maintenance_info)
+            self.update_maintenance('deleted', maintenance_info['maintenanceIndex'], maintenance_info)
 
         return '{} has been deleted'.format(event_name), True
 
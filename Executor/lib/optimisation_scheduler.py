@@ -0,0 +1,129 @@
+import logging
+import threading
+import time
+from collections import deque
+
+# Constants
+OPTIMISATION_WINDOW = 10  # seconds during which requests are collapsed into one optimisation
+OPTIMISATION_TIMEOUT = 120  # seconds a request waits for its optimisation after the window closed
+HISTORY_SIZE = 100  # Optimisations kept for stats
+
+# Logging
+logger = logging.getLogger(__name__)
+
+
+class _Optimisation(object):
+    def __init__(self, due):
+        self.due = due
+        self.requests = 0
+        self.requested = time.time()
+        self.started = None
+        self.finished = None
+        self.result = None
+        self.done = threading.Event()
+
+
+class OptimisationScheduler(object):
+    def __init__(self, optimise, window=OPTIMISATION_WINDOW, timeout=OPTIMISATION_TIMEOUT):
+        """Collapses the path optimisations requested by plans into as few
+        NorthStar calls as possible
+
+        The first request opens a window of window seconds, every request made
+        before it closes waits for the same optimisation and gets its result.
+        Only one optimisation runs at a time: requests made while one is in
+        flight are collapsed into the next one, which starts once it finished,
+        as the network may have changed since the first one started.
+
+        A request gives up after window + timeout seconds, which covers the wait
+        for the one in flight, so a hung NorthStar call cannot block the plans
+        forever. The optimisation itself still runs and is reported in stats.
+
+        :param optimise: Runs one optimisation and returns (output, status),
+                         eg. NorthstarTrigger.trigger_path_optimisation
+        :type optimise: callable
+        :param window: Seconds during which requests are collapsed
+        :type window: float
+        :param timeout: Seconds a request waits for its optimisation after the window closed
+        :type timeout: float
+        """
+        self.optimise = optimise
+        self.window = window
+        self.timeout = timeout
+        self._pending = None
+        self._in_flight = None
+        self._history = deque(maxlen=HISTORY_SIZE)
+        self._calls = 0
+        self._requests = 0
+        self._timeouts = 0
+        self._condition = threading.Condition()
+        thread = threading.Thread(name='OptimisationScheduler', target=self._run)
+        thread.daemon = True
+        thread.start()
+
+    def request(self):
+        """Requests a path optimisation and waits for the one it was collapsed into
+
+        :return: The output and [True] if the optimisation succeeded, an error and
+                 [False] if it did not finish in time
+        :rtype: tuple
+        """
+        with self._condition:
+            if self._pending is None:
+                self._pending = _Optimisation(time.time() + self.window)
+                self._condition.notify()
+            optimisation = self._pending
+            optimisation.requests += 1
+            self._requests += 1
+        if not optimisation.done.wait(self.window + self.timeout):
+            with self._condition:
+                self._timeouts += 1
+            logger.error('Path optimisation did not finish within %s seconds', self.window + self.timeout)
+            return {'Error': 'Path optimisation did not finish within {} seconds'
+                    .format(self.window + self.timeout)}, False
+        return optimisation.result
+
+    def stats(self):
+        """Number of requests, NorthStar calls and timed out requests so far, the state of the
+        current optimisations, and how many requests each recent call absorbed
+
+        :rtype: dict
+        """
+        with self._condition:
+            return {
+                'requests': self._requests,
+                'calls': self._calls,
+                'timeouts': self._timeouts,
+                'in_flight': self._in_flight.requests if self._in_flight else 0,
+                'pending': self._pending.requests if self._pending else 0,
+                'recent': list(self._history),
+            }
+
+    def _run(self):
+        while True:
+            with self._condition:
+                while self._pending is None or time.time() < self._pending.due:
+                    self._condition.wait(None if self._pending is None else self._pending.due - time.time())
+                optimisation, self._pending = self._pending, None
+                self._in_flight = optimisation
+                self._calls += 1
+
+            logger.info('Running path optimisation for %s requests', optimisation.requests)
+            optimisation.started = time.time()
+            try:
+                optimisation.result = self.optimise()
+            except Exception as e:
+                logger.exception('Path optimisation failed: %s', e)
+                optimisation.result = ({'Error': 'Could not trigger path optimisation, {}'.format(e)}, False)
+            optimisation.finished = time.time()
+
+            with self._condition:
+                self._in_flight = None
+                self._history.append({
+                    'requests': optimisation.requests,
+                    'absorbed': optimisation.requests - 1,
+                    'requested': optimisation.requested,
+                    'started': optimisation.started,
+                    'finished': optimisation.finished,
+                    'status': optimisation.result[1],
+                })
+            optimisation.done.set()
@@ -0,0 +1,203 @@
+import logging
+import threading
+import time
+from contextlib import contextmanager
+
+import yaml
+from jnpr.junos import Device
+from jnpr.junos.exception import ConnectError
+
+# Constants
+DEVICES_FILE = 'config/devices.yaml'
+IDLE_TIMEOUT = 600  # seconds after which an unused session is closed
+PROBE_INTERVAL = 60  # seconds between health probes of a session
+PROBE_TIMEOUT = 5  # seconds
+
+# Logging
+logger = logging.getLogger(__name__)
+
+
+class _Session(object):
+    def __init__(self):
+        self.device = None
+        self.lock = threading.RLock()
+        self.last_used = 0
+        self.last_checked = 0
+
+
+class SessionPool(object):
+    def __init__(self, config_path=DEVICES_FILE, device_factory=Device,
+                 idle_timeout=IDLE_TIMEOUT, probe_interval=PROBE_INTERVAL):
+        """One NETCONF session per network device, shared by every trigger
+
+        Sessions are opened the first time a device is used, probed before use
+        when they were not checked for probe_interval seconds, reopened when
+        they turn out to be closed or unreachable, and closed after idle_timeout
+        seconds without use by a maintenance thread.
+
+        :param config_path: Location of the credentials for each network device
+        :type config_path: str
+        :param device_factory: Creates the device objects, called with the same arguments
+                               as jnpr.junos.Device (eg. the collector's DeviceSimulator),
+                               defaults to Device
+        :type device_factory: callable, optional
+        :param idle_timeout: Seconds after which an unused session is closed
+        :type idle_timeout: float
+        :param probe_interval: Seconds between health probes of a session
+        :type probe_interval: float
+        """
+        self.device_factory = device_factory
+        self.idle_timeout = idle_timeout
+        self.probe_interval = probe_interval
+        self.network_devices = {}
+        self._sessions = {}
+        self._lock = threading.Lock()
+        self._connects = 0
+        self._reconnects = 0
+        self._evictions = 0
+
+        self._import_network_devices(config_path)
+        thread = threading.Thread(name='SessionPool', target=self._maintain)
+        thread.daemon = True
+        thread.start()
+
+    def _import_network_devices(self, network_device_file):
+        """Import the hostnames, username and password for each network device
+
+        :param network_device_file: Location of the credentials for each network device
+        :type network_device_file: str
+        """
+        logger.debug('Loading network devices into SessionPool')
+        with open(network_device_file, 'r') as f:
+            import_devices = yaml.safe_load(f.read())
+
+        for device in import_devices['devices']:
+            self.network_devices[device['name']] = device
+            logger.debug('Imported credentials for %s', device['name'])
+
+    def get(self, device_name):
+        """Gets the open device, for callers which only need it to open their
+        own connections (eg. StartShell)
+
+        :param device_name: Name of the network device
+        :type device_name: str
+        :raises KeyError: If the device is not in the devices file
+        :raises ConnectError: If the device cannot be connected to
+        :rtype: jnpr.junos.Device
+        """
+        session = self._session(device_name)
+        with session.lock:
+            return self._open(device_name, session)
+
+    @contextmanager
+    def session(self, device_name):
+        """Borrows the NETCONF session of a device, one caller at a time, as
+        NETCONF sessions cannot be shared by threads
+
+            with pool.session('P1') as dev:
+                dev.cli('show version')
+
+        A session that fails with a ConnectError is closed, so the next caller
+        reconnects.
+
+        :param device_name: Name of the network device
+        :type device_name: str
+        :raises KeyError: If the device is not in the devices file
+        :raises ConnectError: If the device cannot be connected to
+        """
+        session = self._session(device_name)
+        with session.lock:
+            device = self._open(device_name, session)
+            try:
+                yield device
+            except ConnectError:
+                self._close(session)
+                raise
+            finally:
+                session.last_used = time.time()
+
+    def stats(self):
+        """Number of open sessions and of connects, reconnects and evictions so far
+
+        :rtype: dict
+        """
+        with self._lock:
+            open_sessions = sum(1 for session in self._sessions.values() if session.device is not None)
+        return {'open': open_sessions, 'connects': self._connects,
+                'reconnects': self._reconnects, 'evictions': self._evictions}
+
+    def close_all(self):
+        """Closes every session"""
+        with self._lock:
+            sessions = list(self._sessions.values())
+        for session in sessions:
+            with session.lock:
+                self._close(session)
+
+    def _session(self, device_name):
+        if device_name not in self.network_devices:
+            raise KeyError('Unknown network device {}'.format(device_name))
+        with self._lock:
+            session = self._sessions.get(device_name)
+            if session is None:
+                session = self._sessions[device_name] = _Session()
+            return session
+
+    def _open(self, device_name, session):
+        # Called with the session lock held
+        if session.device is not None and not self._healthy(session):
+            logger.info('Session to %s is down, reconnecting', device_name)
+            self._close(session)
+            self._reconnects += 1
+        if session.device is None:
+            config = self.network_devices[device_name]
+            logger.debug('Connecting to %s', config['ip'])
+            device = self.device_factory(host=config['ip'], user=config['user'], password=config['password'])
+            device.open()
+            logger.info('Successfully connected to %s', config['ip'])
+            session.device = device
+            session.last_checked = time.time()
+            self._connects += 1
+        session.last_used = time.time()
+        return session.device
+
+    def _healthy(self, session):
+        if not getattr(session.device, 'connected', True):
+            return False
+        if time.time() - session.last_checked < self.probe_interval:
+            return True
+        session.last_checked = time.time()
+        probe = getattr(session.device, 'probe', None)
+        return probe is None or probe(timeout=PROBE_TIMEOUT)
+
+    @staticmethod
+    def _close(session):
+        device, session.device = session.device, None
+        if device is None:
+            return
+        try:
+            device.close()
+        except Exception as e:
+            logger.debug('Could not close %s cleanly: %s', device, e)
+
+    def _maintain(self):
+        while True:
+            time.sleep(min(self.probe_interval, self.idle_timeout))
+            with self._lock:
+                sessions = list(self._sessions.items())
+            for device_name, session in sessions:
+                # Sessions in use are left alone until the next round
+                if not session.lock.acquire(False):
+                    continue
+                try:
+                    if session.device is None:
+                        continue
+                    if time.time() - session.last_used > self.idle_timeout:
+                        logger.info('Closing idle session to %s', device_name)
+                        self._close(session)
+                        self._evictions += 1
+                    elif not self._healthy(session):
+                        logger.info('Session to %s failed its probe, closing it', device_name)
+                        self._close(session)
+                finally:
+                    session.lock.release()
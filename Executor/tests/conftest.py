@@ -0,0 +1,5 @@
+import os
+import sys
+
+# The Executor is run from its own folder, so its modules are imported as lib.*
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -0,0 +1,93 @@
+import threading
+
+from lib.command_plan import PlanRunner, build_dependencies
+
+
+def show(device):
+    return {'type': 'cli', 'cmd': 'show interfaces terse', 'args': device}
+
+
+def backup(device):
+    return {'type': 'junos_backup', 'cmd': 'backup.config', 'args': device}
+
+
+def load_config(device):
+    return {'type': 'junos', 'cmd': 'load.config', 'args': {'device': device, 'config_name': 'hostname.down.conf'}}
+
+
+def maintenance(device):
+    return {'type': 'northstar', 'cmd': 'create.device.maintenance', 'args': device}
+
+
+OPTIMISATION = {'type': 'northstar', 'cmd': 'trigger.optimisation', 'args': 'None'}
+
+
+def test_reads_of_a_device_run_together():
+    assert build_dependencies([show('P1'), show('P1'), backup('P1')]) == [set(), set(), set()]
+
+
+def test_reads_wait_for_the_last_write_to_their_device():
+    commands = [show('P1'), load_config('P1'), show('P1'), backup('P1')]
+    assert build_dependencies(commands) == [set(), {0}, {1}, {1}]
+
+
+def test_writes_wait_for_every_earlier_command_on_their_device():
+    commands = [show('P1'), backup('P1'), load_config('P1'), maintenance('P1')]
+    assert build_dependencies(commands) == [set(), set(), {0, 1}, {0, 1, 2}]
+
+
+def test_devices_are_independent():
+    commands = [load_config('P1'), load_config('P2'), show('P2'), show('P1')]
+    assert build_dependencies(commands) == [set(), set(), {1}, {0}]
+
+
+def test_optimisation_is_a_barrier():
+    commands = [show('P1'), load_config('P2'), maintenance('P1'), OPTIMISATION, show('P1'), load_config('P2')]
+    assert build_dependencies(commands) == [set(), set(), {0}, {0, 1, 2}, {3}, {3}]
+
+
+def test_consecutive_barriers_wait_for_each_other():
+    commands = [OPTIMISATION, OPTIMISATION, show('P1')]
+    assert build_dependencies(commands) == [set(), {0}, {1}]
+
+
+def test_plan_runs_the_barrier_after_every_earlier_command():
+    commands = [show('P1'), load_config('P2'), maintenance('P1'), OPTIMISATION, show('P2')]
+    finished = []
+    lock = threading.Lock()
+    done = threading.Event()
+
+    def run_command(command):
+        with lock:
+            if command is OPTIMISATION:
+                assert len(finished) == 3
+            finished.append(command)
+        return 'output', True
+
+    results = []
+
+    def on_complete(plan_results):
+        results.extend(plan_results)
+        done.set()
+
+    PlanRunner(max_workers=4).submit(commands, run_command, on_complete)
+    assert done.wait(5)
+    assert finished.index(OPTIMISATION) == 3
+    assert finished[-1] == show('P2')
+    assert results == [('output', True)] * len(commands)
+
+
+def test_plan_collects_exceptions_as_results():
+    done = threading.Event()
+    results = []
+
+    def run_command(command):
+        raise RuntimeError('device unreachable')
+
+    def on_complete(plan_results):
+        results.extend(plan_results)
+        done.set()
+
+    PlanRunner(max_workers=2).submit([show('P1'), show('P1')], run_command, on_complete)
+    assert done.wait(5)
+    assert all(isinstance(result, RuntimeError) for result in results)
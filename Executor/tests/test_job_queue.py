@@ -0,0 +1,138 @@
+import json
+import os
+import shutil
+from queue import Empty, Queue
+
+import pytest
+
+from lib.job_queue import RETRY_AFTER, JobQueue, QueueFull, plan_lane
+
+WAIT = 5  # seconds
+
+
+def show(device):
+    return {'type': 'cli', 'cmd': 'show interfaces terse', 'args': device}
+
+
+def load_config(device):
+    return {'type': 'junos', 'cmd': 'load.config', 'args': {'device': device, 'config_name': 'hostname.down.conf'}}
+
+
+@pytest.fixture
+def started():
+    return Queue()
+
+
+def make_queue(tmp_path, started, **kwargs):
+    return JobQueue(started.put, path=str(tmp_path / 'jobs.db'), **kwargs)
+
+
+def next_started(started):
+    return started.get(timeout=WAIT)['job_id']
+
+
+def assert_nothing_started(started):
+    with pytest.raises(Empty):
+        started.get(timeout=0.2)
+
+
+def test_plan_lane():
+    assert plan_lane([show('P1'), {'type': 'junos_backup', 'cmd': 'backup.config', 'args': 'P1'}]) == 'informational'
+    assert plan_lane([show('P1'), load_config('P1')]) == 'critical'
+
+
+def test_critical_lane_is_served_first(tmp_path, started):
+    queue = make_queue(tmp_path, started, max_running=1)
+    queue.submit('running', 'Running', '[]', [load_config('P1')])
+    assert next_started(started) == 'running'
+
+    queue.submit('show', 'Show', '[]', [show('P2')])
+    queue.submit('remediation', 'Remediation', '[]', [load_config('P3')])
+    assert queue.get('show')['position'] == 0
+    assert queue.stats()['queued'] == {'critical': 1, 'informational': 1}
+    assert_nothing_started(started)
+
+    queue.finish('running', 'completed', [])
+    assert next_started(started) == 'remediation'
+    queue.finish('remediation', 'completed', [])
+    assert next_started(started) == 'show'
+
+
+def test_busy_device_does_not_hold_back_other_jobs(tmp_path, started):
+    queue = make_queue(tmp_path, started, max_running=8, max_per_device=1)
+    queue.submit('first', 'P1 Interface Down', '[]', [load_config('P1')])
+    queue.submit('second', 'P1 Interface Up', '[]', [load_config('P1')])
+    queue.submit('other', 'P2 Interface Down', '[]', [load_config('P2')])
+    assert next_started(started) == 'first'
+    assert next_started(started) == 'other'
+    assert_nothing_started(started)
+    assert queue.get('second')['status'] == 'queued'
+    assert queue.stats()['running_devices'] == ['P1', 'P2']
+
+    queue.finish('first', 'completed', [])
+    assert next_started(started) == 'second'
+
+
+def test_full_lane_raises_queue_full(tmp_path, started):
+    queue = make_queue(tmp_path, started, max_running=1, max_queued={'critical': 2, 'informational': 1})
+    queue.submit('running', 'Running', '[]', [load_config('P1')])
+    assert next_started(started) == 'running'
+
+    queue.submit('show', 'Show', '[]', [show('P1')])
+    with pytest.raises(QueueFull):
+        queue.submit('show-2', 'Show', '[]', [show('P2')])
+    # The lanes are limited separately
+    queue.submit('critical-1', 'Critical', '[]', [load_config('P2')])
+    queue.submit('critical-2', 'Critical', '[]', [load_config('P3')])
+    with pytest.raises(QueueFull):
+        queue.submit('critical-3', 'Critical', '[]', [load_config('P4')])
+    assert queue.get('show-2') is None
+
+
+def test_unknown_lane_is_refused(tmp_path, started):
+    queue = make_queue(tmp_path, started)
+    with pytest.raises(ValueError):
+        queue.submit('job', 'Job', '[]', [show('P1')], lane='urgent')
+
+
+def test_running_jobs_are_interrupted_by_a_restart(tmp_path, started):
+    queue = make_queue(tmp_path, started)
+    queue.submit('job', 'Job', '[]', [load_config('P1')])
+    assert next_started(started) == 'job'
+
+    restarted = make_queue(tmp_path, Queue())
+    assert restarted.get('job')['status'] == 'interrupted'
+
+
+@pytest.fixture
+def executor(tmp_path, monkeypatch, started):
+    """The Executor app, started in a copy of its config folder, with a
+    JobQueue whose critical lane holds a single job
+    """
+    pytest.importorskip('jnpr.junos')
+    executor_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    shutil.copytree(os.path.join(executor_dir, 'config'), str(tmp_path / 'config'))
+    # The devices file is shipped empty, nothing is connected to in these tests
+    (tmp_path / 'config' / 'devices.yaml').write_text('devices: []\n')
+    (tmp_path / 'backups').mkdir()
+    monkeypatch.chdir(str(tmp_path))
+    import executor
+    monkeypatch.setattr(executor, 'jobs', make_queue(tmp_path, started, max_running=1,
+                                                     max_queued={'critical': 1, 'informational': 1}))
+    return executor
+
+
+def test_full_lane_answers_429_with_retry_after(executor, started):
+    client = executor.app.test_client()
+    data = {'commands': json.dumps([load_config('P1')]), 'evaluation_name': 'P1 Interface Down',
+            'binded_events': '[]'}
+
+    running = client.post('/exec_command', data=data)
+    assert running.status_code == 202
+    assert next_started(started) == running.get_json()['job_id']
+    assert client.post('/exec_command', data=data).status_code == 202
+
+    refused = client.post('/exec_command', data=data)
+    assert refused.status_code == 429
+    assert refused.headers['Retry-After'] == str(RETRY_AFTER)
+    assert 'critical' in refused.get_json()['Error']
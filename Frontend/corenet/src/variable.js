@@ -1 +1,2 @@
 export const host = 'http://0.0.0.0:5000/'
+export const streamRetryDelay = 10000 // ms before reconnecting a refused /stream, the Database's STREAM_RETRY_AFTER
@@ -0,0 +1,283 @@
+"""End-to-end benchmark of the collector -> Database -> Evaluator -> Executor pipeline
+
+Every scale runs in its own process with a fresh temporary database:
+
+1. The Database app is served in-process on a free port, or --database-url points
+   at a Database started as in production (gunicorn, see start_corenet.sh).
+2. Synthetic devices each report an interface failure, oper_status.interface.down
+   and admin_status.interface.down, posted to /create_event (DBCreateEvent) by a
+   pool of sender threads, like a collector per group of devices.
+3. An Evaluator with one 'Interface Down' rule per device follows the event feed
+   and runs Evaluator._evaluate_events every --evaluation-interval seconds.
+4. A stub Executor records when each execution arrives.
+
+For each scale it reports the ingest rate, the p50/p99 latency from the second
+event of a failure being stored to its execution reaching the Executor, the
+failures that were never executed and the peak RSS of the process. The results are written as JSON so runs can be compared.
+
+    python bench_pipeline.py --scales 10,1000,100000 --output results.json
+"""
+import argparse
+import json
+import logging
+import multiprocessing
+import os
+import platform
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from socketserver import ThreadingMixIn
+
+import requests
+import yaml
+from requests.adapters import HTTPAdapter
+
+BENCHMARKS_DIRECTORY = os.path.dirname(os.path.abspath(__file__))
+REPOSITORY_DIRECTORY = os.path.dirname(BENCHMARKS_DIRECTORY)
+
+# Constants
+HOST = '127.0.0.1'
+SENDERS = 4  # Threads posting events, like several collectors
+EVALUATION_INTERVAL = 0.5  # seconds, the Evaluator itself waits 20s between evaluations
+EXECUTION_TIMEOUT = 600  # seconds to wait for the last execution
+QUIET_PERIOD = 5  # seconds without new executions after which the rest count as missed
+FAILURE_EVENTS = ('oper_status.interface.down.{}', 'admin_status.interface.down.{}')
+
+
+class _ThreadingHTTPServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+
+class StubExecutor(object):
+    def __init__(self):
+        """Executor that only records when each execution arrived"""
+        self.executions = {}
+        self._lock = threading.Lock()
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_POST(self):
+                body = json.loads(self.rfile.read(int(self.headers['Content-Length'])))
+                with stub._lock:
+                    stub.executions.setdefault(body['evaluation_name'], time.time())
+                self.send_response(200)
+                self.send_header('Content-Length', '0')
+                self.end_headers()
+
+            def log_message(self, *args):
+                pass
+
+        self.server = _ThreadingHTTPServer((HOST, 0), Handler)
+        self.url = 'http://{}:{}/exec_command'.format(HOST, self.server.server_address[1])
+        thread = threading.Thread(target=self.server.serve_forever)
+        thread.daemon = True
+        thread.start()
+
+
+def _serve_database():
+    # Imported here, after changing into the temporary directory, since db_core
+    # creates core.db in the working directory when it is imported
+    sys.path.insert(0, os.path.join(REPOSITORY_DIRECTORY, 'Database'))
+    import db_core
+    from werkzeug.serving import make_server
+
+    server = make_server(HOST, 0, db_core.app, threaded=True)
+    thread = threading.Thread(target=server.serve_forever)
+    thread.daemon = True
+    thread.start()
+    return 'http://{}:{}'.format(HOST, server.server_port)
+
+
+def _write_evaluation_config(device_names):
+    configs = []
+    links = []
+    for device_name in device_names:
+        for state in ('Down', 'Up'):
+            configs.append({
+                'name': '{} Interface {}'.format(device_name, state),
+                'events': [event.format(device_name).replace('.down.', '.{}.'.format(state.lower()))
+                           for event in FAILURE_EVENTS],
+                'commands': [{'type': 'cli', 'cmd': 'show interfaces terse', 'args': device_name}],
+            })
+        links.append({1: '{} Interface Up'.format(device_name), 2: '{} Interface Down'.format(device_name),
+                      'default': 1})
+    with open('evaluation_config.yaml', 'w') as f:
+        yaml.safe_dump(configs, f)
+    with open('evaluation_link.yaml', 'w') as f:
+        yaml.safe_dump(links, f)
+
+
+def _percentile(values, percentile):
+    if not values:
+        return None
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * percentile))]
+
+
+def run_scale(devices, evaluation_interval, senders, database_url=None):
+    """Runs the pipeline for a number of devices in the current process
+
+    :param database_url: URL of a running Database, None to serve one in-process
+    :type database_url: str, optional
+    :return: Results of the scale
+    :rtype: dict
+    """
+    if database_url is None:
+        database_url = _serve_database()
+    executor = StubExecutor()
+
+    sys.path.insert(0, os.path.join(REPOSITORY_DIRECTORY, 'Evaluator'))
+    import evaluate
+
+    # After the imports, as the services set their own log levels
+    for name in ('', 'db_core', 'db_schema', 'db_retention', 'werkzeug'):
+        logging.getLogger(name).setLevel(logging.WARNING)
+    # The Evaluator logs an error for every evaluation without new events
+    logging.getLogger('evaluate').setLevel(logging.CRITICAL)
+    device_names = ['sim-{:06d}'.format(i) for i in range(devices)]
+    _write_evaluation_config(device_names)
+    evaluate.Evaluator.get_events_since_url = '{}/get_events_since'.format(database_url)
+    evaluate.Evaluator.execution_url = executor.url
+    evaluator = evaluate.Evaluator(autostart=False)
+    evaluator.evaluate_once()  # Starts the feed at the current head
+
+    stop = threading.Event()
+
+    def evaluate_loop():
+        while not stop.is_set():
+            evaluator.evaluate_once()
+            stop.wait(evaluation_interval)
+
+    evaluator_thread = threading.Thread(target=evaluate_loop)
+    evaluator_thread.daemon = True
+    evaluator_thread.start()
+
+    session = requests.Session()
+    session.mount('http://', HTTPAdapter(pool_connections=senders, pool_maxsize=senders))
+    stored = {}
+    errors = [0]
+
+    def send(device_name):
+        for i, event_name in enumerate(FAILURE_EVENTS):
+            r = session.post('{}/create_event'.format(database_url), data={
+                'uuid': '{}-{}-{}'.format(device_name, i, time.time()),
+                'time': time.strftime('%Y-%m-%dT%H:%M:%S', time.gmtime()),
+                'name': event_name.format(device_name),
+                'type': 'cli',
+                'priority': 'critical',
+                'body': json.dumps({device_name: {'ge-0/0/0': {'admin-status': 'down', 'oper-status': 'down'}}}),
+            })
+            if r.status_code != 201:
+                errors[0] += 1
+        stored[device_name] = time.time()
+
+    start = time.time()
+    with ThreadPoolExecutor(max_workers=senders) as pool:
+        list(pool.map(send, device_names))
+    ingest_duration = time.time() - start
+
+    # Failures whose two events were fetched by different evaluations are never
+    # executed, so stop once no execution arrived for a few evaluations
+    deadline = time.time() + EXECUTION_TIMEOUT
+    quiet_period = max(QUIET_PERIOD, 4 * evaluation_interval)
+    last_count, last_change = -1, time.time()
+    while len(executor.executions) < devices and time.time() < deadline:
+        if len(executor.executions) != last_count:
+            last_count, last_change = len(executor.executions), time.time()
+        elif time.time() - last_change > quiet_period:
+            break
+        time.sleep(0.1)
+    stop.set()
+
+    latencies = []
+    for device_name in device_names:
+        executed = executor.executions.get('{} Interface Down'.format(device_name))
+        if executed is not None:
+            latencies.append(executed - stored[device_name])
+
+    p50 = _percentile(latencies, 0.5)
+    p99 = _percentile(latencies, 0.99)
+    return {
+        'devices': devices,
+        'events': devices * len(FAILURE_EVENTS),
+        'ingest_errors': errors[0],
+        'ingest_seconds': ingest_duration,
+        'events_per_sec': devices * len(FAILURE_EVENTS) / ingest_duration,
+        'executions': len(latencies),
+        'missed_executions': devices - len(latencies),
+        'latency_p50_ms': p50 * 1000 if p50 is not None else None,
+        'latency_p99_ms': p99 * 1000 if p99 is not None else None,
+        'peak_rss_mb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.0,
+    }
+
+
+def _run_scale_process(devices, evaluation_interval, senders, database_url, results):
+    directory = tempfile.mkdtemp()
+    os.chdir(directory)
+    try:
+        results.put(run_scale(devices, evaluation_interval, senders, database_url))
+    except Exception as e:
+        results.put({'devices': devices, 'error': repr(e)})
+    finally:
+        shutil.rmtree(directory, ignore_errors=True)
+
+
+def _git_commit():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', 'HEAD'], cwd=REPOSITORY_DIRECTORY).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+if __name__ == '__main__':
+    arg_parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    arg_parser.add_argument('--scales', default='10,1000,100000', help='Comma separated numbers of devices')
+    arg_parser.add_argument('--evaluation-interval', type=float, default=EVALUATION_INTERVAL,
+                            help='Seconds between evaluations')
+    arg_parser.add_argument('--senders', type=int, default=SENDERS, help='Threads posting events')
+    arg_parser.add_argument('--database-url', help='Running Database to use instead of an in-process one '
+                                                   '(eg. http://127.0.0.1:5000)')
+    arg_parser.add_argument('--output', default='bench_pipeline_results.json', help='JSON file for the results')
+    options = arg_parser.parse_args()
+
+    report = {
+        'benchmark': 'pipeline',
+        'time': time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime()),
+        'commit': _git_commit(),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'evaluation_interval': options.evaluation_interval,
+        'senders': options.senders,
+        'database': options.database_url or 'in-process',
+        'scales': [],
+    }
+
+    print('{:>8} {:>10} {:>12} {:>8} {:>10} {:>10} {:>10}'.format(
+        'devices', 'events/s', 'executions', 'missed', 'p50 ms', 'p99 ms', 'RSS MB'))
+    for scale in [int(scale) for scale in options.scales.split(',')]:
+        result_queue = multiprocessing.Queue()
+        process = multiprocessing.Process(target=_run_scale_process,
+                                          args=(scale, options.evaluation_interval, options.senders,
+                                                options.database_url, result_queue))
+        process.start()
+        result = result_queue.get()
+        process.join()
+        report['scales'].append(result)
+        if 'error' in result:
+            print('{:>8} failed: {}'.format(scale, result['error']))
+            continue
+        if not result['executions']:
+            print('{:>8} no executions'.format(scale))
+            continue
+        print('{devices:>8} {events_per_sec:>10.0f} {executions:>12} {missed_executions:>8} '
+              '{latency_p50_ms:>10.1f} {latency_p99_ms:>10.1f} {peak_rss_mb:>10.1f}'.format(**result))
+
+    with open(options.output, 'w') as f:
+        json.dump(report, f, indent=2, sort_keys=True)
+    print('Results written to {}'.format(options.output))
@@ -0,0 +1,104 @@
+"""Parse time of a get-interface-information (terse) reply from a 1000 interface router
+
+Compares the original per-element lookups of JunosCollector.get_interface_status,
+which compile './/name' style expressions for every field of every interface
+and filter afterwards, with the precompiled RecordExtractor in lib/rpc_extract.py
+which filters on the interface name before reading any other field.
+
+The reply is generated in the same shape as a recorded Junos reply, with the
+whitespace around the text that Junos sends, and can be written out with
+--write-fixture for use elsewhere.
+
+    python bench_rpc_extract.py --interfaces 1000 --repeat 200
+"""
+import argparse
+import os
+import sys
+import time
+
+from lxml import etree
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'Event-Collector'))
+
+from lib.rpc_extract import INTERFACE_STATUS  # noqa: E402
+
+# Constants
+TO_MONITOR = ['ge-0/0/0', 'ge-0/0/1', 'ge-0/0/2', 'ge-0/0/0.0', 'ge-0/0/1.0', 'ge-0/0/2.0']
+
+
+def interface_reply_xml(interfaces):
+    """Builds a get-interface-information terse reply
+
+    :param interfaces: Number of physical interfaces, each with one logical unit
+    :type interfaces: int
+    :rtype: str
+    """
+    parts = ['<interface-information style="terse">']
+    for i in range(interfaces):
+        name = 'ge-{}/{}/{}'.format(i // 400, (i // 40) % 10, i % 40)
+        status = 'down' if i % 7 == 0 else 'up'
+        parts.append(
+            '<physical-interface>\n<name>\n{name}\n</name>\n<admin-status>\nup\n</admin-status>\n'
+            '<oper-status>\n{status}\n</oper-status>\n'
+            '<logical-interface>\n<name>\n{name}.0\n</name>\n<admin-status>\nup\n</admin-status>\n'
+            '<oper-status>\n{status}\n</oper-status>\n<filter-information>\n</filter-information>\n'
+            '<address-family>\n<address-family-name>\ninet\n</address-family-name>\n'
+            '<interface-address>\n<ifa-local>\n10.{a}.{b}.1/30\n</ifa-local>\n</interface-address>\n'
+            '</address-family>\n</logical-interface>\n</physical-interface>'
+            .format(name=name, status=status, a=i // 256, b=i % 256))
+    parts.append('</interface-information>')
+    return ''.join(parts)
+
+
+def original_extract(rpc_reply):
+    interface_status = {}
+    logical_interfaces = rpc_reply.xpath('//physical-interface|//logical-interface')
+    for logical_interface in logical_interfaces:
+        name = logical_interface.xpath('.//name')[0].text.replace('\n', '')
+        if name not in TO_MONITOR:
+            continue
+        admin_status = logical_interface.xpath('.//admin-status')[0].text.replace('\n', '')
+        oper_status = logical_interface.xpath('.//oper-status')[0].text.replace('\n', '')
+        interface_status[name] = {
+            'admin-status': admin_status,
+            'oper-status': oper_status,
+        }
+    return interface_status
+
+
+def extractor_extract(rpc_reply, include=frozenset(TO_MONITOR)):
+    return INTERFACE_STATUS.extract_by_key(rpc_reply, include=include)
+
+
+def _measure(fn, rpc_reply, repeat):
+    latencies = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn(rpc_reply)
+        latencies.append(time.perf_counter() - start)
+    latencies.sort()
+    return {
+        'p50_ms': latencies[len(latencies) // 2] * 1000,
+        'p99_ms': latencies[int(len(latencies) * 0.99)] * 1000,
+    }
+
+
+if __name__ == '__main__':
+    arg_parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    arg_parser.add_argument('--interfaces', type=int, default=1000, help='Physical interfaces in the reply')
+    arg_parser.add_argument('--repeat', type=int, default=200, help='Parses per method')
+    arg_parser.add_argument('--write-fixture', help='Also write the reply XML to this file')
+    options = arg_parser.parse_args()
+
+    xml = interface_reply_xml(options.interfaces)
+    if options.write_fixture:
+        with open(options.write_fixture, 'w') as f:
+            f.write(xml)
+    reply = etree.fromstring(xml)
+
+    if original_extract(reply) != extractor_extract(reply):
+        sys.exit('The extractor does not return the same records as the original code')
+
+    print('{:<10} {:>10} {:>10}'.format('method', 'p50 ms', 'p99 ms'))
+    for method, fn in (('original', original_extract), ('extractor', extractor_extract)):
+        print('{:<10} {p50_ms:>10.2f} {p99_ms:>10.2f}'.format(method, **_measure(fn, reply, options.repeat)))
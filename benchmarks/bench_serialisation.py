@@ -0,0 +1,125 @@
+"""Response latency of the 100 row /get_events_last read path
+
+Compares the original path, which loads ORM objects and decodes every stored
+body with json.loads only for Flask to encode it again, with the current path,
+which splices the stored JSON text into the response. The current path is
+measured with an empty fragment cache (every request serialises its rows) and
+with a warm one (rows already serialised by an earlier request).
+
+    python bench_serialisation.py --requests 2000
+"""
+import argparse
+import json
+import os
+import shutil
+import sys
+import tempfile
+import time
+import uuid
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'Database'))
+
+from sqlalchemy.orm import sessionmaker  # noqa: E402
+
+import db_serialise  # noqa: E402
+from db_models import Event, db  # noqa: E402
+from db_serialise import event_fragment, json_array  # noqa: E402
+from db_storage import create_read_engine  # noqa: E402
+
+# Constants
+DATABASE_NAME = 'bench.db'
+ROWS = 1000
+LIMIT = 100  # Rows returned by /get_events_last
+
+
+def _body(i):
+    # About the size of a get_interface_status body for a small device
+    return json.dumps({'P{}'.format(i % 10): {'ge-0/0/{}'.format(port): {'admin-status': 'up', 'oper-status': 'up'}
+                                              for port in range(24)}})
+
+
+def _populate(engine):
+    db.Model.metadata.create_all(engine)
+    now = time.time()
+    engine.execute(Event.__table__.insert(), [{
+        'uuid': str(uuid.uuid4()),
+        'time': '2019-03-01T10:11:12.123456',
+        'timestamp': now + i,
+        'seq': i + 1,
+        'name': 'oper_status.interface.up.P{}'.format(i % 10),
+        'type': 'cli',
+        'priority': 'information',
+        'body': _body(i),
+    } for i in range(ROWS)])
+
+
+def original_path(session):
+    queries = session.query(Event).order_by(Event.timestamp.desc()).limit(LIMIT).all()
+    output = [{
+        'uuid': query.uuid,
+        'time': query.time,
+        'name': query.name,
+        'type': query.type,
+        'priority': query.priority,
+        'body': json.loads(query.body)
+    } for query in queries]
+    return json.dumps(output)
+
+
+def spliced_path(engine):
+    event = Event.__table__
+    rows = engine.execute(event.select().order_by(event.c.timestamp.desc()).limit(LIMIT)).fetchall()
+    return json_array([event_fragment(row) for row in rows])
+
+
+def _measure(fn, requests, before_each=None):
+    latencies = []
+    for _ in range(requests):
+        if before_each is not None:
+            before_each()
+        start = time.perf_counter()
+        fn()
+        latencies.append(time.perf_counter() - start)
+    latencies.sort()
+    return {
+        'p50_ms': latencies[len(latencies) // 2] * 1000,
+        'p99_ms': latencies[int(len(latencies) * 0.99)] * 1000,
+        'requests_per_sec': requests / sum(latencies),
+    }
+
+
+def run(requests):
+    """Runs every read path against the same database
+
+    :return: Path name to its latency results
+    :rtype: dict
+    """
+    directory = tempfile.mkdtemp()
+    try:
+        engine = create_read_engine(os.path.join(directory, DATABASE_NAME))
+        _populate(engine)
+        session = sessionmaker(bind=engine)()
+
+        results = {}
+        results['original'] = _measure(lambda: original_path(session), requests,
+                                       before_each=session.expunge_all)
+        results['spliced cold'] = _measure(lambda: spliced_path(engine), requests,
+                                           before_each=lambda: db_serialise.event_fragments._fragments.clear())
+        results['spliced warm'] = _measure(lambda: spliced_path(engine), requests)
+
+        assert json.loads(original_path(session))[0]['body'] == json.loads(spliced_path(engine))[0]['body']
+        session.close()
+        engine.dispose()
+    finally:
+        shutil.rmtree(directory)
+    return results
+
+
+if __name__ == '__main__':
+    arg_parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    arg_parser.add_argument('--requests', type=int, default=2000, help='Requests per read path')
+    options = arg_parser.parse_args()
+
+    print('{:<14} {:>10} {:>10} {:>12}'.format('path', 'p50 ms', 'p99 ms', 'requests/s'))
+    for path, result in run(options.requests).items():
+        print('{:<14} {p50_ms:>10.2f} {p99_ms:>10.2f} {requests_per_sec:>12.0f}'.format(path, **result))
@@ -0,0 +1,154 @@
+"""Sustained insert throughput of the Database storage modes with parallel readers
+
+Runs several processes, like gunicorn workers, each with writer threads that
+insert batches of events and reader threads that run the /get_events_last
+query. The 'default' mode writes straight from every thread through the
+original rollback journal engine. The 'wal' mode uses the WAL engine and
+sends every write through the DBWriter.
+
+    python bench_storage.py --duration 10 --processes 4
+"""
+import argparse
+import multiprocessing
+import os
+import shutil
+import sys
+import tempfile
+import threading
+import time
+import uuid
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'Database'))
+
+from sqlalchemy import select  # noqa: E402
+from sqlalchemy.exc import OperationalError  # noqa: E402
+
+from db_models import Event, db  # noqa: E402
+from db_storage import DBWriter, create_read_engine, create_write_engine  # noqa: E402
+
+# Constants
+DATABASE_NAME = 'bench.db'
+BATCH_SIZE = 20  # Events per insert, about one device's worth per cycle
+
+
+def _make_rows(count):
+    now = time.time()
+    return [{
+        'uuid': str(uuid.uuid4()),
+        'time': '2019-03-01T10:11:12.123456',
+        'timestamp': now,
+        'name': 'oper_status.interface.up.P1',
+        'type': 'cli',
+        'priority': 'information',
+        'body': '{"P1": {"ge-0/0/0": {"admin-status": "up", "oper-status": "up"}}}',
+    } for _ in range(count)]
+
+
+def _insert(conn, rows):
+    conn.execute(Event.__table__.insert(), rows)
+
+
+def _worker(mode, database_name, duration, writers, readers, results):
+    read_engine = create_read_engine(database_name, mode)
+    if mode == 'wal':
+        db_writer = DBWriter(create_write_engine(database_name, mode))
+    counters = {'inserted': 0, 'lock_errors': 0, 'reads': 0}
+    read_latencies = []
+    lock = threading.Lock()
+    deadline = time.time() + duration
+
+    def write():
+        while time.time() < deadline:
+            rows = _make_rows(BATCH_SIZE)
+            try:
+                if mode == 'wal':
+                    db_writer.execute(_insert, rows)
+                else:
+                    with read_engine.begin() as conn:
+                        _insert(conn, rows)
+            except OperationalError:
+                with lock:
+                    counters['lock_errors'] += 1
+                continue
+            with lock:
+                counters['inserted'] += len(rows)
+
+    def read():
+        query = select([Event.__table__]).order_by(Event.__table__.c.timestamp.desc()).limit(100)
+        while time.time() < deadline:
+            start = time.time()
+            try:
+                read_engine.execute(query).fetchall()
+            except OperationalError:
+                with lock:
+                    counters['lock_errors'] += 1
+                continue
+            with lock:
+                counters['reads'] += 1
+                read_latencies.append(time.time() - start)
+
+    threads = [threading.Thread(target=write) for _ in range(writers)]
+    threads += [threading.Thread(target=read) for _ in range(readers)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    results.put((counters, read_latencies))
+
+
+def run(mode, duration, processes, writers, readers):
+    """Runs the benchmark for one storage mode
+
+    :return: Aggregated results
+    :rtype: dict
+    """
+    directory = tempfile.mkdtemp()
+    database_name = os.path.join(directory, DATABASE_NAME)
+    try:
+        engine = create_read_engine(database_name, mode)
+        db.Model.metadata.create_all(engine)
+        engine.dispose()
+
+        results = multiprocessing.Queue()
+        workers = [multiprocessing.Process(target=_worker,
+                                           args=(mode, database_name, duration, writers, readers, results))
+                   for _ in range(processes)]
+        for worker in workers:
+            worker.start()
+        totals = {'inserted': 0, 'lock_errors': 0, 'reads': 0}
+        read_latencies = []
+        for _ in workers:
+            counters, latencies = results.get()
+            for name, value in counters.items():
+                totals[name] += value
+            read_latencies.extend(latencies)
+        for worker in workers:
+            worker.join()
+    finally:
+        shutil.rmtree(directory)
+
+    read_latencies.sort()
+    p99 = read_latencies[int(len(read_latencies) * 0.99)] if read_latencies else 0
+    return {
+        'mode': mode,
+        'inserts_per_sec': totals['inserted'] / duration,
+        'reads_per_sec': totals['reads'] / duration,
+        'read_p99_ms': p99 * 1000,
+        'lock_errors': totals['lock_errors'],
+    }
+
+
+if __name__ == '__main__':
+    arg_parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    arg_parser.add_argument('--duration', type=float, default=10, help='Seconds to run each mode for')
+    arg_parser.add_argument('--processes', type=int, default=4, help='Worker processes')
+    arg_parser.add_argument('--writers', type=int, default=4, help='Writer threads per process')
+    arg_parser.add_argument('--readers', type=int, default=4, help='Reader threads per process')
+    arg_parser.add_argument('--modes', default='default,wal', help='Comma separated storage modes')
+    options = arg_parser.parse_args()
+
+    print('{:<8} {:>14} {:>12} {:>12} {:>12}'.format('mode', 'inserts/s', 'reads/s', 'read p99 ms', 'lock errors'))
+    for storage_mode in options.modes.split(','):
+        result = run(storage_mode, options.duration, options.processes, options.writers, options.readers)
+        print('{mode:<8} {inserts_per_sec:>14.0f} {reads_per_sec:>12.0f} {read_p99_ms:>12.1f} {lock_errors:>12}'
+              .format(**result))
@@ -14,6 +14,10 @@ NC='\033[0m'
 echo "${GREEN}Starting Database...${NC}"
 cd Database
 nohup gunicorn --workers=13 --threads=13 --bind 0.0.0.0:5000 --preload db_core:app &
+echo "${YELLOW}Sleeping for 10 seconds ...${NC}"
+sleep 10s
+echo "${GREEN}Starting Database retention...${NC}"
+nohup python db_retention.py &
 cd ..
 echo "${YELLOW}Sleeping for 30 seconds ...${NC}"
 sleep 30s
@@ -31,7 +35,7 @@ echo "${YELLOW}Sleeping for 30 seconds ...${NC}"
 sleep 30s
 echo "${GREEN}Starting Evaluator...${NC}"
 cd Evaluator
-nohup python evaluate.py &
+nohup python rule_engine.py &
 cd ..
 echo "Please start the Frontend manually"
 echo "nohup npm run dev &"
@@ -1,4 +1,6 @@
 kill $(ps aux | grep "[g]unicorn" | awk '{print $2}')
+kill $(ps aux | grep "[p]ython db_retention.py" | awk '{print $2}')
 kill $(ps aux | grep "[p]ython evaluate.py"   | awk '{print $2}')
+kill $(ps aux | grep "[p]ython rule_engine.py" | awk '{print $2}')
 kill $(ps aux | grep "[p]ython collector.py"  | awk '{print $2}')
 kill $(ps aux | grep "[p]ython executor.py"   | awk '{print $2}')